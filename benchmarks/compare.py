@@ -0,0 +1,67 @@
+"""Compare two benchmarks.models result files and flag regressions.
+
+A case regresses when its median got slower by more than the threshold
+and by more than the noise floor in absolute terms. Exits non-zero when
+anything regressed. Run `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import json
+import sys
+from collections import namedtuple
+
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_NOISE_MS = 0.05
+
+Change = namedtuple("Change", ["size", "case", "old_ms", "new_ms", "ratio", "regressed"])
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD, noise_ms=DEFAULT_NOISE_MS):
+    """Return a Change for every (size, case) present in both runs.
+
+    `size` is the dataset size as a string, or "imports" for import times.
+    """
+    changes = []
+    for size, cases in new["results"].items():
+        for case, stats in cases.items():
+            before = old["results"].get(size, {}).get(case)
+            if before is None:
+                continue
+            old_ms, new_ms = before["median_ms"], stats["median_ms"]
+            ratio = new_ms / old_ms if old_ms else float("inf")
+            regressed = ratio > 1 + threshold and new_ms - old_ms > noise_ms
+            changes.append(Change(size, case, old_ms, new_ms, ratio, regressed))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown as a fraction of the old median")
+    parser.add_argument("--noise-ms", type=float, default=DEFAULT_NOISE_MS,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    parser.add_argument("--all", action="store_true", help="print unchanged cases too")
+    args = parser.parse_args(argv)
+
+    changes = compare(load(args.old), load(args.new), args.threshold, args.noise_ms)
+    print(f"{'size':>10}  {'case':<36}{'old ms':>12}{'new ms':>12}{'change':>9}")
+    for change in changes:
+        if not (args.all or change.regressed or change.ratio < 1 / (1 + args.threshold)):
+            continue
+        flag = "  REGRESSED" if change.regressed else ""
+        print(f"{change.size:>10}  {change.case:<36}{change.old_ms:>12.3f}{change.new_ms:>12.3f}"
+              f"{change.ratio - 1:>+9.0%}{flag}")
+
+    regressions = [change for change in changes if change.regressed]
+    print(f"{len(regressions)} regression(s) in {len(changes)} compared cases")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
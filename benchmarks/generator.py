@@ -0,0 +1,149 @@
+"""Deterministic synthetic catalogues for the benchmarks.
+
+Article authors, magazines and title words are drawn from Zipf
+distributions, so a few prolific authors and busy magazines hold most of
+the articles, as in a real catalogue. The same (articles, seed) always
+produces the same database. Run `python -m benchmarks.generator PATH -n 100000`.
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import time
+
+from db.connection import ConnectionPool, set_provider
+from db.changelog import create_changelog
+from db.search import rebuild_search
+from db.stats import rebuild_stats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, "db", "schema.sql")
+
+DEFAULT_SEED = 0
+ZIPF_EXPONENT = 1.1
+VOCABULARY_SIZE = 20000
+TITLE_WORDS = (3, 8)
+CATEGORIES = (
+    "Technology", "Science", "Health", "Business", "Politics", "Culture",
+    "Travel", "Food", "Sport", "Fashion", "Design", "Education",
+)
+BATCH_SIZE = 50000
+
+
+class Zipf:
+    """Draw ranks 0..n-1 with P(k) proportional to 1 / (k + 1) ** s"""
+
+    def __init__(self, n, s=ZIPF_EXPONENT):
+        self.n = n
+        self._cumulative = list(itertools.accumulate((k + 1) ** -s for k in range(n)))
+        self._total = self._cumulative[-1]
+
+    def sample(self, rng, k):
+        cumulative, total, n = self._cumulative, self._total, self.n - 1
+        return [min(bisect.bisect(cumulative, rng.random() * total), n) for _ in range(k)]
+
+
+def counts_for(articles):
+    """Return (authors, magazines) for a catalogue of `articles` articles"""
+    return max(10, articles // 20), max(5, articles // 2000)
+
+
+def _words(rng):
+    #Syllable words so FTS has realistic prefixes to match
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "da", "pe", "go"]
+    words = ["".join(parts) for n in (2, 3, 4) for parts in itertools.product(syllables, repeat=n)]
+    rng.shuffle(words)
+    return words[:VOCABULARY_SIZE]
+
+
+def _split_schema():
+    """Return (tables, indexes) from schema.sql so indexes can follow the load"""
+    with open(SCHEMA) as f:
+        statements = [s.strip() for s in f.read().split(";") if s.strip()]
+    indexes = [s for s in statements if "CREATE INDEX" in s.upper() or "CREATE UNIQUE INDEX" in s.upper()]
+    tables = [s for s in statements if s not in indexes]
+    return ";\n".join(tables) + ";", ";\n".join(indexes) + ";"
+
+
+def generate(path, articles, seed=DEFAULT_SEED):
+    """Build a catalogue of `articles` articles at `path` and return its row counts"""
+    for stale in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    authors, magazines = counts_for(articles)
+    rng = random.Random(seed)
+    vocabulary = _words(rng)
+    #Shuffled so the most prolific author is not always author 1
+    author_ids = list(range(1, authors + 1))
+    magazine_ids = list(range(1, magazines + 1))
+    rng.shuffle(author_ids)
+    rng.shuffle(magazine_ids)
+    author_zipf, magazine_zipf, word_zipf = Zipf(authors), Zipf(magazines), Zipf(len(vocabulary))
+
+    pool = ConnectionPool(path, size=1, profile="bulk-load")
+    previous = set_provider(pool)
+    try:
+        tables, indexes = _split_schema()
+        with pool.connection() as conn:
+            conn.executescript(tables)
+            conn.executemany(
+                "INSERT INTO authors (author_id, name) VALUES (?, ?)",
+                ((i, f"Author {i}") for i in range(1, authors + 1))
+            )
+            conn.executemany(
+                "INSERT INTO magazines (magazine_id, name, category) VALUES (?, ?, ?)",
+                ((i, f"Magazine {i}", CATEGORIES[i % len(CATEGORIES)]) for i in range(1, magazines + 1))
+            )
+            for start in range(0, articles, BATCH_SIZE):
+                size = min(BATCH_SIZE, articles - start)
+                by = author_zipf.sample(rng, size)
+                into = magazine_zipf.sample(rng, size)
+                lengths = rng.choices(range(TITLE_WORDS[0], TITLE_WORDS[1] + 1), k=size)
+                words = word_zipf.sample(rng, sum(lengths))
+                rows = []
+                offset = 0
+                for i in range(size):
+                    title = " ".join(vocabulary[w] for w in words[offset:offset + lengths[i]])
+                    offset += lengths[i]
+                    rows.append((title, author_ids[by[i]], magazine_ids[into[i]]))
+                conn.executemany("INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, ?)", rows)
+            conn.commit()
+
+        #Indexes and derived tables are cheaper to build once than to maintain row by row
+        with pool.connection() as conn:
+            conn.executescript(indexes)
+        rebuild_stats()
+        rebuild_search()
+        #Tracking starts after the load; the first full export sees watermark 0
+        with pool.connection() as conn:
+            create_changelog(conn)
+    finally:
+        set_provider(previous)
+        pool.close()
+    return {"authors": authors, "magazines": magazines, "articles": articles}
+
+
+def parse_size(text):
+    """Parse 10000, 10k or 10m"""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("-n", "--articles", type=parse_size, default=100000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = generate(args.path, args.articles, args.seed)
+    print(f"{counts['articles']:,} articles, {counts['authors']:,} authors, "
+          f"{counts['magazines']:,} magazines in {time.perf_counter() - start:.1f}s")
+    return counts
+
+
+if __name__ == "__main__":
+    main()
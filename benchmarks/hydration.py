@@ -0,0 +1,112 @@
+"""Bytes per instance and rows per second for Article hydration.
+
+"before" rebuilds the original dict-backed Article hydrated from
+sqlite3.Row through __init__; "after" is the current slotted model
+hydrated from plain tuples. Both use a plain dict identity map so only
+hydration is compared; the last rows add the models' default weak identity
+map and the opt-in LRU one.
+Run with `python -m benchmarks.hydration`.
+"""
+import argparse
+import gc
+import sqlite3
+import time
+import tracemalloc
+
+from db.identity import WeakIdentityMap, LRUIdentityMap
+from lib.models.article import Article
+
+
+class DictArticle:
+    all = {}
+
+    def __init__(self, title, author_id, magazine_id, article_id=None):
+        self.article_id = article_id
+        self.title = title
+        self.author_id = author_id
+        self.magazine_id = magazine_id
+
+    @classmethod
+    def instance_from_db(cls, row):
+        article = cls.all.get(row[0])
+        if article:
+            article.title = row[1]
+            article.author_id = row[2]
+            article.magazine_id = row[3]
+        else:
+            article = cls(row[1], row[2], row[3], article_id=row[0])
+            cls.all[article.article_id] = article
+        return article
+
+
+def build_database(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""
+        CREATE TABLE articles (
+            article_id INTEGER PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            author_id INTEGER,
+            magazine_id INTEGER
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, ?)",
+        ((f"Article {i}", i % 997, i % 101) for i in range(rows))
+    )
+    conn.commit()
+    return conn
+
+
+def measure(conn, model, row_factory, rows, identity_map):
+    """Return (bytes per instance, rows per second) for one variant"""
+    conn.row_factory = row_factory
+
+    model.all = identity_map()
+    gc.collect()
+    start = time.perf_counter()
+    instances = [model.instance_from_db(row) for row in conn.execute("SELECT * FROM articles")]
+    rate = rows / (time.perf_counter() - start)
+
+    #Second pass on already fetched rows so only the instances are counted
+    fetched = conn.execute("SELECT * FROM articles").fetchall()
+    del instances
+    model.all = _StrongMap()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [model.instance_from_db(row) for row in fetched]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    overhead = instances.__sizeof__() + model.all.__sizeof__()
+    return (after - before - overhead) / rows, rate
+
+
+class _StrongMap(dict):
+    """Plain dict stand-in so the memory pass measures instances, not map entries"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    conn = build_database(args.rows)
+    previous = Article.all
+    try:
+        results = {
+            "before (dict, sqlite3.Row)": measure(conn, DictArticle, sqlite3.Row, args.rows, dict),
+            "after (slots, tuple)": measure(conn, Article, None, args.rows, dict),
+            "after + weak identity map": measure(conn, Article, None, args.rows, WeakIdentityMap),
+            "after + LRU identity map": measure(conn, Article, None, args.rows, LRUIdentityMap),
+        }
+    finally:
+        Article.all = previous
+    print(f"{'variant':<28}{'bytes/instance':>16}{'rows/sec':>14}")
+    for name, (per_instance, rate) in results.items():
+        print(f"{name:<28}{per_instance:>16.0f}{rate:>14,.0f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
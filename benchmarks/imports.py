@@ -0,0 +1,54 @@
+"""Import time of the model packages, each measured in a fresh interpreter.
+
+Run `python -m benchmarks.imports`; benchmarks.models includes these
+timings in its results so benchmarks.compare tracks them too.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("lib.models", "lib.models.article", "lib.models.author", "lib.models.magazine")
+DEFAULT_RUNS = 7
+
+_PROBE = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def import_time(module):
+    """Seconds a new interpreter spends importing `module`"""
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output)
+
+
+def measure(modules=MODULES, runs=DEFAULT_RUNS):
+    """Return {module: stats in ms} in the same shape as a benchmark case"""
+    results = {}
+    for module in modules:
+        timings = sorted(import_time(module) for _ in range(runs))
+        results[f"import {module}"] = {
+            "calls": runs,
+            "min_ms": timings[0] * 1000,
+            "median_ms": statistics.median(timings) * 1000,
+            "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    args = parser.parse_args(argv)
+
+    results = measure(runs=args.runs)
+    for name, stats in results.items():
+        print(f"{name:<30}{stats['median_ms']:>10.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    main()
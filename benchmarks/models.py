@@ -0,0 +1,398 @@
+"""Time every public model method against generated catalogues.
+
+Each dataset size gets its own database from benchmarks.generator, cached
+between runs. Results are written as JSON; compare two runs with
+`python -m benchmarks.compare`. Run
+`python -m benchmarks.models --sizes 10k,100k,1m --output results.json`.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from benchmarks import generator, imports
+from db.connection import ConnectionPool, fetchall, set_provider
+from lib.models.article import Article
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+
+DEFAULT_SIZES = "10k,100k"
+DEFAULT_MIN_TIME = 0.5
+DEFAULT_MAX_CALLS = 200
+SAMPLE_SIZE = 50
+FORMAT_VERSION = 1
+
+#`setup` builds the argument for one call outside the timed region; `run`
+#is the timed call. Both receive the Context.
+Case = namedtuple("Case", ["name", "run", "setup"], defaults=[None])
+
+
+class Context:
+    """Ids sampled once per dataset, handed out round-robin to the cases"""
+
+    def __init__(self, seed):
+        rng = random.Random(seed)
+        self.ids = {}
+        for table, column in (("articles", "article_id"), ("authors", "author_id"), ("magazines", "magazine_id")):
+            ids = [row[0] for row in fetchall(f"SELECT {column} FROM {table}")]
+            self.ids[column] = rng.sample(ids, min(SAMPLE_SIZE, len(ids)))
+        self.titles = [row[0] for row in fetchall(
+            "SELECT title FROM articles WHERE article_id IN ({})".format(",".join("?" * len(self.ids["article_id"]))),
+            self.ids["article_id"]
+        )]
+        self.words = [title.split()[0] for title in self.titles]
+        self.categories = [row[0] for row in fetchall("SELECT DISTINCT category FROM magazines")]
+        self.created = []
+        self._turn = 0
+        self._names = 0
+
+    def next(self, values):
+        self._turn += 1
+        return values[self._turn % len(values)]
+
+    def article_id(self):
+        return self.next(self.ids["article_id"])
+
+    def author(self):
+        return Author.find_by_id(self.next(self.ids["author_id"]))
+
+    def magazine(self):
+        return Magazine.find_by_id(self.next(self.ids["magazine_id"]))
+
+    def new_article(self):
+        return Article("Benchmark article", self.next(self.ids["author_id"]), self.next(self.ids["magazine_id"]))
+
+    def name(self, prefix):
+        """A fresh name for a write case; author and magazine names are unique"""
+        self._names += 1
+        return f"{prefix} {self._names}"
+
+    def keep(self, *instances):
+        """Remember rows a write case created so they can be deleted afterwards"""
+        self.created.extend(instances)
+        return instances
+
+
+def drain(iterable):
+    count = 0
+    for _ in iterable:
+        count += 1
+    return count
+
+
+def _saved(ctx, instance):
+    instance.save()
+    ctx.keep(instance)
+
+
+def _created_article(ctx):
+    article = ctx.new_article()
+    _saved(ctx, article)
+    return article
+
+
+def _created(new):
+    def setup(ctx):
+        instance = new(ctx)
+        _saved(ctx, instance)
+        return instance
+    return setup
+
+
+CASES = [
+    #Article
+    Case("Article.find_by_id", lambda ctx, _: Article.find_by_id(ctx.article_id())),
+    Case("Article.find_by_title", lambda ctx, _: Article.find_by_title(ctx.next(ctx.titles))),
+    Case("Article.search", lambda ctx, _: Article.search(ctx.next(ctx.words))),
+    Case("Article.get_all", lambda ctx, _: Article.get_all()),
+    Case("Article.iter_all", lambda ctx, _: drain(Article.iter_all())),
+    Case("Article.page", lambda ctx, _: Article.page(order_by="title")),
+    Case("Article.create", lambda ctx, _: ctx.keep(Article.create("Benchmark article", 1, 1))),
+    Case("Article.save", lambda ctx, article: _saved(ctx, article), lambda ctx: ctx.new_article()),
+    Case("Article.create_many", lambda ctx, _: ctx.keep(*Article.create_many(
+        ("Benchmark article", 1, 1) for _ in range(100)
+    ))),
+    Case("Article.bulk_save", lambda ctx, articles: ctx.keep(*Article.bulk_save(articles)),
+         lambda ctx: [ctx.new_article() for _ in range(100)]),
+    Case("Article.update", lambda ctx, article: article.update(), _created_article),
+    Case("Article.delete", lambda ctx, article: article.delete(), _created_article),
+
+    #Author
+    Case("Author.find_by_id", lambda ctx, _: Author.find_by_id(ctx.next(ctx.ids["author_id"]))),
+    Case("Author.find_all_by_id", lambda ctx, _: Author.find_all_by_id(ctx.ids["author_id"][:100])),
+    Case("Author.find_by_name", lambda ctx, author: Author.find_by_name(author.name), lambda ctx: ctx.author()),
+    Case("Author.get_all", lambda ctx, _: Author.get_all()),
+    Case("Author.get_all(prefetch)", lambda ctx, _: Author.get_all(prefetch=["articles", "magazines"])),
+    Case("Author.iter_all", lambda ctx, _: drain(Author.iter_all())),
+    Case("Author.page", lambda ctx, _: Author.page(order_by="name")),
+    Case("Author.top_author", lambda ctx, _: Author.top_author()),
+    Case("Author.articles", lambda ctx, author: author.articles(), lambda ctx: ctx.author()),
+    Case("Author.articles_page", lambda ctx, author: author.articles_page(), lambda ctx: ctx.author()),
+    Case("Author.iter_articles", lambda ctx, author: drain(author.iter_articles()), lambda ctx: ctx.author()),
+    Case("Author.magazines", lambda ctx, author: author.magazines(), lambda ctx: ctx.author()),
+    Case("Author.magazines_for", lambda ctx, _: Author.magazines_for()),
+    Case("Author.iter_magazines", lambda ctx, author: drain(author.iter_magazines()), lambda ctx: ctx.author()),
+    Case("Author.topic_areas", lambda ctx, author: author.topic_areas(), lambda ctx: ctx.author()),
+    Case("Author.topic_areas_for", lambda ctx, _: Author.topic_areas_for()),
+    Case("Author.topic_areas_for(ids)", lambda ctx, _: Author.topic_areas_for(ctx.ids["author_id"])),
+    Case("Author.prefetch", lambda ctx, authors: Author.prefetch(authors, ["articles", "magazines"]),
+         lambda ctx: [ctx.author() for _ in range(20)]),
+    Case("Author.create", lambda ctx, _: ctx.keep(Author.create(ctx.name("Benchmark author")))),
+    Case("Author.save", lambda ctx, author: _saved(ctx, author), lambda ctx: Author(ctx.name("Benchmark author"))),
+    Case("Author.create_many", lambda ctx, _: ctx.keep(*Author.create_many(
+        [ctx.name("Benchmark author") for _ in range(100)]
+    ))),
+    Case("Author.bulk_save", lambda ctx, authors: ctx.keep(*Author.bulk_save(authors)),
+         lambda ctx: [Author(ctx.name("Benchmark author")) for _ in range(100)]),
+    Case("Author.add_article", lambda ctx, pair: ctx.keep(pair[0].add_article(pair[1], "Benchmark article")),
+         lambda ctx: (ctx.author(), ctx.magazine())),
+    Case("Author.add_with_articles", lambda ctx, magazine: ctx.keep(Author.add_with_articles(
+        ctx.name("Benchmark author"), [{"title": "Benchmark article", "magazine_id": magazine.magazine_id}] * 5
+    )), lambda ctx: ctx.magazine()),
+    Case("Author.get_or_create", lambda ctx, _: ctx.keep(Author.get_or_create(ctx.name("Benchmark author")))),
+    Case("Author.get_or_create(existing)", lambda ctx, author: Author.get_or_create(author.name),
+         lambda ctx: ctx.author()),
+    Case("Author.get_or_create_many", lambda ctx, _: ctx.keep(*Author.get_or_create_many(
+        [ctx.name("Benchmark author") for _ in range(100)]
+    ))),
+    Case("Author.update", lambda ctx, author: author.update(),
+         _created(lambda ctx: Author(ctx.name("Benchmark author")))),
+    Case("Author.delete", lambda ctx, author: author.delete(),
+         _created(lambda ctx: Author(ctx.name("Benchmark author")))),
+
+    #Magazine
+    Case("Magazine.find_by_id", lambda ctx, _: Magazine.find_by_id(ctx.next(ctx.ids["magazine_id"]))),
+    Case("Magazine.find_all_by_id", lambda ctx, _: Magazine.find_all_by_id(ctx.ids["magazine_id"][:100])),
+    Case("Magazine.find_by_name", lambda ctx, magazine: Magazine.find_by_name(magazine.name), lambda ctx: ctx.magazine()),
+    Case("Magazine.find_by_category", lambda ctx, _: Magazine.find_by_category(ctx.next(ctx.categories))),
+    Case("Magazine.get_all", lambda ctx, _: Magazine.get_all()),
+    Case("Magazine.get_all_by_category", lambda ctx, _: Magazine.get_all_by_category(ctx.next(ctx.categories))),
+    Case("Magazine.iter_all", lambda ctx, _: drain(Magazine.iter_all())),
+    Case("Magazine.page", lambda ctx, _: Magazine.page(order_by="name")),
+    Case("Magazine.with_multiple_authors", lambda ctx, _: Magazine.with_multiple_authors()),
+    Case("Magazine.article_counts", lambda ctx, _: Magazine.article_counts()),
+    Case("Magazine.most_articles_written", lambda ctx, _: Magazine.most_articles_written()),
+    Case("Magazine.articles", lambda ctx, magazine: magazine.articles(), lambda ctx: ctx.magazine()),
+    Case("Magazine.articles_page", lambda ctx, magazine: magazine.articles_page(), lambda ctx: ctx.magazine()),
+    Case("Magazine.iter_articles", lambda ctx, magazine: drain(magazine.iter_articles()), lambda ctx: ctx.magazine()),
+    Case("Magazine.article_titles", lambda ctx, magazine: magazine.article_titles(), lambda ctx: ctx.magazine()),
+    Case("Magazine.iter_article_titles", lambda ctx, magazine: drain(magazine.iter_article_titles()),
+         lambda ctx: ctx.magazine()),
+    Case("Magazine.authors", lambda ctx, magazine: magazine.authors(), lambda ctx: ctx.magazine()),
+    Case("Magazine.iter_authors", lambda ctx, magazine: drain(magazine.iter_authors()), lambda ctx: ctx.magazine()),
+    Case("Magazine.contributors", lambda ctx, magazine: magazine.contributors(), lambda ctx: ctx.magazine()),
+    Case("Magazine.iter_contributors", lambda ctx, magazine: drain(magazine.iter_contributors()),
+         lambda ctx: ctx.magazine()),
+    Case("Magazine.contributing_authors", lambda ctx, magazine: magazine.contributing_authors(),
+         lambda ctx: ctx.magazine()),
+    Case("Magazine.contributors_for", lambda ctx, _: Magazine.contributors_for()),
+    Case("Magazine.contributors_for(min_articles=3)", lambda ctx, _: Magazine.contributors_for(min_articles=3)),
+    Case("Magazine.prefetch", lambda ctx, magazines: Magazine.prefetch(magazines, ["articles", "authors"]),
+         lambda ctx: [ctx.magazine() for _ in range(5)]),
+    Case("Magazine.create", lambda ctx, _: ctx.keep(Magazine.create(ctx.name("Benchmark magazine"), "Benchmarks"))),
+    Case("Magazine.save", lambda ctx, magazine: _saved(ctx, magazine),
+         lambda ctx: Magazine(ctx.name("Benchmark magazine"), "Benchmarks")),
+    Case("Magazine.create_many", lambda ctx, _: ctx.keep(*Magazine.create_many(
+        [(ctx.name("Benchmark magazine"), "Benchmarks") for _ in range(100)]
+    ))),
+    Case("Magazine.bulk_save", lambda ctx, magazines: ctx.keep(*Magazine.bulk_save(magazines)),
+         lambda ctx: [Magazine(ctx.name("Benchmark magazine"), "Benchmarks") for _ in range(100)]),
+    Case("Magazine.get_or_create", lambda ctx, _: ctx.keep(
+        Magazine.get_or_create(ctx.name("Benchmark magazine"), "Benchmarks"))),
+    Case("Magazine.get_or_create(existing)", lambda ctx, magazine: Magazine.get_or_create(magazine.name, "Benchmarks"),
+         lambda ctx: ctx.magazine()),
+    Case("Magazine.upsert", lambda ctx, _: ctx.keep(Magazine.upsert(ctx.name("Benchmark magazine"), "Benchmarks"))),
+    Case("Magazine.get_or_create_many", lambda ctx, _: ctx.keep(*Magazine.get_or_create_many(
+        [(ctx.name("Benchmark magazine"), "Benchmarks") for _ in range(100)]
+    ))),
+    Case("Magazine.upsert_many", lambda ctx, _: ctx.keep(*Magazine.upsert_many(
+        [(ctx.name("Benchmark magazine"), "Benchmarks") for _ in range(100)]
+    ))),
+    Case("Magazine.update", lambda ctx, magazine: magazine.update(),
+         _created(lambda ctx: Magazine(ctx.name("Benchmark magazine"), "Benchmarks"))),
+    Case("Magazine.delete", lambda ctx, magazine: magazine.delete(),
+         _created(lambda ctx: Magazine(ctx.name("Benchmark magazine"), "Benchmarks"))),
+]
+
+#Public methods deliberately left out, and why
+NOT_TIMED = {
+    "create_table": "schema setup",
+    "drop_table": "schema setup",
+    "instance_from_db": "timed inside every read; see benchmarks.hydration",
+    "prefetch_articles": "timed through prefetch",
+    "prefetch_magazines": "timed through prefetch",
+    "prefetch_authors": "timed through prefetch",
+}
+
+
+def public_methods(model):
+    """Names of the public methods a benchmark case should cover"""
+    return sorted(
+        name for name, value in vars(model).items()
+        if not name.startswith("_") and callable(getattr(model, name))
+        #Async twins run the same code on the executor
+        and not (name.startswith("a") and name[1:] in vars(model))
+        and not name.startswith("aiter_")
+    )
+
+
+def untimed_methods():
+    """Public methods with neither a case nor a NOT_TIMED reason"""
+    timed = {case.name.split("(")[0] for case in CASES}
+    return [
+        f"{model.__name__}.{name}"
+        for model in (Article, Author, Magazine)
+        for name in public_methods(model)
+        if f"{model.__name__}.{name}" not in timed and name not in NOT_TIMED
+    ]
+
+
+def time_case(case, ctx, min_time=DEFAULT_MIN_TIME, max_calls=DEFAULT_MAX_CALLS):
+    """Call a case until `min_time` seconds have been timed; return its statistics in ms"""
+    #One untimed call warms the page cache and the identity map
+    case.run(ctx, case.setup(ctx) if case.setup else None)
+
+    timings = []
+    total = 0.0
+    while not timings or (total < min_time and len(timings) < max_calls):
+        arg = case.setup(ctx) if case.setup else None
+        start = time.perf_counter()
+        case.run(ctx, arg)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "min_ms": timings[0] * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+    }
+
+
+def _clean_up(ctx):
+    for instance in reversed(ctx.created):
+        if instance is None:
+            continue
+        if isinstance(instance, Author):
+            for article in instance.articles():
+                article.delete()
+        if getattr(instance, instance.id_column, None) is not None:
+            instance.delete()
+    ctx.created.clear()
+
+
+def run_size(path, cases, seed, min_time, max_calls, report=print):
+    pool = ConnectionPool(path)
+    previous = set_provider(pool)
+    maps = {model: model.all for model in (Article, Author, Magazine)}
+    results = {}
+    try:
+        ctx = Context(seed)
+        for case in cases:
+            #A fresh identity map per case, so one case does not warm the next
+            for model in maps:
+                model.all = type(maps[model])()
+            try:
+                results[case.name] = time_case(case, ctx, min_time, max_calls)
+            finally:
+                _clean_up(ctx)
+            report(f"  {case.name:<36}{results[case.name]['median_ms']:>12.3f} ms "
+                   f"({results[case.name]['calls']} calls)")
+    finally:
+        for model, identity_map in maps.items():
+            model.all = identity_map
+        set_provider(previous)
+        pool.close()
+    return results
+
+
+def catalogue_path(data_dir, size, seed):
+    return os.path.join(data_dir, f"catalogue-{size}-seed{seed}.db")
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, seed=generator.DEFAULT_SEED, data_dir=None, cases=None, min_time=DEFAULT_MIN_TIME,
+        max_calls=DEFAULT_MAX_CALLS, import_runs=imports.DEFAULT_RUNS, report=print):
+    """Benchmark `cases` (all by default) at every size; return the JSON-ready results.
+
+    Import times of the model packages are reported under "imports"
+    alongside the sizes; import_runs=0 leaves them out.
+    """
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), "articles-benchmarks")
+    os.makedirs(data_dir, exist_ok=True)
+    cases = cases or CASES
+
+    results = {}
+    for size in sizes:
+        path = catalogue_path(data_dir, size, seed)
+        if not os.path.exists(path):
+            report(f"generating {size:,} articles into {path}")
+            generator.generate(path, size, seed)
+        report(f"{size:,} articles")
+        results[str(size)] = run_size(path, cases, seed, min_time, max_calls, report)
+    if import_runs:
+        results["imports"] = imports.measure(runs=import_runs)
+        for name, stats in results["imports"].items():
+            report(f"  {name:<36}{stats['median_ms']:>12.3f} ms")
+
+    return {
+        "format": FORMAT_VERSION,
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "min_time": min_time,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated, e.g. 10k,100k,1m,10m")
+    parser.add_argument("--seed", type=int, default=generator.DEFAULT_SEED)
+    parser.add_argument("--data-dir", help="where generated catalogues are cached")
+    parser.add_argument("--only", help="run the cases whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds timed per case")
+    parser.add_argument("--max-calls", type=int, default=DEFAULT_MAX_CALLS)
+    parser.add_argument("--import-runs", type=int, default=imports.DEFAULT_RUNS,
+                        help="fresh interpreters per import timing; 0 skips them")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    missing = untimed_methods()
+    if missing:
+        parser.error(f"no benchmark case for {', '.join(missing)}")
+
+    sizes = [generator.parse_size(size) for size in args.sizes.split(",")]
+    cases = [case for case in CASES if not args.only or args.only in case.name]
+    results = run(sizes, args.seed, args.data_dir, cases, args.min_time, args.max_calls, args.import_runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import contextvars
+import functools
+import weakref
+
+#asyncio and concurrent.futures are imported on first use: the models build
+#their async twins at import time, and most callers never await one
+from db.connection import DEFAULT_POOL_SIZE, fetchall
+
+DEFAULT_BATCH_SIZE = 500
+
+_executor = None
+_inflight = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    """Return the executor async model calls run on, creating it on first use.
+
+    It is kept separate from the default loop executor and sized to the
+    connection pool so queued queries wait for a thread, not a connection.
+    """
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE, thread_name_prefix="db-aio")
+    return _executor
+
+
+def set_executor(executor):
+    """Swap the executor used by async model calls; returns the old one"""
+    global _executor
+    previous, _executor = _executor, executor
+    return previous
+
+
+def _in_context(fn, args, kwargs):
+    #Like asyncio.to_thread: the query runs in the awaiting task's context,
+    #so instrument.count_queries() blocks see it
+    return functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+async def run(fn, *args, **kwargs):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _in_context(fn, args, kwargs))
+
+
+async def run_coalesced(key, fn, *args, **kwargs):
+    """Run `fn` once for every concurrent await that shares the same `key`"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    inflight = _inflight.setdefault(loop, {})
+    future = inflight.get(key)
+    if future is None:
+        future = loop.run_in_executor(get_executor(), _in_context(fn, args, kwargs))
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+
+    #Shielded so one cancelled caller does not cancel the query for the rest
+    return await asyncio.shield(future)
+
+
+def _key(receiver, name, args, kwargs):
+    def freeze(value):
+        if isinstance(value, (list, set)):
+            return tuple(freeze(item) for item in value)
+        return value
+
+    return (receiver, name, freeze(args), tuple((k, freeze(v)) for k, v in sorted(kwargs.items())))
+
+
+def async_classmethod(name, coalesce=True):
+    """Build an awaitable twin of the classmethod `name`"""
+    async def method(cls, *args, **kwargs):
+        fn = getattr(cls, name)
+        if not coalesce:
+            return await run(fn, *args, **kwargs)
+        return await run_coalesced(_key(cls, name, args, kwargs), fn, *args, **kwargs)
+
+    method.__name__ = f"a{name}"
+    method.__doc__ = f"Awaitable version of `{name}`, run on the database executor"
+    return classmethod(method)
+
+
+def async_method(name, coalesce=True):
+    """Build an awaitable twin of the instance method `name`"""
+    async def method(self, *args, **kwargs):
+        fn = getattr(self, name)
+        if not coalesce:
+            return await run(fn, *args, **kwargs)
+        return await run_coalesced(_key(self, name, args, kwargs), fn, *args, **kwargs)
+
+    method.__name__ = f"a{name}"
+    method.__doc__ = f"Awaitable version of `{name}`, run on the database executor"
+    return method
+
+
+async def aiter_rows(table, id_column, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield every row of `table` in id order, one executor call per batch.
+
+    Each batch is a separate keyset query, so no cursor or connection is
+    held while the caller awaits between rows.
+    """
+    first = f"SELECT * FROM {table} ORDER BY {id_column} LIMIT ?"
+    after = f"SELECT * FROM {table} WHERE {id_column} > ? ORDER BY {id_column} LIMIT ?"
+
+    rows = await run(fetchall, first, (batch_size,))
+    while rows:
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        rows = await run(fetchall, after, (rows[-1][0], batch_size))
@@ -0,0 +1,229 @@
+"""Author x magazine article counts as NumPy arrays, for analytics jobs.
+
+`AuthorMagazineMatrix.load()` reads author_magazine_counts (the trigger
+maintained GROUP BY of articles) into a sparse matrix in coordinate form:
+one (author, magazine, count) entry per pair with articles. Queries over
+it are vectorized, and `refresh()` applies only the pairs that changed
+since the last load, which the change log records (db/changelog.sql).
+
+NumPy is only needed by this module; the models never import it.
+"""
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("db.analytics needs numpy; install it with `pip install numpy`") from e
+
+from db.connection import get_provider
+from db.sharding import ShardingError, get_shards
+
+#A refresh that touches more pairs than this share of the matrix reloads it instead
+FULL_RELOAD_RATIO = 0.5
+
+_CHANGED_PAIRS = """
+    SELECT COUNT(DISTINCT row_id) FROM changelog
+    WHERE table_name = 'author_magazine_counts' AND seq > ?
+"""
+
+
+def _pair_keys(author_ids, magazine_ids):
+    #Ids are SQLite rowids below 2**31 in practice, so a pair packs into one int64
+    return (author_ids.astype(np.int64) << 32) | magazine_ids.astype(np.int64)
+
+
+class AuthorMagazineMatrix:
+    """Article counts per (author, magazine) with id <-> index maps.
+
+    `author_ids` and `magazine_ids` are sorted id arrays; an id's index is
+    its position in them. `rows`, `cols` and `counts` hold one entry per
+    pair with at least one article, ordered by (author, magazine). Authors
+    without articles are not in the matrix; every magazine is.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.magazine_ids = np.empty(0, dtype=np.int64)
+        self.categories = np.empty(0, dtype=object)
+        self._keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._index()
+
+    def __repr__(self):
+        return f"<AuthorMagazineMatrix {self.shape[0]}x{self.shape[1]}, {len(self.counts)} pairs, version {self.version}>"
+
+    @classmethod
+    def load(cls):
+        matrix = cls()
+        matrix.refresh(full=True)
+        return matrix
+
+    @property
+    def shape(self):
+        return (len(self.author_ids), len(self.magazine_ids))
+
+    #Reading the counts that changed since the last load, in one snapshot
+    def refresh(self, full=False):
+        """Bring the matrix up to date; returns the number of pairs re-read.
+
+        Magazines are always re-read, so a new magazine or category shows
+        up even when no counts changed. When the change log was compacted
+        past the last load, the whole matrix is reloaded.
+        """
+        if get_shards() is not None:
+            raise ShardingError("the matrix reads the primary's counts, which are empty while articles are sharded")
+        provider = get_provider()
+        checkout = getattr(provider, "checkout", provider.connection)
+        with checkout() as conn:
+            owns_transaction = not conn.in_transaction
+            if owns_transaction:
+                conn.execute("BEGIN")
+            try:
+                version = conn.execute(
+                    "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changelog'), 0)"
+                ).fetchone()[0]
+                magazines = conn.execute("SELECT magazine_id, category FROM magazines ORDER BY magazine_id").fetchall()
+                if not full:
+                    row = conn.execute("SELECT through_seq FROM changelog_compactions WHERE id = 1").fetchone()
+                    full = row is not None and row[0] > self.version
+                if not full:
+                    changed = conn.execute(_CHANGED_PAIRS, (self.version,)).fetchone()[0]
+                    full = changed > FULL_RELOAD_RATIO * max(len(self.counts), 1)
+                if full:
+                    pairs = conn.execute("""
+                        SELECT author_id, magazine_id, article_count
+                        FROM author_magazine_counts
+                        WHERE article_count > 0
+                    """).fetchall()
+                else:
+                    pairs = conn.execute("""
+                        SELECT v.author_id, v.magazine_id, COALESCE(c.article_count, 0)
+                        FROM (
+                            SELECT DISTINCT row_id >> 32 AS author_id, row_id & 4294967295 AS magazine_id
+                            FROM changelog
+                            WHERE table_name = 'author_magazine_counts' AND seq > ?
+                        ) v
+                        LEFT JOIN author_magazine_counts c
+                            ON c.author_id = v.author_id AND c.magazine_id = v.magazine_id
+                    """, (self.version,)).fetchall()
+            finally:
+                if owns_transaction:
+                    conn.rollback()
+
+        self.magazine_ids = np.array([row[0] for row in magazines], dtype=np.int64)
+        self.categories = np.array([row[1] for row in magazines], dtype=object)
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 3)
+        keys, counts = _pair_keys(pairs[:, 0], pairs[:, 1]), pairs[:, 2]
+        if full:
+            order = np.argsort(keys)
+            self._keys, self.counts = keys[order], counts[order]
+        else:
+            self._merge(keys, counts)
+        self.version = version
+        self._index()
+        return len(pairs)
+
+    def _merge(self, keys, counts):
+        position = np.searchsorted(self._keys, keys)
+        found = position < len(self._keys)
+        found[found] = self._keys[position[found]] == keys[found]
+        self.counts[position[found]] = counts[found]
+
+        keys = np.concatenate([self._keys, keys[~found]])
+        counts = np.concatenate([self.counts, counts[~found]])
+        keep = counts > 0
+        keys, counts = keys[keep], counts[keep]
+        order = np.argsort(keys, kind="stable")
+        self._keys, self.counts = keys[order], counts[order]
+
+    def _index(self):
+        """Derive the author index and each pair's row and column from the keys"""
+        pair_authors = self._keys >> 32
+        pair_magazines = self._keys & 0xFFFFFFFF
+        #Pairs left behind by a deleted magazine have nowhere to go
+        cols = np.searchsorted(self.magazine_ids, pair_magazines)
+        valid = cols < len(self.magazine_ids)
+        valid[valid] = self.magazine_ids[cols[valid]] == pair_magazines[valid]
+        if not valid.all():
+            self._keys, self.counts = self._keys[valid], self.counts[valid]
+            pair_authors, cols = pair_authors[valid], cols[valid]
+        self.author_ids = np.unique(pair_authors)
+        self.rows = np.searchsorted(self.author_ids, pair_authors)
+        self.cols = cols
+
+    def author_index(self, author_id):
+        """Row of `author_id`, or None when the author has no articles"""
+        index = int(np.searchsorted(self.author_ids, author_id))
+        return index if index < len(self.author_ids) and self.author_ids[index] == author_id else None
+
+    def magazine_index(self, magazine_id):
+        index = int(np.searchsorted(self.magazine_ids, magazine_id))
+        return index if index < len(self.magazine_ids) and self.magazine_ids[index] == magazine_id else None
+
+    def dense(self):
+        """The full authors x magazines count array; mind the size on large catalogues"""
+        matrix = np.zeros(self.shape, dtype=np.int64)
+        matrix[self.rows, self.cols] = self.counts
+        return matrix
+
+    def magazines_of(self, author_id):
+        """Ids of the magazines `author_id` has written for, as Author.magazines() lists them"""
+        index = self.author_index(author_id)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        start, end = np.searchsorted(self.rows, [index, index + 1])
+        return self.magazine_ids[self.cols[start:end]]
+
+    def magazines_with_authors(self, k=2):
+        """Ids of magazines with at least `k` distinct authors; k=2 is with_multiple_authors()"""
+        authors = np.bincount(self.cols, minlength=len(self.magazine_ids))
+        return self.magazine_ids[authors >= k]
+
+    def contributing_authors(self, magazine_id, more_than=2):
+        """Ids of authors with more than `more_than` articles in the magazine, as
+        Magazine.contributing_authors() finds them with the default"""
+        index = self.magazine_index(magazine_id)
+        mask = (self.cols == index) & (self.counts > more_than)
+        return self.author_ids[self.rows[mask]]
+
+    def frequent_pairs(self, more_than):
+        """(author ids, magazine ids, counts) of every pair with more than `more_than` articles"""
+        mask = self.counts > more_than
+        return self.author_ids[self.rows[mask]], self.magazine_ids[self.cols[mask]], self.counts[mask]
+
+    def top_authors_by_category(self, k=10):
+        """Return {category: (author ids, article counts)}, the `k` most prolific per category"""
+        names, category_of = np.unique(self.categories.astype(str), return_inverse=True)
+        cells = self.rows * len(names) + category_of[self.cols]
+        totals = np.bincount(cells, weights=self.counts, minlength=len(self.author_ids) * len(names))
+        totals = totals.astype(np.int64).reshape(len(self.author_ids), len(names))
+
+        top = {}
+        for column, name in enumerate(names):
+            best = self._top(totals[:, column], k)
+            top[str(name)] = (self.author_ids[best], totals[best, column])
+        return top
+
+    def similar_authors(self, author_id, k=10):
+        """(author ids, Jaccard scores) of the `k` authors sharing the most of
+        `author_id`'s magazines, relative to both authors' magazine counts"""
+        index = self.author_index(author_id)
+        if index is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        start, end = np.searchsorted(self.rows, [index, index + 1])
+        magazines = np.zeros(len(self.magazine_ids), dtype=bool)
+        magazines[self.cols[start:end]] = True
+
+        shared = np.bincount(self.rows[magazines[self.cols]], minlength=len(self.author_ids))
+        degree = np.bincount(self.rows, minlength=len(self.author_ids))
+        scores = shared / (degree + degree[index] - shared)
+        scores[index] = 0.0
+        best = self._top(scores, k)
+        return self.author_ids[best], scores[best]
+
+    def _top(self, values, k):
+        """Row indexes of the `k` largest non-zero values, ties to the lower author id"""
+        candidates = np.flatnonzero(values)
+        if len(candidates) > k:
+            kth = np.partition(values[candidates], len(candidates) - k)[len(candidates) - k]
+            candidates = candidates[values[candidates] >= kth]
+        order = np.lexsort((self.author_ids[candidates], -values[candidates]))
+        return candidates[order[:k]]
@@ -0,0 +1,111 @@
+from itertools import islice
+
+from db import instrument
+from db.connection import in_transaction, write_connection
+
+#Rows per executemany call; keeps each batch well under SQLite's limits
+DEFAULT_CHUNK_SIZE = 1000
+
+#Rows per multi-row INSERT ... RETURNING, keeping its parameters under SQLite's limit
+DEFAULT_UPSERT_SIZE = 400
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items without materialising the input"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_many(table, id_column, columns, objects, values, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+    """Insert `objects` into `table` in chunked executemany batches.
+
+    All chunks run inside a single transaction, committed at the end unless
+    the caller holds a transaction of its own. `values` maps an object to
+    the tuple of `columns` to insert. The generated primary key is written
+    back to each object's `id_column` attribute and the saved objects are
+    returned in input order.
+
+    With `return_objects=False` only the number of rows inserted is
+    returned and no chunk is kept once it is written, so a streamed input
+    is inserted in flat memory. A failed insert then only clears the ids
+    of the chunk it failed in.
+    """
+    sql = f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join("?" for _ in columns)})
+    """
+    saved = []
+    count = 0
+    chunk = []
+    with write_connection() as conn:
+        commit = not in_transaction()
+        try:
+            for chunk in chunked(objects, chunk_size):
+                instrument.executemany(conn, sql, [values(obj) for obj in chunk])
+
+                #The write lock is held for the whole transaction and rowids are
+                #allocated as max(rowid) + 1, so a chunk's ids are contiguous
+                last_id = instrument.execute(conn, f"SELECT MAX({id_column}) FROM {table}").fetchone()[0]
+                first_id = last_id - len(chunk) + 1
+                for offset, obj in enumerate(chunk):
+                    setattr(obj, id_column, first_id + offset)
+                count += len(chunk)
+                if return_objects:
+                    saved.extend(chunk)
+        except BaseException:
+            if commit:
+                conn.rollback()
+                for obj in saved if return_objects else chunk:
+                    setattr(obj, id_column, None)
+            raise
+        if commit:
+            conn.commit()
+    return saved if return_objects else count
+
+
+def upsert_many(table, key, columns, rows, update=(), chunk_size=DEFAULT_UPSERT_SIZE):
+    """Insert `rows` unless a row with the same unique `key` exists; return every row they name.
+
+    `rows` are tuples in `columns` order and `key` is one of the columns.
+    Existing rows are left as they are, or have their `update` columns
+    overwritten. Each chunk is one INSERT ... ON CONFLICT ... RETURNING,
+    plus one lookup for the existing rows it did not return, all in a
+    single transaction. Returns {key value: full table row}.
+    """
+    position = columns.index(key)
+    #Table rows start with the id column, then `columns` in order
+    row_key = position + 1
+    if update:
+        conflict = f"DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in update)}"
+    else:
+        conflict = "DO NOTHING"
+    placeholders = f"({', '.join('?' for _ in columns)})"
+
+    found = {}
+    with write_connection() as conn:
+        commit = not in_transaction()
+        try:
+            for chunk in chunked(rows, chunk_size):
+                sql = f"""
+                    INSERT INTO {table} ({", ".join(columns)})
+                    VALUES {", ".join(placeholders for _ in chunk)}
+                    ON CONFLICT ({key}) {conflict}
+                    RETURNING *
+                """
+                returned = instrument.execute(conn, sql, [value for row in chunk for value in row]).fetchall()
+                found.update((row[row_key], row) for row in returned)
+                missing = [row[position] for row in chunk if row[position] not in found]
+                if missing:
+                    sql = f"SELECT * FROM {table} WHERE {key} IN ({', '.join('?' for _ in missing)})"
+                    found.update((row[row_key], row) for row in instrument.execute(conn, sql, missing).fetchall())
+        except BaseException:
+            if commit and conn.in_transaction:
+                conn.rollback()
+            raise
+        if commit:
+            conn.commit()
+    return found
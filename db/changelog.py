@@ -0,0 +1,199 @@
+"""Consumers for the change log that triggers on the model tables fill.
+
+Every insert, update and delete on authors, magazines and articles is a
+Change(seq, table, op, row_id), and so is every change to an
+author_magazine_counts pair, with author_id << 32 | magazine_id as its
+row_id. SQLite has one writer at a time, so seq order is commit order and
+a reader never sees a gap that fills in later.
+
+Jobs read the log with `changes_since` or follow it with `tail`/`atail`.
+Named `Consumer`s also store how far they got, which `compact` uses to
+decide what can go.
+"""
+import os
+import time
+from collections import namedtuple
+
+from db.connection import connection, execute, fetchall, fetchone, held_transaction
+
+CHANGELOG_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "changelog.sql")
+DEFAULT_LIMIT = 1000
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_MAX_ROWS = 1000000
+
+Change = namedtuple("Change", ["seq", "table", "op", "row_id"])
+
+
+class ChangelogTruncated(LookupError):
+    """Changes after the requested seq were compacted away.
+
+    The reader has to resync from the tables, then carry on from `latest_seq()`
+    read before it started.
+    """
+
+
+def create_changelog(conn=None):
+    """Create the change log tables and their triggers if they are missing"""
+    with open(CHANGELOG_SQL) as f:
+        script = f.read()
+    if conn is not None:
+        conn.executescript(script)
+        return
+    with connection() as conn:
+        conn.executescript(script)
+
+
+def drop_changelog():
+    """Drop the change log tables; the triggers go with the model tables"""
+    with connection() as conn:
+        for table in ("changelog", "changelog_consumers", "changelog_compactions"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.commit()
+
+
+def latest_seq():
+    """The seq of the newest change ever logged, 0 if there has been none"""
+    row = fetchone("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'")
+    return row[0] if row else 0
+
+
+def compacted_through():
+    row = fetchone("SELECT through_seq FROM changelog_compactions WHERE id = 1")
+    return row[0] if row else 0
+
+
+def changes_since(seq=0, limit=DEFAULT_LIMIT, tables=None):
+    """Return up to `limit` changes with a seq above `seq`, oldest first.
+
+    `tables` narrows the result to some of the model tables. Raises
+    ChangelogTruncated when compaction already removed changes after `seq`.
+    """
+    sql = """
+        SELECT seq, table_name, op, row_id FROM changelog
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+    """
+    params = (seq, limit)
+    if tables:
+        sql = f"""
+            SELECT seq, table_name, op, row_id FROM changelog
+            WHERE seq > ? AND table_name IN ({", ".join("?" for _ in tables)})
+            ORDER BY seq
+            LIMIT ?
+        """
+        params = (seq, *tables, limit)
+    #Read the log and the compaction mark in one snapshot
+    with connection() as conn:
+        owns_transaction = not conn.in_transaction
+        if owns_transaction:
+            conn.execute("BEGIN")
+        try:
+            rows = fetchall(sql, params)
+            through = compacted_through()
+        finally:
+            if owns_transaction:
+                conn.rollback()
+    if seq < through:
+        raise ChangelogTruncated(f"changes up to seq {through} were compacted; asked for changes after {seq}")
+    return [Change(*row) for row in rows]
+
+
+def tail(seq=None, limit=DEFAULT_LIMIT, tables=None, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+    """Yield changes after `seq` (default: from now on) as they are committed.
+
+    Blocks between polls; stops once `timeout` seconds pass with nothing new.
+    """
+    seq = latest_seq() if seq is None else seq
+    idle_since = time.monotonic()
+    while True:
+        changes = changes_since(seq, limit, tables)
+        if changes:
+            yield from changes
+            seq = changes[-1].seq
+            idle_since = time.monotonic()
+            continue
+        if timeout is not None and time.monotonic() - idle_since >= timeout:
+            return
+        time.sleep(poll_interval)
+
+
+async def atail(seq=None, limit=DEFAULT_LIMIT, tables=None, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+    """Async version of `tail`: polls on the database executor, sleeps without blocking the loop"""
+    import asyncio
+    from db import aio
+    seq = await aio.run(latest_seq) if seq is None else seq
+    idle_since = time.monotonic()
+    while True:
+        changes = await aio.run(changes_since, seq, limit, tables)
+        if changes:
+            for change in changes:
+                yield change
+            seq = changes[-1].seq
+            idle_since = time.monotonic()
+            continue
+        if timeout is not None and time.monotonic() - idle_since >= timeout:
+            return
+        await asyncio.sleep(poll_interval)
+
+
+class Consumer:
+    """A named reader whose position is stored in the database.
+
+    A new consumer starts at the current end of the log. `changes()`
+    returns what it has not acknowledged yet; `ack()` moves it forward,
+    and compaction keeps everything it has not acknowledged.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        execute("""
+            INSERT INTO changelog_consumers (name, seq)
+            SELECT ?, (SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'changelog')
+            ON CONFLICT (name) DO NOTHING
+        """, (name,))
+
+    def __repr__(self):
+        return f"<Consumer {self.name} at {self.position()}>"
+
+    def position(self):
+        row = fetchone("SELECT seq FROM changelog_consumers WHERE name = ?", (self.name,))
+        return row[0] if row else 0
+
+    def changes(self, limit=DEFAULT_LIMIT, tables=None):
+        return changes_since(self.position(), limit, tables)
+
+    def ack(self, seq):
+        """Record that every change up to `seq` has been processed"""
+        execute("UPDATE changelog_consumers SET seq = MAX(seq, ?) WHERE name = ?", (seq, self.name))
+
+    def remove(self):
+        execute("DELETE FROM changelog_consumers WHERE name = ?", (self.name,))
+
+
+def compact(max_rows=DEFAULT_MAX_ROWS):
+    """Delete changes every consumer has acknowledged, then cap the log at `max_rows`; returns how many went.
+
+    Without consumers only the cap applies; max_rows=None turns it off.
+    A consumer that falls more than `max_rows` behind gets
+    ChangelogTruncated on its next read.
+    """
+    with held_transaction() as conn:
+        try:
+            row = fetchone("SELECT MIN(seq) FROM changelog_consumers")
+            through = row[0] if row and row[0] is not None else 0
+            if max_rows is not None:
+                row = fetchone("SELECT seq FROM changelog ORDER BY seq DESC LIMIT 1 OFFSET ?", (max_rows,))
+                if row:
+                    through = max(through, row[0])
+            deleted = execute("DELETE FROM changelog WHERE seq <= ?", (through,)).rowcount
+            if deleted:
+                execute("""
+                    INSERT INTO changelog_compactions (id, through_seq) VALUES (1, ?)
+                    ON CONFLICT (id) DO UPDATE SET through_seq = MAX(through_seq, excluded.through_seq)
+                """, (through,))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return deleted
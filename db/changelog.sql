@@ -0,0 +1,91 @@
+-- Change data capture: one row per insert, update or delete on authors,
+-- magazines and articles, in commit order. seq comes from AUTOINCREMENT,
+-- so it only ever grows, even after compaction empties the log.
+--
+-- Changes to author_magazine_counts (db/stats.sql, which has to be
+-- installed first) are logged too, for db.analytics. Their row_id packs
+-- the pair as author_id << 32 | magazine_id.
+
+CREATE TABLE IF NOT EXISTS changelog (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL
+);
+
+-- Where each named consumer has got to, and how far compaction has gone
+CREATE TABLE IF NOT EXISTS changelog_consumers (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS changelog_compactions (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    through_seq INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS authors_changelog_insert AFTER INSERT ON authors
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('authors', 'insert', NEW.author_id);
+END;
+
+-- Updates that change nothing, like an upsert of an unchanged row, are not logged
+CREATE TRIGGER IF NOT EXISTS authors_changelog_update AFTER UPDATE ON authors
+WHEN OLD.name IS NOT NEW.name
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('authors', 'update', NEW.author_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS authors_changelog_delete AFTER DELETE ON authors
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('authors', 'delete', OLD.author_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS magazines_changelog_insert AFTER INSERT ON magazines
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('magazines', 'insert', NEW.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS magazines_changelog_update AFTER UPDATE ON magazines
+WHEN OLD.name IS NOT NEW.name OR OLD.category IS NOT NEW.category
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('magazines', 'update', NEW.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS magazines_changelog_delete AFTER DELETE ON magazines
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('magazines', 'delete', OLD.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_changelog_insert AFTER INSERT ON articles
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('articles', 'insert', NEW.article_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_changelog_update AFTER UPDATE OF title, author_id, magazine_id ON articles
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('articles', 'update', NEW.article_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_changelog_delete AFTER DELETE ON articles
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id) VALUES ('articles', 'delete', OLD.article_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS author_magazine_counts_changelog_insert AFTER INSERT ON author_magazine_counts
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id)
+    VALUES ('author_magazine_counts', 'insert', NEW.author_id << 32 | NEW.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS author_magazine_counts_changelog_update AFTER UPDATE OF article_count ON author_magazine_counts
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id)
+    VALUES ('author_magazine_counts', 'update', NEW.author_id << 32 | NEW.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS author_magazine_counts_changelog_delete AFTER DELETE ON author_magazine_counts
+BEGIN
+    INSERT INTO changelog (table_name, op, row_id)
+    VALUES ('author_magazine_counts', 'delete', OLD.author_id << 32 | OLD.magazine_id);
+END;
@@ -0,0 +1,220 @@
+"""Keep the model identity maps in step with commits from other processes.
+
+A connection's `PRAGMA data_version` changes whenever some other
+connection commits, so "has anything changed?" costs one pragma. When it
+has, the change log says which rows: cached instances of updated rows are
+re-read in place, deleted ones leave the identity map, and prefetched
+relations that may have changed are dropped.
+
+Checks run before model reads, at most once per `staleness` seconds, so a
+cached instance is never further behind than that. Coherence is off until
+`set_staleness()` turns it on; `sync()` checks right away.
+"""
+import sqlite3
+import threading
+import time
+
+from db import connection as _connection
+from db.changelog import DEFAULT_LIMIT, ChangelogTruncated, changes_since, latest_seq
+from db.connection import connection, get_provider, in_transaction
+from db.prefetch import fetch_in
+from db.session import current_session
+
+
+def _models():
+    #Imported on first use; the models import db.connection, which this module extends
+    from lib.models.article import Article
+    from lib.models.author import Author
+    from lib.models.magazine import Magazine
+    return {model.table_name: model for model in (Author, Magazine, Article)}
+
+
+class Coherence:
+    """Remembers how far into the change log the identity maps are.
+
+    `seq` is the last change applied, None until the first check. Changes
+    committed before that check are assumed to be reflected already.
+    """
+
+    def __init__(self, staleness=None):
+        self.staleness = staleness
+        self.seq = None
+        self.checks = 0
+        self.applied = 0
+        self.refreshed = 0
+        self.evicted = 0
+        self.resyncs = 0
+        #id(conn) -> (conn, data_version); connections can't be weakly referenced
+        self._versions = {}
+        self._provider = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<Coherence staleness={self.staleness} seq={self.seq}>"
+
+    def before_read(self):
+        if self.staleness is None or time.monotonic() - self._last_check < self.staleness:
+            return
+        #A read inside a transaction has to keep its own snapshot, and the
+        #check's own queries come back through here while the lock is held
+        if in_transaction() or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = time.monotonic()
+            self._check()
+        finally:
+            self._lock.release()
+
+    def sync(self):
+        """Check for outside commits now; returns the number of changes applied"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            return self._check()
+
+    def _check(self):
+        self.checks += 1
+        if get_provider() is not self._provider:
+            #Another database; nothing known about the old one applies
+            self._provider, self.seq = get_provider(), None
+            self._versions.clear()
+        with connection() as conn:
+            if conn.in_transaction:
+                return 0
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            seen = self._versions.get(id(conn))
+            self._versions[id(conn)] = (conn, version)
+            if self.seq is not None and seen is not None and seen[0] is conn and seen[1] == version:
+                return 0
+            try:
+                if self.seq is None:
+                    self.seq = latest_seq()
+                    return 0
+                applied = 0
+                while True:
+                    changes = changes_since(self.seq, DEFAULT_LIMIT)
+                    if not changes:
+                        return applied
+                    self.apply(changes)
+                    applied += len(changes)
+                    self.seq = changes[-1].seq
+            except ChangelogTruncated:
+                self.resync()
+                return 0
+            except sqlite3.OperationalError as e:
+                #A database without the change log can only be re-read wholesale
+                if "no such table" not in str(e):
+                    raise
+                self.resync()
+                return 0
+
+    def apply(self, changes):
+        """Bring the cached instances `changes` touch up to date"""
+        models = _models()
+        changed = {table: {} for table in models}
+        for change in changes:
+            if change.table in changed:
+                #The last change to a row decides whether it still exists
+                changed[change.table][change.row_id] = change.op
+        self.applied += len(changes)
+
+        relations = {"authors": set(), "magazines": set()}
+        for table, model in models.items():
+            ids = list(changed[table])
+            if table != "articles":
+                self._refresh(model, [row_id for row_id in ids if model.all.get(row_id) is not None])
+                continue
+            #An article deleted before anything cached it leaves no trace of whose it was
+            unknown = any(op == "delete" and model.all.get(row_id) is None for row_id, op in changed[table].items())
+            for author_id, magazine_id in self._refresh(model, ids):
+                relations["authors"].add(author_id)
+                relations["magazines"].add(magazine_id)
+            if unknown:
+                relations = {"authors": None, "magazines": None}
+        for table, ids in relations.items():
+            self._drop_relations(models[table], ids)
+
+    def resync(self):
+        """Re-read every cached instance, when the change log can't say what changed"""
+        self.resyncs += 1
+        try:
+            self.seq = latest_seq()
+        except sqlite3.OperationalError:
+            self.seq = 0
+        for model in _models().values():
+            self._refresh(model, list(model.all))
+            self._drop_relations(model, None)
+
+    def _refresh(self, model, ids):
+        """Re-read the cached instances in `ids`, evicting the ones whose row is gone.
+
+        Returns (author_id, magazine_id) of the articles, old and new, for
+        working out whose prefetched relations changed.
+        """
+        session = current_session()
+        #Instances with unsaved edits in this thread's session keep them
+        pending = session.dirty if session else {}
+        cached = {}
+        for row_id in ids:
+            obj = model.all.get(row_id)
+            if obj is not None and id(obj) not in pending:
+                cached[row_id] = obj
+
+        owners = [(obj.author_id, obj.magazine_id) for obj in cached.values() if model.table_name == "articles"]
+        rows = fetch_in(f"SELECT * FROM {model.table_name} WHERE {model.id_column} IN ({{ids}})", list(ids))
+        for row in rows:
+            if model.table_name == "articles":
+                owners.append((row[2], row[3]))
+            if cached.pop(row[0], None) is not None:
+                model.instance_from_db(row)
+                self.refreshed += 1
+        for row_id in cached:
+            model.all.pop(row_id, None)
+            self.evicted += 1
+        return owners
+
+    @staticmethod
+    def _drop_relations(model, ids):
+        """Forget the prefetched relations of cached `ids`; None means every instance"""
+        if model.table_name == "articles":
+            return
+        for key, obj in model.all.items():
+            if ids is None or key in ids:
+                obj._prefetched = None
+
+    def stats(self):
+        return {
+            "staleness": self.staleness,
+            "seq": self.seq,
+            "checks": self.checks,
+            "applied": self.applied,
+            "refreshed": self.refreshed,
+            "evicted": self.evicted,
+            "resyncs": self.resyncs,
+        }
+
+
+_coherence = Coherence()
+
+
+def set_staleness(seconds):
+    """Check for outside commits at most every `seconds`; None turns checking off.
+
+    Returns the previous setting.
+    """
+    previous, _coherence.staleness = _coherence.staleness, seconds
+    _connection.set_read_hook(None if seconds is None else _coherence.before_read)
+    return previous
+
+
+def get_staleness():
+    return _coherence.staleness
+
+
+def sync():
+    """Apply every outside commit to the identity maps now; returns the number of changes"""
+    return _coherence.sync()
+
+
+def stats():
+    return _coherence.stats()
@@ -1,5 +1,426 @@
+import os
+import queue
+import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-CONN = sqlite3.connect('articles.db')
-CONN.row_factory = sqlite3.Row
-CURSOR = CONN.cursor()
\ No newline at end of file
+from db import instrument
+
+DATABASE = 'articles.db'
+DATABASE_ENV = "ARTICLES_DB"
+PROFILE_ENV = "ARTICLES_DB_PROFILE"
+DEFAULT_POOL_SIZE = 5
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_FETCH_SIZE = 500
+DEFAULT_PROFILE = "oltp"
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.01
+MAX_BACKOFF = 1.0
+
+#PRAGMA settings applied to every new connection, by workload.
+#A negative cache_size is in KiB; mmap_size is in bytes.
+PROFILES = {
+    #Short reads and writes from many threads: readers never wait on the writer
+    "oltp": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000,
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+    },
+    #One writer loading data it can reload: skip fsyncs, keep index pages hot
+    "bulk-load": {
+        "journal_mode": "wal",
+        "synchronous": "off",
+        "busy_timeout": 30000,
+        "cache_size": -256000,
+        "mmap_size": 256 * 1024 * 1024,
+    },
+    #Long read-only scans and aggregates over the whole database
+    "analytics": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 10000,
+        "cache_size": -256000,
+        "mmap_size": 1024 * 1024 * 1024,
+    },
+}
+
+#Applied in this order; journal_mode first since it may need an exclusive lock
+SETTINGS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")
+
+
+class PoolExhausted(sqlite3.OperationalError):
+    """Raised when no pooled connection became free within the timeout"""
+
+
+def resolve_profile(profile):
+    """Return the PRAGMA settings for a profile name or a settings dict"""
+    if isinstance(profile, dict):
+        unknown = set(profile) - set(SETTINGS)
+        if unknown:
+            raise ValueError(f"unknown connection settings: {', '.join(sorted(unknown))}")
+        return dict(profile)
+    try:
+        return dict(PROFILES[profile])
+    except KeyError:
+        raise ValueError(f"unknown connection profile {profile!r}; use one of {', '.join(PROFILES)}") from None
+
+
+def apply_profile(conn, profile):
+    pragmas = resolve_profile(profile)
+    for name in SETTINGS:
+        value = pragmas.get(name)
+        if value is not None:
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+
+def read_settings(conn):
+    """Return the values SQLite reports for the profile settings on `conn`"""
+    return {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in SETTINGS}
+
+
+def is_busy(error):
+    """True for the transient locking errors that are worth retrying"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error)
+    return "database is locked" in message or "database table is locked" in message
+
+
+def retry_busy(fn, *args, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, **kwargs):
+    """Call `fn`, retrying with jittered exponential backoff while SQLite is busy.
+
+    busy_timeout already waits inside SQLite; this covers the cases it
+    cannot, such as a WAL snapshot going stale or a checkpoint in progress.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if attempt == retries or isinstance(e, PoolExhausted) or not is_busy(e):
+                raise
+        time.sleep(min(MAX_BACKOFF, backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+class ConnectionPool:
+    """Bounded pool of sqlite3 connections shared between threads.
+
+    Connections are opened on demand up to `size`. A thread keeps the
+    connection it checked out until its outermost `connection()` block
+    exits, so nested model calls reuse it instead of taking another one.
+    """
+
+    def __init__(self, database=DATABASE, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, profile=DEFAULT_PROFILE):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile
+        self.pragmas = resolve_profile(profile)
+        self._idle = queue.LifoQueue()
+        self._opened = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def __repr__(self):
+        return f"<ConnectionPool {self.database} ({len(self._opened)}/{self.size} open)>"
+
+    def connect(self):
+        #Rows stay plain tuples; the models hydrate them positionally
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        retry_busy(apply_profile, conn, self.pragmas)
+        return conn
+
+    def settings(self):
+        """Return the profile and the settings SQLite reports for a pooled connection"""
+        with self.connection() as conn:
+            return {"database": self.database, "profile": self.profile, **read_settings(conn)}
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def checkout(self):
+        """Take a connection for exclusive use without binding it to this thread.
+
+        Long-lived readers such as suspended generators use this, so their
+        cleanup never touches another thread's state. If this thread already
+        holds a connection, that one is shared instead.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Close every idle connection; checked-out ones close when returned"""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._opened.remove(conn)
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._opened) < self.size:
+                conn = self.connect()
+                self._opened.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolExhausted(
+                f"no connection to {self.database} was free after {self.timeout}s"
+            ) from None
+
+    def _release(self, conn):
+        #Never hand the next thread a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._closed:
+                conn.close()
+                self._opened.remove(conn)
+                return
+        self._idle.put(conn)
+
+
+#The default pool is built from configuration on first use, so importing the
+#models never touches a database file
+_provider = None
+_default_pool = None
+_options = {}
+_provider_lock = threading.Lock()
+_local = threading.local()
+
+#Called before every read helper runs; db.coherence installs its check here
+_before_read = None
+
+
+def configure(path=None, profile=None, size=None, timeout=None):
+    """Choose the database the default pool opens; takes effect on the next query.
+
+    Anything left unset falls back to $ARTICLES_DB and $ARTICLES_DB_PROFILE,
+    then to articles.db with the "oltp" profile. A default pool that is
+    already open is closed, and a provider installed with `set_provider`
+    is replaced.
+    """
+    global _provider, _default_pool, _options
+    if profile is not None:
+        resolve_profile(profile)
+    options = {"database": path, "profile": profile, "size": size, "timeout": timeout}
+    with _provider_lock:
+        _options = {name: value for name, value in options.items() if value is not None}
+        previous, _provider, _default_pool = _default_pool, None, None
+    if previous is not None:
+        previous.close()
+
+
+def get_provider():
+    """Return the active provider, opening the default pool on first use"""
+    global _provider, _default_pool
+    provider = _provider
+    if provider is not None:
+        return provider
+    with _provider_lock:
+        if _provider is None:
+            options = {
+                "database": os.environ.get(DATABASE_ENV) or DATABASE,
+                "profile": os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE,
+                **_options,
+            }
+            pool = ConnectionPool(**options)
+            _upgrade(pool)
+            _provider = _default_pool = pool
+        return _provider
+
+
+def _upgrade(pool):
+    """Add the tables newer features need to a database made before them"""
+    from db.migrate import upgrade
+    with pool.connection() as conn:
+        retry_busy(upgrade, conn)
+
+
+def set_provider(provider):
+    """Swap the connection provider used by the models; returns the old one.
+
+    A provider is any object with a `connection()` context manager; it may
+    also offer `checkout()` for connections held across generator yields.
+    """
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
+
+
+@contextmanager
+def connection():
+    """Check out this thread's connection for the duration of the block"""
+    if in_transaction():
+        #Reads inside a held transaction have to see its own writes
+        with write_connection() as conn:
+            yield conn
+        return
+    with get_provider().connection() as conn:
+        yield conn
+
+
+@contextmanager
+def write_connection():
+    """Check out the connection writes go to.
+
+    This is `connection()` unless the provider has a separate `writer()`,
+    as a read replica does.
+    """
+    provider = get_provider()
+    with getattr(provider, "writer", provider.connection)() as conn:
+        yield conn
+
+
+@contextmanager
+def held_transaction():
+    """Hold this thread's connection and stop `execute` from committing"""
+    with write_connection() as conn:
+        _local.transactions = getattr(_local, "transactions", 0) + 1
+        try:
+            yield conn
+        finally:
+            _local.transactions -= 1
+
+
+def in_transaction():
+    return getattr(_local, "transactions", 0) > 0
+
+
+def settings():
+    """Describe the active provider's connection settings, for diagnostics"""
+    describe = getattr(get_provider(), "settings", None)
+    if describe is not None:
+        return describe()
+    with connection() as conn:
+        return read_settings(conn)
+
+
+def set_read_hook(hook):
+    """Run `hook()` before each fetchone, fetchall and iterate; returns the old hook"""
+    global _before_read
+    previous, _before_read = _before_read, hook
+    return previous
+
+
+def fetchone(sql, params=()):
+    if _before_read is not None:
+        _before_read()
+    with connection() as conn:
+        start = time.perf_counter()
+        row = retry_busy(lambda: conn.execute(sql, params).fetchone())
+        instrument.record(conn, sql, params, time.perf_counter() - start, row is not None)
+        return row
+
+
+def fetchall(sql, params=()):
+    if _before_read is not None:
+        _before_read()
+    with connection() as conn:
+        start = time.perf_counter()
+        rows = retry_busy(lambda: conn.execute(sql, params).fetchall())
+        instrument.record(conn, sql, params, time.perf_counter() - start, len(rows))
+        return rows
+
+
+def iterate(sql, params=(), batch_size=DEFAULT_FETCH_SIZE):
+    """Yield the rows of `sql` in `fetchmany` batches of `batch_size`.
+
+    The connection stays checked out until the generator is exhausted,
+    closed or garbage collected; wrap it in `contextlib.closing` when a loop
+    may stop early. Without WAL an open reader also blocks commits from
+    other connections. The statement is recorded once it finishes, with the
+    time spent fetching rather than the time the caller held the cursor.
+    """
+    if _before_read is not None:
+        _before_read()
+    provider = get_provider()
+    checkout = getattr(provider, "checkout", provider.connection)
+    if in_transaction():
+        checkout = getattr(provider, "writer", checkout)
+    with checkout() as conn:
+        start = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        count = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    return
+                count += len(rows)
+                yield from rows
+        finally:
+            cursor.close()
+            instrument.record(conn, sql, params, elapsed, count)
+
+
+def execute(sql, params=()):
+    """Run a write statement and commit it unless a transaction is held.
+
+    Returns the cursor so callers can read `lastrowid` and `rowcount`.
+    """
+    with write_connection() as conn:
+        if in_transaction():
+            return instrument.execute(conn, sql, params)
+        return retry_busy(_committed, conn, instrument.execute, sql, params)
+
+
+def executemany(sql, seq_of_params):
+    with write_connection() as conn:
+        if in_transaction():
+            return instrument.executemany(conn, sql, seq_of_params)
+        seq_of_params = list(seq_of_params)
+        return retry_busy(_committed, conn, instrument.executemany, sql, seq_of_params)
+
+
+def _committed(conn, run, sql, params):
+    #A busy statement leaves its implicit transaction open on a stale
+    #snapshot; roll it back so the retry starts a fresh one
+    try:
+        cursor = run(conn, sql, params)
+        conn.commit()
+    except sqlite3.OperationalError:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return cursor
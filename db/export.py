@@ -0,0 +1,147 @@
+"""Streaming export of the joined article catalogue to CSV or JSON Lines.
+
+One JOIN query is read in `fetchmany` batches and written as it arrives,
+so memory stays flat however large the catalogue is. An export records the
+change log seq it saw as its watermark; passing that back as `since`
+exports only the articles changed or deleted after it, read from the
+change log (db/changelog.sql). Renaming an author or a magazine changes
+every exported row that names it.
+"""
+import os
+import time
+from collections import namedtuple
+
+from db.changelog import ChangelogTruncated
+from db.connection import DEFAULT_FETCH_SIZE, get_provider
+from db.sharding import ShardingError, get_shards
+
+FORMATS = ("csv", "jsonl")
+PROGRESS_EVERY = 100000
+
+COLUMNS = ("article_id", "title", "author_id", "author_name", "magazine_id", "magazine_name", "category")
+CHANGE_COLUMNS = COLUMNS + ("version", "deleted")
+
+ExportResult = namedtuple("ExportResult", ["rows", "seconds", "rows_per_second", "watermark"])
+
+_SELECT = """
+    SELECT ar.article_id, ar.title, ar.author_id, au.name, ar.magazine_id, m.name, m.category
+    FROM articles ar
+    LEFT JOIN authors au ON au.author_id = ar.author_id
+    LEFT JOIN magazines m ON m.magazine_id = ar.magazine_id
+    ORDER BY ar.article_id
+"""
+
+#Deleted articles come back as tombstones: the id, the version and deleted = 1
+_CHANGES = """
+    WITH changed (article_id, seq) AS (
+        SELECT row_id, seq FROM changelog
+        WHERE table_name = 'articles' AND seq > ? AND seq <= ?
+        UNION ALL
+        SELECT ar.article_id, c.seq FROM changelog c JOIN articles ar ON ar.author_id = c.row_id
+        WHERE c.table_name = 'authors' AND c.op != 'insert' AND c.seq > ? AND c.seq <= ?
+        UNION ALL
+        SELECT ar.article_id, c.seq FROM changelog c JOIN articles ar ON ar.magazine_id = c.row_id
+        WHERE c.table_name = 'magazines' AND c.op != 'insert' AND c.seq > ? AND c.seq <= ?
+    )
+    SELECT c.article_id, ar.title, ar.author_id, au.name, ar.magazine_id, m.name, m.category,
+           c.version, ar.article_id IS NULL
+    FROM (SELECT article_id, MAX(seq) AS version FROM changed GROUP BY article_id) c
+    LEFT JOIN articles ar ON ar.article_id = c.article_id
+    LEFT JOIN authors au ON au.author_id = ar.author_id
+    LEFT JOIN magazines m ON m.magazine_id = ar.magazine_id
+    ORDER BY c.version, c.article_id
+"""
+
+
+#csv, gzip and json are imported on first export so the models stay cheap to import
+def _writer(stream, fmt, columns):
+    if fmt == "csv":
+        import csv
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        return writer.writerows
+    import json
+    return lambda rows: stream.writelines(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+    )
+
+
+def _open(target, fmt, compress):
+    """Return (text stream, close) for a path or an open binary/text file"""
+    import gzip
+    if isinstance(target, (str, os.PathLike)):
+        if compress is None:
+            compress = os.fspath(target).endswith(".gz")
+        if compress:
+            stream = gzip.open(target, "wt", encoding="utf-8", newline="")
+        else:
+            stream = open(target, "w", encoding="utf-8", newline="")
+        return stream, stream.close
+    if compress:
+        import io
+        binary = gzip.GzipFile(fileobj=target, mode="wb")
+        stream = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+        return stream, lambda: (stream.flush(), stream.detach(), binary.close())
+    return target, target.flush
+
+
+def export(target, fmt="csv", since=None, compress=None, batch_size=DEFAULT_FETCH_SIZE, progress=None):
+    """Write the catalogue to `target` and return an ExportResult.
+
+    `target` is a path (compressed when it ends in .gz, unless `compress`
+    says otherwise) or an open file. With `since`, only articles changed
+    after that watermark are written, with version and deleted columns;
+    ChangelogTruncated means the log was compacted past it and a full
+    export is needed.
+    `progress(rows, seconds)` is called every PROGRESS_EVERY rows. Sharded
+    articles raise ShardingError.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}; use one of {', '.join(FORMATS)}")
+    if get_shards() is not None:
+        raise ShardingError("exports read the primary's articles, which are empty while articles are sharded")
+    columns = COLUMNS if since is None else CHANGE_COLUMNS
+
+    provider = get_provider()
+    checkout = getattr(provider, "checkout", provider.connection)
+    stream, close = _open(target, fmt, compress)
+    start = time.perf_counter()
+    rows = 0
+    try:
+        with checkout() as conn:
+            #One read transaction, so the rows and the watermark come from the same snapshot
+            owns_transaction = not conn.in_transaction
+            if owns_transaction:
+                conn.execute("BEGIN")
+            try:
+                watermark = conn.execute(
+                    "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changelog'), 0)"
+                ).fetchone()[0]
+                if since is None:
+                    cursor = conn.execute(_SELECT)
+                else:
+                    row = conn.execute("SELECT through_seq FROM changelog_compactions WHERE id = 1").fetchone()
+                    if row and since < row[0]:
+                        raise ChangelogTruncated(
+                            f"changes up to seq {row[0]} were compacted; asked for changes after {since}"
+                        )
+                    cursor = conn.execute(_CHANGES, (since, watermark) * 3)
+                write = _writer(stream, fmt, columns)
+                next_report = PROGRESS_EVERY
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    write(batch)
+                    rows += len(batch)
+                    if progress and rows >= next_report:
+                        progress(rows, time.perf_counter() - start)
+                        next_report += PROGRESS_EVERY
+            finally:
+                if owns_transaction:
+                    conn.rollback()
+    finally:
+        close()
+
+    seconds = time.perf_counter() - start
+    return ExportResult(rows, seconds, rows / seconds if seconds else 0.0, watermark)
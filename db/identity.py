@@ -0,0 +1,203 @@
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+DEFAULT_MAXSIZE = 10000
+
+#Entries a weak map holds before its first sweep for collected instances
+_MIN_SWEEP = 1024
+
+
+class IdentityMap(MutableMapping):
+    """Maps primary keys to the canonical model instance for that row.
+
+    This base class holds strong references, like the plain dicts the models
+    used to keep. `get` is the lookup the models use when hydrating rows, so
+    it is the call that counts hits and misses.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collected = 0
+
+    def __repr__(self):
+        return f"<{type(self).__name__} ({len(self)} instances)>"
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, obj):
+        self._data[key] = obj
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            obj = self[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return obj
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "collected": self.collected,
+        }
+
+
+class WeakIdentityMap(IdentityMap):
+    """Identity map that only remembers instances something else still uses.
+
+    Entries hold plain weak references without a callback, which are
+    several times cheaper to create than KeyedRef. An entry whose instance
+    was garbage collected reads as missing, and dead entries are swept out
+    (and counted in `collected`) whenever the map has doubled since the
+    last sweep, or when `stats()` is called.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._sweep_at = _MIN_SWEEP
+
+    def __getitem__(self, key):
+        obj = self._data[key]()
+        if obj is None:
+            raise KeyError(key)
+        return obj
+
+    def __setitem__(self, key, obj):
+        data = self._data
+        data[key] = weakref.ref(obj)
+        if len(data) > self._sweep_at:
+            self._sweep()
+
+    def get(self, key, default=None):
+        ref = self._data.get(key)
+        obj = ref() if ref is not None else None
+        if obj is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return obj
+
+    def _sweep(self):
+        dead = [key for key, ref in list(self._data.items()) if ref() is None]
+        for key in dead:
+            ref = self._data.get(key)
+            if ref is not None and ref() is None:
+                del self._data[key]
+                self.collected += 1
+        self._sweep_at = max(_MIN_SWEEP, 2 * len(self._data))
+
+    def stats(self):
+        self._sweep()
+        return super().stats()
+
+    def __len__(self):
+        return sum(1 for ref in list(self._data.values()) if ref() is not None)
+
+    def __iter__(self):
+        return iter([key for key, _ in self.items()])
+
+    def items(self):
+        pairs = ((key, ref()) for key, ref in list(self._data.items()))
+        return [(key, obj) for key, obj in pairs if obj is not None]
+
+    def values(self):
+        return [obj for _, obj in self.items()]
+
+
+class LRUIdentityMap(WeakIdentityMap):
+    """Weak identity map that also pins the `maxsize` most recently used instances.
+
+    Instances that fall off the LRU are counted in `evictions` but stay
+    canonical for as long as the caller holds on to them; they are only
+    forgotten once nothing references them.
+
+    Hydration goes through `get` and `__setitem__` for every row, so both
+    are written out in full and take no lock: each OrderedDict call is
+    atomic under the GIL, and a race between two threads can at worst
+    evict one extra instance, which only drops its pin.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        super().__init__()
+        self.maxsize = maxsize
+        self._recent = OrderedDict()
+
+    def __getitem__(self, key):
+        obj = super().__getitem__(key)
+        self._touch(key, obj)
+        return obj
+
+    def __setitem__(self, key, obj):
+        data = self._data
+        data[key] = weakref.ref(obj)
+        if len(data) > self._sweep_at:
+            self._sweep()
+        recent = self._recent
+        recent.pop(key, None)
+        recent[key] = obj
+        if len(recent) > self.maxsize:
+            self._evict()
+
+    def get(self, key, default=None):
+        ref = self._data.get(key)
+        obj = ref() if ref is not None else None
+        if obj is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(key, obj)
+        return obj
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._recent.pop(key, None)
+
+    def clear(self):
+        super().clear()
+        self._recent.clear()
+
+    def _touch(self, key, obj):
+        recent = self._recent
+        recent.pop(key, None)
+        recent[key] = obj
+        if len(recent) > self.maxsize:
+            self._evict()
+
+    def _evict(self):
+        try:
+            self._recent.popitem(last=False)
+        except KeyError:
+            return
+        self.evictions += 1
+
+
+def set_identity_map(model, identity_map):
+    """Install `identity_map` on a model class, carrying over live instances"""
+    previous = model.all
+    if previous is not identity_map:
+        for key, obj in list(previous.items()):
+            identity_map[key] = obj
+        previous.clear()
+    model.all = identity_map
+    return identity_map
@@ -0,0 +1,323 @@
+"""Bulk import of (author, magazine, category, title) records from CSV or JSON Lines.
+
+The file is read as raw bytes and cut into chunks on record boundaries,
+which a process pool parses in parallel. Author and magazine names are
+resolved to ids through an in-memory cache; the names it does not know
+yet go to the database in batched INSERT ... ON CONFLICT (name) DO
+NOTHING RETURNING statements, which create the missing ones. Articles are written in large
+transactions, and each one also records how far into the file it got in
+import_checkpoints, so an interrupted import resumes from the last commit.
+"""
+import os
+import time
+from collections import deque, namedtuple
+
+from db import instrument
+from db.bulk import chunked, upsert_many
+from db.connection import held_transaction, retry_busy, write_connection
+from db.sharding import ShardingError, get_shards
+
+FORMATS = ("csv", "jsonl")
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_CHUNK_LINES = 5000
+
+#Per-statement limit on IN (...) lookups, well under SQLITE_MAX_VARIABLE_NUMBER
+LOOKUP_SIZE = 500
+
+#Input keys accepted for each field; the export's column names work as-is
+FIELDS = {
+    "author": ("author", "author_name"),
+    "magazine": ("magazine", "magazine_name"),
+    "category": ("category",),
+    "title": ("title",),
+}
+
+ImportResult = namedtuple("ImportResult", [
+    "rows", "skipped", "authors_created", "magazines_created", "seconds", "rows_per_second", "resumed_at",
+])
+
+_CHECKPOINTS = """
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source TEXT PRIMARY KEY,
+        offset INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        skipped INTEGER NOT NULL
+    )
+"""
+
+
+def detect_format(path):
+    """"jsonl" for .jsonl/.json files (optionally .gz), otherwise "csv" """
+    name = os.fspath(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return "jsonl" if name.endswith((".jsonl", ".json")) else "csv"
+
+
+def _open(path):
+    if os.fspath(path).endswith(".gz"):
+        import gzip
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_chunks(f, fmt, chunk_lines=DEFAULT_CHUNK_LINES):
+    """Yield (bytes, end offset) chunks of about `chunk_lines` whole records.
+
+    A CSV field may contain newlines inside quotes, so a chunk only ends
+    on a line that leaves an even number of quote characters behind it.
+    """
+    offset = f.tell()
+    lines = []
+    quotes = 0
+    for line in f:
+        lines.append(line)
+        offset += len(line)
+        if fmt == "csv":
+            quotes += line.count(b'"')
+        if len(lines) >= chunk_lines and quotes % 2 == 0:
+            yield b"".join(lines), offset
+            lines = []
+    if lines:
+        yield b"".join(lines), offset
+
+
+def _field(record, names):
+    for name in names:
+        value = record.get(name)
+        if value is not None:
+            value = str(value).strip()
+            return value or None
+    return None
+
+
+def parse_chunk(fmt, header, data):
+    """Parse one chunk into (author, magazine, category, title) tuples.
+
+    Returns (records, rejected); records without a title are rejected.
+    Runs in the worker processes, so it only takes and returns plain data.
+    """
+    text = data.decode("utf-8")
+    if fmt == "csv":
+        import csv
+        import io
+        rows = csv.DictReader(io.StringIO(text, newline=""), fieldnames=header)
+    else:
+        import json
+        rows = (json.loads(line) for line in text.splitlines() if line.strip())
+
+    records = []
+    rejected = 0
+    for row in rows:
+        record = tuple(_field(row, names) for names in FIELDS.values())
+        if record[3] is None:
+            rejected += 1
+        else:
+            records.append(record)
+    return records, rejected
+
+
+def _parsed(chunks, fmt, header, workers):
+    """Yield (records, rejected, end offset) in file order.
+
+    With workers, at most two chunks per worker are in flight so a large
+    file is never read ahead of the writer by more than that.
+    """
+    if not workers:
+        for data, end in chunks:
+            yield (*parse_chunk(fmt, header, data), end)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for data, end in chunks:
+            pending.append((executor.submit(parse_chunk, fmt, header, data), end))
+            if len(pending) >= workers * 2:
+                future, end = pending.popleft()
+                yield (*future.result(), end)
+        while pending:
+            future, end = pending.popleft()
+            yield (*future.result(), end)
+
+
+class NameCache:
+    """name -> id for one table, filled from the database on first use.
+
+    Ids of rows inserted in an uncommitted transaction are staged and only
+    become visible to later batches once `commit()` is called.
+    """
+
+    def __init__(self, table, id_column, columns):
+        self.table = table
+        self.id_column = id_column
+        self.columns = columns
+        self.ids = {}
+        self._staged = {}
+        self.created = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, name):
+        return self._staged.get(name) or self.ids.get(name)
+
+    def resolve(self, conn, rows):
+        """Find or create the row each of `rows` names, tuples in `columns` order starting with the name.
+
+        A row with a None value cannot be inserted, so its name is only
+        looked up. Must run inside the caller's transaction.
+        """
+        rows = [row for row in rows if self.get(row[0]) is None]
+        if not rows:
+            return
+        newest = instrument.execute(
+            conn, f"SELECT COALESCE(MAX({self.id_column}), 0) FROM {self.table}"
+        ).fetchone()[0]
+        found = upsert_many(self.table, "name", self.columns, [row for row in rows if None not in row])
+        lookup = [row[0] for row in rows if row[0] not in found]
+        for group in chunked(lookup, LOOKUP_SIZE):
+            sql = f"SELECT * FROM {self.table} WHERE name IN ({', '.join('?' for _ in group)})"
+            found.update((row[1], row) for row in instrument.execute(conn, sql, group).fetchall())
+        self._staged.update((name, row[0]) for name, row in found.items())
+        self.created += sum(row[0] > newest for row in found.values())
+
+    def commit(self):
+        self.ids.update(self._staged)
+        self._staged.clear()
+
+    def rollback(self, created):
+        self._staged.clear()
+        self.created = created
+
+
+class Importer:
+    """Write parsed records to the database in checkpointed batches"""
+
+    def __init__(self, source):
+        self.source = source
+        self.authors = NameCache("authors", "author_id", ("name",))
+        self.magazines = NameCache("magazines", "magazine_id", ("name", "category"))
+
+    def checkpoint(self):
+        """Return (offset, rows, skipped) committed for this source so far"""
+        with write_connection() as conn:
+            conn.execute(_CHECKPOINTS)
+            row = conn.execute(
+                "SELECT offset, rows, skipped FROM import_checkpoints WHERE source = ?", (self.source,)
+            ).fetchone()
+        return row or (0, 0, 0)
+
+    def forget(self):
+        with write_connection() as conn:
+            conn.execute(_CHECKPOINTS)
+            conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (self.source,))
+            conn.commit()
+
+    def write(self, records, offset, rows, skipped):
+        """Insert one batch and move the checkpoint to `offset` in a single transaction.
+
+        `rows` and `skipped` are the totals committed before this batch.
+        Returns (articles written, records dropped because they named a new
+        magazine that no record in the batch gave a category for).
+        """
+        #Held, so upsert_many joins the batch's transaction instead of committing it
+        with held_transaction() as conn:
+            return retry_busy(self._write, conn, records, offset, rows, skipped)
+
+    def _write(self, conn, records, offset, rows, skipped):
+        created = (self.authors.created, self.magazines.created)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.authors.resolve(conn, [(name,) for name in dict.fromkeys(r[0] for r in records if r[0])])
+            #A new magazine takes the first category the batch gives it; without one it cannot be created
+            categories = {}
+            for _, magazine, category, _ in records:
+                if magazine and categories.get(magazine) is None:
+                    categories[magazine] = category
+            self.magazines.resolve(conn, list(categories.items()))
+
+            articles = []
+            dropped = 0
+            for author, magazine, category, title in records:
+                magazine_id = self.magazines.get(magazine) if magazine else None
+                if magazine and magazine_id is None:
+                    dropped += 1
+                    continue
+                articles.append((title, self.authors.get(author) if author else None, magazine_id))
+            instrument.executemany(
+                conn, "INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, ?)", articles
+            )
+            instrument.execute(conn, """
+                INSERT INTO import_checkpoints (source, offset, rows, skipped) VALUES (?, ?, ?, ?)
+                ON CONFLICT (source) DO UPDATE
+                SET offset = excluded.offset, rows = excluded.rows, skipped = excluded.skipped
+            """, (self.source, offset, rows + len(articles), skipped + dropped))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            self.authors.rollback(created[0])
+            self.magazines.rollback(created[1])
+            raise
+        self.authors.commit()
+        self.magazines.commit()
+        return len(articles), dropped
+
+
+def import_file(path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, workers=None,
+                chunk_lines=DEFAULT_CHUNK_LINES, restart=False, progress=None):
+    """Import a CSV or JSON Lines file (optionally gzipped) and return an ImportResult.
+
+    CSV files need a header row. Each record has a title and optionally an
+    author, a magazine and the magazine's category; unknown authors and
+    magazines are created. Re-running an interrupted import continues
+    after its last committed batch unless `restart` is set. `workers`
+    defaults to one parser process per CPU; 0 parses in this process.
+    `progress(rows, seconds)` is called after every committed batch.
+    Sharded articles raise ShardingError.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown import format {fmt!r}; use one of {', '.join(FORMATS)}")
+    if get_shards() is not None:
+        raise ShardingError("imports write the primary's articles, which are empty while articles are sharded")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    importer = Importer(os.path.abspath(path))
+    if restart:
+        importer.forget()
+    resumed_at, rows, skipped = importer.checkpoint()
+    rows_before, skipped_before = rows, skipped
+    start = time.perf_counter()
+
+    with _open(path) as f:
+        header = None
+        offset = resumed_at
+        if fmt == "csv":
+            import csv
+            first = f.readline()
+            header = next(csv.reader([first.decode("utf-8-sig")]), [])
+            offset = max(offset, len(first))
+        f.seek(offset)
+
+        batch = []
+        committed = offset
+        for records, rejected, offset in _parsed(read_chunks(f, fmt, chunk_lines), fmt, header, workers):
+            batch.extend(records)
+            skipped += rejected
+            if len(batch) >= batch_size:
+                written, dropped = importer.write(batch, offset, rows, skipped)
+                rows, skipped, committed, batch = rows + written, skipped + dropped, offset, []
+                if progress:
+                    progress(rows - rows_before, time.perf_counter() - start)
+        if offset > committed or resumed_at == 0:
+            written, dropped = importer.write(batch, offset, rows, skipped)
+            rows, skipped = rows + written, skipped + dropped
+
+    seconds = time.perf_counter() - start
+    imported = rows - rows_before
+    return ImportResult(
+        imported, skipped - skipped_before, importer.authors.created, importer.magazines.created,
+        seconds, imported / seconds if seconds else 0.0, resumed_at,
+    )
@@ -0,0 +1,245 @@
+"""Per-statement query metrics for the model layer.
+
+Every statement the db helpers run is recorded with the model method that
+issued it, its normalized SQL, latency and row count. Totals are kept per
+(method, SQL) pair; `count_queries()` collects the individual statements
+of one block, and statements slower than the slow-query threshold are
+logged to the "db.queries" logger together with their query plan.
+"""
+import contextlib
+import contextvars
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+LOGGER = "db.queries"
+
+Query = namedtuple("Query", ["method", "sql", "ms", "rows"])
+
+_DB_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_CONTEXTLIB = contextlib.__file__
+_slow_query_ms = DEFAULT_SLOW_QUERY_MS
+_scopes = contextvars.ContextVar("query_scopes", default=())
+
+
+class QueryStats:
+    __slots__ = ("count", "total_ms", "max_ms", "rows")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+
+class Metrics:
+    """Running totals per (method, normalized SQL), shared by all threads"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, method, sql, ms, rows):
+        key = (method, sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats()
+            stats.count += 1
+            stats.total_ms += ms
+            stats.rows += rows
+            if ms > stats.max_ms:
+                stats.max_ms = ms
+
+    def snapshot(self):
+        """Return one dict per (method, SQL), most total time first"""
+        with self._lock:
+            items = [
+                {"method": method, "sql": sql, "count": s.count, "total_ms": s.total_ms,
+                 "mean_ms": s.total_ms / s.count, "max_ms": s.max_ms, "rows": s.rows}
+                for (method, sql), s in self._stats.items()
+            ]
+        return sorted(items, key=lambda item: item["total_ms"], reverse=True)
+
+    def by_method(self):
+        """Return {method: (statements, total ms)} summed over every SQL"""
+        totals = {}
+        for item in self.snapshot():
+            count, ms = totals.get(item["method"], (0, 0.0))
+            totals[item["method"]] = (count + item["count"], ms + item["total_ms"])
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+metrics = Metrics()
+
+
+class QueryLog(list):
+    """The statements run inside one `count_queries()` block"""
+
+    @property
+    def count(self):
+        return len(self)
+
+    @property
+    def total_ms(self):
+        return sum(query.ms for query in self)
+
+    def by_method(self):
+        return Counter(query.method for query in self)
+
+
+def set_slow_query_ms(ms):
+    """Log statements slower than `ms` (None turns the log off); returns the old value"""
+    global _slow_query_ms
+    previous, _slow_query_ms = _slow_query_ms, ms
+    return previous
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    """Collapse whitespace and literals so equivalent statements share a key"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return re.sub(r"\bIN \(\?(?:, ?\?)*\)", "IN (?...)", sql, flags=re.IGNORECASE)
+
+
+def caller(depth=2):
+    """Return "Class.method" of the nearest frame outside the db package.
+
+    contextlib frames are skipped too, so statements run when a `with`
+    block exits are charged to the method that opened it.
+    """
+    frame = sys._getframe(depth)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_DB_DIR) and filename != _CONTEXTLIB:
+            code = frame.f_code
+            #co_qualname is new in Python 3.11; older versions only name the function
+            return getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return "<unknown>"
+
+
+def record(conn, sql, params, elapsed, rows):
+    """Record one statement that took `elapsed` seconds and returned or changed `rows`"""
+    ms = elapsed * 1000
+    method = caller()
+    normalized = normalize(sql)
+    metrics.add(method, normalized, ms, rows)
+
+    scopes = _scopes.get()
+    if scopes:
+        query = Query(method, normalized, ms, rows)
+        for log in scopes:
+            log.append(query)
+
+    if _slow_query_ms is not None and ms >= _slow_query_ms:
+        #logging is only imported once something is slow enough to log
+        import logging
+        logger = logging.getLogger(LOGGER)
+        #The plan costs an extra EXPLAIN, so only run it when the warning will be emitted
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning("slow query in %s (%.1f ms, %d rows): %s\n%s",
+                           method, ms, rows, normalized, "\n".join(plan(conn, sql, params)))
+
+
+def plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN lines for a statement, or the reason there are none"""
+    if not sql.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+        return []
+    try:
+        return ["    " + row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    except sqlite3.Error as e:
+        return [f"    (no plan: {e})"]
+
+
+class FetchedCursor:
+    """The rows of a statement, fetched up front so they could be counted and timed.
+
+    It reads like the sqlite3.Cursor it came from.
+    """
+
+    __slots__ = ("description", "rowcount", "lastrowid", "_rows")
+
+    def __init__(self, cursor, rows):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        self._rows = iter(rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=1):
+        return list(islice(self._rows, size))
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        self._rows = iter(())
+
+
+def execute(conn, sql, params=()):
+    """conn.execute, recorded with the rows it returned or, failing that, changed.
+
+    A statement that returns rows (a SELECT, or a write with RETURNING) is
+    fetched to the end here, since SQLite does most of its work while the
+    rows are stepped through; the rows come back in a FetchedCursor.
+    """
+    start = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    if cursor.description is None:
+        record(conn, sql, params, time.perf_counter() - start, max(cursor.rowcount, 0))
+        return cursor
+    rows = cursor.fetchall()
+    record(conn, sql, params, time.perf_counter() - start, len(rows))
+    return FetchedCursor(cursor, rows)
+
+
+def executemany(conn, sql, seq_of_params):
+    """conn.executemany, recorded once with the total rows changed"""
+    seq_of_params = list(seq_of_params)
+    start = time.perf_counter()
+    cursor = conn.executemany(sql, seq_of_params)
+    record(conn, sql, seq_of_params[0] if seq_of_params else (), time.perf_counter() - start,
+           max(cursor.rowcount, 0))
+    return cursor
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements run in this block, in this thread or task"""
+    log = QueryLog()
+    token = _scopes.set(_scopes.get() + (log,))
+    try:
+        yield log
+    finally:
+        _scopes.reset(token)
+
+
+@contextmanager
+def max_queries(limit):
+    """Fail with AssertionError if the block runs more than `limit` statements"""
+    with count_queries() as log:
+        yield log
+    if log.count > limit:
+        lines = "\n".join(f"  {query.method}: {query.sql}" for query in log)
+        raise AssertionError(f"expected at most {limit} queries, ran {log.count}:\n{lines}")
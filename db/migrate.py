@@ -0,0 +1,74 @@
+"""Bring a database made before the stats, search and change log tables up to date.
+
+Each of those features ships its own script in db/, which
+Article.create_table runs for a new database. An existing one, like the
+articles.db in the repository, has none of their tables, so top_author,
+article_counts, search, exports and the change log fail with "no such
+table". `upgrade()` runs every script (they only create what is missing)
+and fills the tables it created from the articles already there.
+
+Such a database also lacks the unique name indexes get_or_create, upsert
+and the importer rely on, so `upgrade()` merges duplicate names and
+builds them too (see db.natural_keys).
+
+The default pool upgrades its database once, when it first opens it.
+Databases opened some other way can run scripts/upgrade_db.py.
+"""
+from db.changelog import create_changelog
+from db.natural_keys import NATURAL_KEYS, merge_names, missing_indexes
+from db.search import create_search
+from db.stats import EXPECTED, create_stats
+
+#The table whose absence means a feature was never installed, and its script
+FEATURES = (
+    ("author_stats", create_stats),
+    ("articles_fts", create_search),
+    ("changelog", create_changelog),
+)
+
+
+def missing_tables(conn):
+    """The feature tables `conn`'s database does not have yet"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [table for table, _ in FEATURES if table not in tables]
+
+
+def upgrade(conn):
+    """Create the missing feature tables, triggers and unique name indexes, then backfill them.
+
+    Returns the tables created, followed by the unique indexes built. A
+    database without an articles table is left alone; setting it up with
+    the models' create_table creates everything.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'articles'").fetchone() is None:
+        return []
+    missing = missing_tables(conn)
+    unindexed = missing_indexes(conn)
+    if not missing and not unindexed:
+        return []
+
+    #Merging moves articles between authors and magazines; the search triggers can't follow that before the rebuild
+    try:
+        merge_names(conn, unindexed)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    #The change log goes last, so the backfill is not logged as a change to every pair
+    for table, create in FEATURES[:-1]:
+        create(conn)
+    try:
+        #The triggers are already counting new writes; these recount everything
+        if "author_stats" in missing:
+            for table, expected in EXPECTED.items():
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"INSERT INTO {table} {expected}")
+        if "articles_fts" in missing:
+            conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    create_changelog(conn)
+    return missing + [NATURAL_KEYS[table][2] for table in unindexed]
@@ -0,0 +1,92 @@
+"""Unique author and magazine names for databases created before they were enforced.
+
+get_or_create and upsert rely on unique indexes on authors.name and
+magazines.name. An older database may hold duplicate names, which have to
+be merged before the index can be built: each name keeps its lowest id,
+and the articles of the other rows are moved to it. A merged magazine
+keeps the category of that row; `category_conflicts()` lists the names
+whose rows disagree, so they can be checked before or after the merge.
+
+db.migrate.upgrade merges and builds the indexes when they are missing,
+so the default pool does this on its own; scripts/unique_names.py runs
+it for databases opened some other way.
+"""
+from db.connection import fetchall, held_transaction
+
+#table -> (id column, the articles column that references it, unique index)
+NATURAL_KEYS = {
+    "authors": ("author_id", "author_id", "idx_authors_name"),
+    "magazines": ("magazine_id", "magazine_id", "idx_magazines_name"),
+}
+
+
+def duplicate_names():
+    """Return {table: number of rows whose name an older row already has}"""
+    counts = {}
+    for table in NATURAL_KEYS:
+        counts[table] = fetchall(f"SELECT COUNT(*) - COUNT(DISTINCT name) FROM {table}")[0][0]
+    return counts
+
+
+def category_conflicts():
+    """Return {magazine name: [categories]} for duplicate names whose rows differ in category.
+
+    Categories are in magazine_id order, so the first is the one
+    `enforce_unique_names` keeps.
+    """
+    rows = fetchall("""
+        SELECT name, category FROM magazines
+        WHERE name IN (SELECT name FROM magazines GROUP BY name HAVING COUNT(DISTINCT category) > 1)
+        ORDER BY name, magazine_id
+    """)
+    conflicts = {}
+    for name, category in rows:
+        categories = conflicts.setdefault(name, [])
+        if category not in categories:
+            categories.append(category)
+    return conflicts
+
+
+def missing_indexes(conn):
+    """The tables in `conn`'s database whose name has no unique index yet"""
+    missing = []
+    for table, (_, _, index) in NATURAL_KEYS.items():
+        unique = {row[1] for row in conn.execute(f"PRAGMA index_list({table})") if row[2]}
+        if index not in unique:
+            missing.append(table)
+    return missing
+
+
+def merge_names(conn, tables=tuple(NATURAL_KEYS)):
+    """Merge duplicate names in `tables` and build their unique indexes on `conn`, leaving the commit to the caller.
+
+    Returns {table: rows merged}.
+    """
+    merged = {}
+    for table in tables:
+        id_column, reference, index = NATURAL_KEYS[table]
+        keep = f"""
+            SELECT MIN(k.{id_column}) FROM {table} d JOIN {table} k ON k.name = d.name
+            WHERE d.{id_column} = articles.{reference}
+        """
+        duplicates = f"""
+            SELECT d.{id_column} FROM {table} d
+            WHERE EXISTS (SELECT 1 FROM {table} k WHERE k.name = d.name AND k.{id_column} < d.{id_column})
+        """
+        conn.execute(f"UPDATE articles SET {reference} = ({keep}) WHERE {reference} IN ({duplicates})")
+        merged[table] = conn.execute(f"DELETE FROM {table} WHERE {id_column} IN ({duplicates})").rowcount
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+        conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} (name)")
+    return merged
+
+
+def enforce_unique_names():
+    """Merge duplicate names and build the unique name indexes; returns {table: rows merged}"""
+    with held_transaction() as conn:
+        try:
+            merged = merge_names(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return merged
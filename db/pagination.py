@@ -0,0 +1,88 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from db.connection import fetchall
+
+DEFAULT_PAGE_SIZE = 20
+
+Page = namedtuple("Page", ["items", "next_token"])
+
+
+def encode_token(order_by, value, row_id):
+    payload = json.dumps([order_by, value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_token(token, order_by):
+    """Return the (value, id) a page token continues after"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        token_order, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("invalid page token") from None
+    if token_order != order_by:
+        raise ValueError(f"page token was issued for order_by={token_order!r}, not {order_by!r}")
+    return value, row_id
+
+
+def page_sql(table, id_column, order_by, filters=(), after=False):
+    """Build the keyset query for one page.
+
+    `order_by` is a column name, prefixed with "-" for descending order.
+    Ties on a non-unique column are broken by the primary key, so the
+    query walks an index on (filters..., column) and never uses OFFSET.
+    """
+    descending = order_by.startswith("-")
+    column = order_by.lstrip("-")
+    direction = "DESC" if descending else "ASC"
+    where = [f"{name} = ?" for name in filters]
+
+    if after:
+        op = "<" if descending else ">"
+        if column == id_column:
+            where.append(f"{id_column} {op} ?")
+        else:
+            where.append(f"({column}, {id_column}) {op} (?, ?)")
+
+    if column == id_column:
+        order = f"{id_column} {direction}"
+    else:
+        order = f"{column} {direction}, {id_column} {direction}"
+
+    return f"""
+        SELECT * FROM {table}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order}
+        LIMIT ?
+    """
+
+
+def fetch_page(cls, order_by, allowed, filters=None, after=None, limit=DEFAULT_PAGE_SIZE, fetch=fetchall):
+    """Return a Page of `cls` instances and the token for the page after it.
+
+    `fetch(sql, params)` runs the page query; sharded articles pass one
+    that runs it on every shard and merges the results.
+    """
+    if limit < 1:
+        raise ValueError(f"a page holds at least one row, not limit={limit!r}")
+    filters = filters or {}
+    column = order_by.lstrip("-")
+    if column not in allowed:
+        raise ValueError(f"{cls.__name__} pages can be ordered by {', '.join(allowed)}, not {order_by!r}")
+
+    params = list(filters.values())
+    if after is not None:
+        value, row_id = decode_token(after, order_by)
+        params += [row_id] if column == cls.id_column else [value, row_id]
+
+    sql = page_sql(cls.table_name, cls.id_column, order_by, filters, after is not None)
+    rows = fetch(sql, params + [limit + 1])
+
+    items = [cls.instance_from_db(row) for row in rows[:limit]]
+    next_token = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_token = encode_token(order_by, getattr(last, column), getattr(last, cls.id_column))
+    return Page(items, next_token)
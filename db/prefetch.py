@@ -0,0 +1,59 @@
+from db.bulk import chunked
+from db.connection import fetchall
+
+#SQLite's default SQLITE_MAX_VARIABLE_NUMBER is 999 on older builds
+MAX_IN_PARAMS = 900
+
+
+def fetch_in(sql, ids, params=()):
+    """Run `sql` once per chunk of `ids`, expanding its {ids} slot to placeholders"""
+    rows = []
+    for chunk in chunked(ids, MAX_IN_PARAMS):
+        placeholders = ", ".join("?" for _ in chunk)
+        rows.extend(fetchall(sql.format(ids=placeholders), tuple(params) + tuple(chunk)))
+    return rows
+
+
+def attach(instances, id_column, relation, rows, hydrate):
+    """Group `rows` by their first column and store them on the matching instances.
+
+    Instances with no related rows get an empty list, so the relation
+    method does not fall back to a query for them.
+    """
+    related = {getattr(obj, id_column): [] for obj in instances}
+    for row in rows:
+        related[row[0]].append(hydrate(row))
+    for obj in instances:
+        if obj._prefetched is None:
+            obj._prefetched = {}
+        obj._prefetched[relation] = related[getattr(obj, id_column)]
+
+
+def group_rows(ids, rows, hydrate):
+    """Group `rows` by their first column into {id: [hydrate(row), ...]}.
+
+    Every id in `ids` gets an entry. A row whose second column is NULL,
+    as an outer join with nothing to join produces, only adds its id.
+    Rows are hydrated once per distinct second column, so an object
+    related to many ids is shared instead of rebuilt for each.
+    """
+    grouped = {key: [] for key in ids}
+    hydrated = {}
+    for row in rows:
+        related = grouped.setdefault(row[0], [])
+        if row[1] is not None:
+            obj = hydrated.get(row[1])
+            if obj is None:
+                obj = hydrated[row[1]] = hydrate(row)
+            related.append(obj)
+    return grouped
+
+
+def load_relations(cls, instances, relations):
+    """Load each named relation for all `instances` with one batched query"""
+    for relation in relations or ():
+        loader = getattr(cls, f"prefetch_{relation}", None)
+        if loader is None:
+            raise ValueError(f"{cls.__name__} has no relation named {relation!r}")
+        loader(instances)
+    return instances
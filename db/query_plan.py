@@ -0,0 +1,148 @@
+"""EXPLAIN QUERY PLAN checks for the SQL the models run.
+
+Run `python -m db.query_plan [database]` to print every plan; it exits
+non-zero when a statement falls back to a full scan of a large table.
+"""
+import ast
+import glob
+import os
+import re
+import sqlite3
+import sys
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, "db", "schema.sql")
+STATS = os.path.join(ROOT, "db", "stats.sql")
+SEARCH = os.path.join(ROOT, "db", "search.sql")
+CHANGELOG = os.path.join(ROOT, "db", "changelog.sql")
+MODEL_FILES = sorted(glob.glob(os.path.join(ROOT, "lib", "models", "*.py")))
+
+#Tables that grow with the data; magazines stays small enough to scan
+LARGE_TABLES = {"articles", "authors"}
+
+#Methods whose job is to read a whole table
+FULL_SCANS_ALLOWED = {
+    "Article.get_all",
+    "Author.get_all",
+    "Magazine.get_all",
+    "Article.iter_all",
+    "Author.iter_all",
+    "Magazine.iter_all",
+    "Author.topic_areas_for",
+    "Author.magazines_for",
+    "Author._sharded_pairs",
+}
+
+SQL_CALLS = {"fetchone", "fetchall", "iterate", "execute", "executemany"}
+
+Statement = namedtuple("Statement", ["location", "path", "lineno", "sql"])
+
+
+def collect_statements(paths=MODEL_FILES):
+    """Find the SQL assigned to `sql` or passed to the query helpers"""
+    statements = []
+    for path in paths:
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for cls in (node for node in tree.body if isinstance(node, ast.ClassDef)):
+            for func in ast.walk(cls):
+                if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    continue
+                for node in ast.walk(func):
+                    sql = _sql_literal(node)
+                    if sql and sql.strip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                        statements.append(Statement(f"{cls.name}.{func.name}", path, node.lineno, sql))
+    return statements
+
+
+def _sql_literal(node):
+    if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "sql" for t in node.targets):
+        value = node.value
+    elif isinstance(node, ast.Call) and getattr(node.func, "id", None) in SQL_CALLS and node.args:
+        value = node.args[0]
+    else:
+        return None
+
+    #Interpolated parts are placeholder lists, so a single ? stands in
+    if isinstance(value, ast.Constant) and isinstance(value.value, str):
+        return re.sub(r"\{\w+\}", "?", value.value)
+    if isinstance(value, ast.JoinedStr):
+        return "".join(
+            part.value if isinstance(part, ast.Constant) else "?"
+            for part in value.values
+        )
+    return None
+
+
+def explain(conn, sql):
+    params = (None,) * sql.count("?")
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def scanned_tables(sql, plan):
+    """Return the tables a plan reads in full, resolving aliases from the SQL"""
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        aliases[table] = table
+        if alias and alias.upper() not in {"WHERE", "JOIN", "LEFT", "INNER", "ON", "GROUP", "ORDER", "LIMIT"}:
+            aliases[alias] = table
+
+    tables = []
+    for detail in plan:
+        match = re.match(r"SCAN (\w+)", detail)
+        if match:
+            tables.append(aliases.get(match.group(1), match.group(1)))
+    return tables
+
+
+def schema_connection():
+    conn = sqlite3.connect(":memory:")
+    for path in (SCHEMA, STATS, SEARCH, CHANGELOG):
+        with open(path) as f:
+            conn.executescript(f.read())
+    return conn
+
+
+def check(conn=None, statements=None):
+    """Return a list of problems, empty when every plan is acceptable"""
+    conn = conn or schema_connection()
+    problems = []
+    for statement in statements or collect_statements():
+        try:
+            plan = explain(conn, statement.sql)
+        except sqlite3.Error as e:
+            problems.append(f"{statement.location} (line {statement.lineno}): cannot be planned: {e}")
+            continue
+        if statement.location in FULL_SCANS_ALLOWED:
+            continue
+        for table in scanned_tables(statement.sql, plan):
+            if table in LARGE_TABLES:
+                problems.append(
+                    f"{statement.location} (line {statement.lineno}): full scan of {table}: " +
+                    "; ".join(plan)
+                )
+    return problems
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    conn = sqlite3.connect(argv[0]) if argv else schema_connection()
+
+    for statement in collect_statements():
+        try:
+            plan = explain(conn, statement.sql)
+        except sqlite3.Error as e:
+            plan = [f"error: {e}"]
+        print(f"{statement.location} (line {statement.lineno})")
+        for detail in plan:
+            print(f"    {detail}")
+
+    problems = check(conn)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
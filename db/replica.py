@@ -0,0 +1,200 @@
+"""Serve model reads from an in-memory copy of the database.
+
+`MemoryReplica` copies its primary into a shared in-memory database with
+SQLite's online backup API and hands out read-only connections to it.
+Writes go to the primary (`writes="forward"`) or raise ReplicaReadOnly
+(`writes="reject"`). It is a connection provider like ConnectionPool, so
+`use_replica()` switches the models over without touching call sites.
+
+A refresh copies the primary into a new in-memory database and swaps it
+in: reads already running finish on the old copy, which is freed once its
+last connection closes. Forwarded writes show up after the next refresh.
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from db.connection import get_provider, set_provider
+
+WRITE_MODES = ("forward", "reject")
+
+#Names the in-memory databases, which are shared by every connection in the process
+_names = itertools.count(1)
+
+
+class ReplicaReadOnly(sqlite3.OperationalError):
+    """Raised for a write to a replica that rejects writes"""
+
+
+class _ReplicaConnection(sqlite3.Connection):
+    """A connection that remembers which copy it reads"""
+
+
+class MemoryReplica:
+    """Read-only connections to an in-memory copy of `primary`.
+
+    `primary` is the provider the copy is taken from and forwarded writes
+    go to. With `refresh_interval`, a read that finds the copy older than
+    that many seconds refreshes it first; `refresh()` does it on demand.
+    """
+
+    def __init__(self, primary, writes="forward", refresh_interval=None):
+        if writes not in WRITE_MODES:
+            raise ValueError(f"unknown write mode {writes!r}; use one of {', '.join(WRITE_MODES)}")
+        self.primary = primary
+        self.writes = writes
+        self.refresh_interval = refresh_interval
+        self.refreshes = 0
+        self.loaded_at = None
+        self.load_seconds = None
+        self._uri = None
+        self._keeper = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._local = threading.local()
+        self.refresh()
+
+    def __repr__(self):
+        return f"<MemoryReplica of {self.primary!r} ({self.writes} writes, {self.refreshes} loads)>"
+
+    def refresh(self):
+        """Copy the primary again and send new reads to the copy; returns the seconds it took"""
+        with self._refresh_lock:
+            return self._load()
+
+    def _refresh_if_stale(self):
+        if self.refresh_interval is None or time.monotonic() - self.loaded_at < self.refresh_interval:
+            return
+        #One thread reloads; the others keep reading the current copy meanwhile
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self.loaded_at >= self.refresh_interval:
+                self._load()
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self):
+        start = time.perf_counter()
+        uri = f"file:articles-replica-{next(_names)}?mode=memory&cache=shared"
+        #The keeper connection is what keeps the in-memory database alive
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            with self.primary.connection() as source:
+                source.backup(keeper)
+        except BaseException:
+            keeper.close()
+            raise
+        with self._lock:
+            previous, self._keeper, self._uri = self._keeper, keeper, uri
+            idle, self._idle = self._idle, []
+            self.loaded_at = time.monotonic()
+        for conn in idle:
+            conn.close()
+        if previous is not None:
+            previous.close()
+        self.refreshes += 1
+        self.load_seconds = time.perf_counter() - start
+        return self.load_seconds
+
+    def connect(self):
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False, factory=_ReplicaConnection)
+        conn.uri = self._uri
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def checkout(self):
+        """Take a replica connection without binding it to this thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def writer(self):
+        """The primary's connection, or ReplicaReadOnly when writes are rejected"""
+        if self.writes == "reject":
+            raise ReplicaReadOnly("this replica rejects writes; write through the primary")
+        with self.primary.connection() as conn:
+            yield conn
+
+    def _checkout(self):
+        self._refresh_if_stale()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        #A connection to a copy that has since been replaced is not reused
+        with self._lock:
+            if conn.uri == self._uri:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def settings(self):
+        """Describe the replica; the in-memory copy has none of the file PRAGMAs to report"""
+        with self.connection() as conn:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+            return {
+                "database": f"memory replica of {getattr(self.primary, 'database', self.primary)}",
+                "writes": self.writes,
+                "refresh_interval": self.refresh_interval,
+                "bytes": pages,
+            }
+
+    def close(self):
+        """Close the idle connections and release the copy once the busy ones finish"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            keeper, self._keeper, self._uri = self._keeper, None, None
+        for conn in idle:
+            conn.close()
+        if keeper is not None:
+            keeper.close()
+
+
+def use_replica(writes="forward", refresh_interval=None):
+    """Serve the models' reads from an in-memory copy of the current database.
+
+    Returns the MemoryReplica, now the active provider; `stop_replica()`
+    switches back to the primary.
+    """
+    replica = MemoryReplica(get_provider(), writes, refresh_interval)
+    set_provider(replica)
+    return replica
+
+
+def stop_replica():
+    provider = get_provider()
+    if isinstance(provider, MemoryReplica):
+        set_provider(provider.primary)
+        provider.close()
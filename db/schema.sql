@@ -24,4 +24,18 @@ CREATE TABLE articles (
     magazine_id INTEGER,
     FOREIGN KEY (author_id) REFERENCES authors(author_id),
     FOREIGN KEY (magazine_id) REFERENCES magazines(magazine_id)
-);
\ No newline at end of file
+);
+
+-- Secondary indexes for the model lookups and relationship joins
+CREATE UNIQUE INDEX idx_authors_name ON authors (name);
+CREATE UNIQUE INDEX idx_magazines_name ON magazines (name);
+CREATE INDEX idx_magazines_category ON magazines (category);
+CREATE INDEX idx_articles_title ON articles (title);
+CREATE INDEX idx_articles_author_magazine ON articles (author_id, magazine_id);
+CREATE INDEX idx_articles_magazine_author ON articles (magazine_id, author_id);
+
+-- Keyset pagination walks these in (filter, sort key, article_id) order
+CREATE INDEX idx_articles_author ON articles (author_id, article_id);
+CREATE INDEX idx_articles_magazine ON articles (magazine_id, article_id);
+CREATE INDEX idx_articles_author_title ON articles (author_id, title);
+CREATE INDEX idx_articles_magazine_title ON articles (magazine_id, title);
\ No newline at end of file
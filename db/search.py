@@ -0,0 +1,104 @@
+import os
+import re
+from collections import namedtuple
+
+from db.connection import connection, fetchall, fetchone
+
+SEARCH_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search.sql")
+DEFAULT_SEARCH_LIMIT = 20
+HIGHLIGHT = ("[", "]")
+SNIPPET_TOKENS = 12
+
+SearchResult = namedtuple("SearchResult", ["article", "snippet", "score"])
+
+#A word, optionally ending in * for a prefix match
+_TERM = re.compile(r"(\w+)(\*?)")
+
+
+def create_search(conn=None):
+    """Create the full-text index and its triggers if they are missing"""
+    with open(SEARCH_SQL) as f:
+        script = f.read()
+    if conn is not None:
+        conn.executescript(script)
+        return
+    with connection() as conn:
+        conn.executescript(script)
+
+
+def drop_search():
+    """Drop the full-text index; its triggers go with the articles table"""
+    with connection() as conn:
+        conn.execute("DROP TABLE IF EXISTS articles_fts")
+        conn.commit()
+
+
+def rebuild_search():
+    """Re-index every article title, then merge the index into one segment"""
+    create_search()
+    with connection() as conn:
+        conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('optimize')")
+        conn.commit()
+
+
+def match_expression(query, magazine_id=None, author_id=None):
+    """Turn what an editor typed into an FTS5 query that cannot fail to parse.
+
+    Every word must appear in the title; a word ending in * matches as a
+    prefix. All other punctuation is dropped, so quotes and operators are
+    never interpreted. Returns None when the query has no words at all.
+    """
+    terms = [f'"{word}"{star}' for word, star in _TERM.findall(query)]
+    if not terms:
+        return None
+    expression = f"title : ({' AND '.join(terms)})"
+    if magazine_id is not None:
+        expression += f' AND magazine_id : "{int(magazine_id)}"'
+    if author_id is not None:
+        expression += f' AND author_id : "{int(author_id)}"'
+    return expression
+
+
+def search_titles(cls, query, magazine_id=None, author_id=None, limit=DEFAULT_SEARCH_LIMIT,
+                  candidates=None, highlight=HIGHLIGHT):
+    """Return up to `limit` SearchResults for `query`, best BM25 match first.
+
+    Every match is ranked by default. BM25 costs a few microseconds per
+    matching row, so a caller that can live with approximate results for
+    broad queries may pass `candidates`: only the newest `candidates`
+    matches are then ranked, and older, better matches are left out.
+    """
+    expression = match_expression(query, magazine_id, author_id)
+    if expression is None:
+        return []
+
+    where = "articles_fts MATCH ?"
+    params = [expression]
+    if candidates is not None:
+        sql = """
+            SELECT rowid FROM articles_fts
+            WHERE articles_fts MATCH ?
+            ORDER BY rowid DESC
+            LIMIT 1 OFFSET ?
+        """
+        cutoff = fetchone(sql, (expression, candidates - 1))
+        if cutoff is not None:
+            where += " AND rowid >= ?"
+            params.append(cutoff[0])
+
+    #rank is bm25() over the title alone: negative, and lower is better
+    sql = f"""
+        SELECT a.*, f.snippet, f.score
+        FROM (
+            SELECT rowid, snippet(articles_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet, -rank AS score
+            FROM articles_fts
+            WHERE {where}
+            ORDER BY rank
+            LIMIT ?
+        ) f
+        JOIN articles a ON a.article_id = f.rowid
+        ORDER BY f.score DESC
+    """
+    rows = fetchall(sql, [highlight[0], highlight[1]] + params + [limit])
+    return [SearchResult(cls.instance_from_db(row), row[-2], row[-1]) for row in rows]
@@ -0,0 +1,39 @@
+-- Full-text index over article titles. It is an external-content table:
+-- the text lives in articles and the triggers below keep the index in step.
+-- Rebuild it from scratch with scripts/rebuild_search.py.
+--
+-- author_id and magazine_id are indexed as tokens too, so a filtered search
+-- intersects posting lists inside FTS5 instead of joining every match back
+-- to articles. The rank below gives them no weight.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5 (
+    title,
+    author_id,
+    magazine_id,
+    content = 'articles',
+    content_rowid = 'article_id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+INSERT INTO articles_fts (articles_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0, 0.0)');
+
+CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles
+BEGIN
+    INSERT INTO articles_fts (rowid, title, author_id, magazine_id)
+    VALUES (NEW.article_id, NEW.title, NEW.author_id, NEW.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles
+BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, title, author_id, magazine_id)
+    VALUES ('delete', OLD.article_id, OLD.title, OLD.author_id, OLD.magazine_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, author_id, magazine_id ON articles
+WHEN OLD.title IS NOT NEW.title OR OLD.author_id IS NOT NEW.author_id OR OLD.magazine_id IS NOT NEW.magazine_id
+BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, title, author_id, magazine_id)
+    VALUES ('delete', OLD.article_id, OLD.title, OLD.author_id, OLD.magazine_id);
+    INSERT INTO articles_fts (rowid, title, author_id, magazine_id)
+    VALUES (NEW.article_id, NEW.title, NEW.author_id, NEW.magazine_id);
+END;
@@ -0,0 +1,166 @@
+import threading
+from contextlib import contextmanager
+
+from db import instrument
+from db.connection import held_transaction
+from db.bulk import insert_many, chunked
+
+_local = threading.local()
+
+
+def current_session():
+    """Return the session open on this thread, or None"""
+    return getattr(_local, "session", None)
+
+
+class Session:
+    """Unit of work that collects model changes and writes them at commit.
+
+    New objects only receive their ids when the session is flushed; call
+    `flush()` explicitly when a later statement needs them.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._reset()
+
+    def __repr__(self):
+        return (
+            f"<Session new ({len(self._new)}), dirty ({len(self.dirty)}), " +
+            f"deleted ({len(self.deleted)})>"
+        )
+
+    @property
+    def new(self):
+        """Objects waiting to be inserted, in the order they were added"""
+        return list(self._new.values())
+
+    def add(self, obj):
+        self._new.setdefault(id(obj), obj)
+
+    def mark_dirty(self, obj):
+        if id(obj) in self._new:
+            return
+        self.dirty[id(obj)] = obj
+        self._updated[id(obj)] = obj
+
+    def mark_deleted(self, obj):
+        if self._new.pop(id(obj), None) is not None:
+            return
+
+        cls = type(obj)
+        obj_id = getattr(obj, cls.id_column)
+        self.dirty.pop(id(obj), None)
+        self.deleted.append((obj, obj_id))
+
+        #Removed from the identity map now so lookups in the session miss it
+        cls.all.pop(obj_id, None)
+        setattr(obj, cls.id_column, None)
+
+    def track_inserted(self, objects):
+        """Remember objects written outside `new` so a rollback can forget them"""
+        self._inserted.extend(objects)
+
+    def flush(self):
+        """Write pending inserts, updates and deletes as grouped statements"""
+        for cls, objects in _grouped(self._new.values()):
+            saved = insert_many(
+                cls.table_name, cls.id_column, cls.columns, objects,
+                lambda obj: tuple(getattr(obj, column) for column in cls.columns)
+            )
+            for obj in saved:
+                cls.all[getattr(obj, cls.id_column)] = obj
+            self._inserted.extend(saved)
+        self._new = {}
+
+        for cls, objects in _grouped(self.dirty.values()):
+            sql = f"""
+                UPDATE {cls.table_name}
+                SET {", ".join(f"{column} = ?" for column in cls.columns)}
+                WHERE {cls.id_column} = ?
+            """
+            instrument.executemany(self.conn, sql, [
+                tuple(getattr(obj, column) for column in cls.columns) + (getattr(obj, cls.id_column),)
+                for obj in objects
+            ])
+        self.dirty = {}
+
+        for cls, entries in reversed(_grouped(self.deleted, key=lambda entry: entry[0])):
+            sql = f"DELETE FROM {cls.table_name} WHERE {cls.id_column} = ?"
+            instrument.executemany(self.conn, sql, [(obj_id,) for _, obj_id in entries])
+        self._removed.extend(self.deleted)
+        self.deleted = []
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+        self._reset()
+
+    def rollback(self):
+        self.conn.rollback()
+
+        for obj in self._inserted:
+            cls = type(obj)
+            cls.all.pop(getattr(obj, cls.id_column), None)
+            setattr(obj, cls.id_column, None)
+
+        for obj, obj_id in self._removed + self.deleted:
+            cls = type(obj)
+            setattr(obj, cls.id_column, obj_id)
+            cls.all[obj_id] = obj
+
+        #Updated objects are reloaded from the rows the rollback restored
+        for cls, objects in _grouped(self._updated.values()):
+            for chunk in chunked(objects, 500):
+                by_id = {getattr(obj, cls.id_column): obj for obj in chunk}
+                sql = f"""
+                    SELECT {cls.id_column}, {", ".join(cls.columns)}
+                    FROM {cls.table_name}
+                    WHERE {cls.id_column} IN ({", ".join("?" for _ in by_id)})
+                """
+                for row in instrument.execute(self.conn, sql, tuple(by_id)).fetchall():
+                    for column, value in zip(cls.columns, row[1:]):
+                        setattr(by_id[row[0]], column, value)
+
+        self._reset()
+
+    def _reset(self):
+        #Pending inserts by id(obj), so membership checks stay O(1) in big units of work
+        self._new = {}
+        self.dirty = {}
+        self.deleted = []
+        self._inserted = []
+        self._removed = []
+        self._updated = {}
+
+
+def _grouped(objects, key=lambda obj: obj):
+    """Group objects by model class, ordered so parents are written first"""
+    groups = {}
+    for item in objects:
+        groups.setdefault(type(key(item)), []).append(item)
+    return sorted(groups.items(), key=lambda group: group[0].flush_order)
+
+
+@contextmanager
+def transaction():
+    """Run the block in a session that commits on success and rolls back on error.
+
+    Nested calls join the session that is already open on this thread.
+    """
+    session = current_session()
+    if session is not None:
+        yield session
+        return
+
+    with held_transaction() as conn:
+        session = Session(conn)
+        _local.session = session
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            _local.session = None
@@ -0,0 +1,18 @@
+-- Schema of one shard file: the articles table with the primary's indexes.
+-- Authors and magazines stay in the primary, so there are no foreign keys;
+-- db/stats.sql is applied too, giving each shard its own summable counts.
+
+CREATE TABLE IF NOT EXISTS articles (
+    article_id INTEGER PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    author_id INTEGER,
+    magazine_id INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_articles_title ON articles (title);
+CREATE INDEX IF NOT EXISTS idx_articles_author_magazine ON articles (author_id, magazine_id);
+CREATE INDEX IF NOT EXISTS idx_articles_magazine_author ON articles (magazine_id, author_id);
+CREATE INDEX IF NOT EXISTS idx_articles_author ON articles (author_id, article_id);
+CREATE INDEX IF NOT EXISTS idx_articles_magazine ON articles (magazine_id, article_id);
+CREATE INDEX IF NOT EXISTS idx_articles_author_title ON articles (author_id, title);
+CREATE INDEX IF NOT EXISTS idx_articles_magazine_title ON articles (magazine_id, title);
@@ -0,0 +1,521 @@
+"""Partition the articles table across several SQLite files.
+
+Articles are hashed on a shard key (magazine_id or author_id) into a fixed
+number of partitions, and the layout in the primary database says which
+shard file holds each partition. Authors and magazines stay in the
+primary. Writes go to the shard that owns the article's partition; reads
+that can't be routed run on every shard in parallel and are merged here.
+
+`use_shards()` makes the models read and write articles through the
+shards: a read filtered on the shard key goes to one shard, any other
+runs on all of them. Relations between authors and magazines come from
+the shards' author_magazine_counts, whose rows never repeat across shards
+since both articles of a pair share a shard. Article.search raises
+ShardingError, as the full-text index is only kept in the primary, and so
+do exports and db.analytics.
+
+Shard writes commit on their own, so article writes inside a session
+raise ShardingError. The shards keep their own author_magazine_counts,
+but none of the primary's triggers see shard writes: they never reach the
+change log, the primary's stats or search index, or the coherence check.
+The importer raises ShardingError for the same reason.
+
+Moving partitions (`move_partition`, `rebalance`) assumes no other process
+writes articles meanwhile; ones that kept running should `reload()`.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from db import instrument
+from db.connection import DEFAULT_FETCH_SIZE, DEFAULT_PROFILE, ConnectionPool, get_provider, retry_busy
+from db.prefetch import MAX_IN_PARAMS
+
+SHARDING_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sharding.sql")
+SHARD_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shard.sql")
+STATS_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats.sql")
+
+SHARD_KEYS = ("magazine_id", "author_id")
+DEFAULT_PARTITIONS = 64
+
+#Ids reserved from the primary at a time; unused ones are simply skipped
+ID_BLOCK = 1000
+
+#Partition of a key value, as SQL and as Python; both must agree.
+#author_id goes through a multiplicative hash so consecutive ids spread out.
+_PARTITION_SQL = {
+    "magazine_id": "COALESCE(magazine_id, 0) % {partitions}",
+    "author_id": "(COALESCE(author_id, 0) * 2654435761 & 4294967295) % {partitions}",
+}
+
+_INSERT = "INSERT INTO articles (article_id, title, author_id, magazine_id) VALUES (?, ?, ?, ?)"
+_COLUMNS = ("article_id", "title", "author_id", "magazine_id")
+
+
+class ShardingError(LookupError):
+    """The primary has no shard layout, or it already has one"""
+
+
+def _run_script(conn, path):
+    with open(path) as f:
+        conn.executescript(f.read())
+
+
+def create_shard(path):
+    """Create (or complete) the schema of one shard file"""
+    conn = sqlite3.connect(path)
+    try:
+        _run_script(conn, SHARD_SQL)
+        _run_script(conn, STATS_SQL)
+    finally:
+        conn.close()
+
+
+def partition_of(key, value, partitions):
+    value = value or 0
+    if key == "author_id":
+        value = value * 2654435761 & 0xFFFFFFFF
+    return value % partitions
+
+
+class ShardSet:
+    """The shard files named in the primary's layout, one connection pool each.
+
+    `primary` is the provider holding the layout, authors and magazines;
+    it defaults to the active one. Reads on several shards run on a thread
+    pool, since SQLite releases the GIL while it works.
+    """
+
+    def __init__(self, primary=None, profile=DEFAULT_PROFILE):
+        self.primary = primary or get_provider()
+        self.profile = profile
+        self.pools = {}
+        self._executor = None
+        self._ids = iter(())
+        self._reserver = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def __repr__(self):
+        return f"<ShardSet {len(self.pools)} shards, {self.partitions} partitions by {self.key}>"
+
+    @classmethod
+    def create(cls, paths, key="magazine_id", partitions=DEFAULT_PARTITIONS, primary=None, profile=DEFAULT_PROFILE):
+        """Lay out `partitions` partitions round-robin over new shard files at `paths`.
+
+        Articles already in the primary are moved to their shards with
+        their ids, leaving the primary's articles table empty.
+        """
+        if key not in SHARD_KEYS:
+            raise ValueError(f"unknown shard key {key!r}; use one of {', '.join(SHARD_KEYS)}")
+        if not paths:
+            raise ValueError("a shard set needs at least one shard")
+        primary = primary or get_provider()
+        with primary.connection() as conn:
+            _run_script(conn, SHARDING_SQL)
+            if conn.execute("SELECT 1 FROM shard_layout").fetchone():
+                raise ShardingError("the primary already has a shard layout")
+            existing = conn.execute("SELECT name FROM sqlite_master WHERE name = 'articles'").fetchone()
+            next_id = conn.execute("SELECT COALESCE(MAX(article_id), 0) + 1 FROM articles").fetchone()[0] if existing else 1
+            conn.execute("INSERT INTO shard_layout (id, shard_key, partitions, next_id) VALUES (1, ?, ?, ?)",
+                         (key, partitions, next_id))
+            conn.executemany("INSERT INTO shards (shard, path) VALUES (?, ?)",
+                             [(shard, os.path.abspath(path)) for shard, path in enumerate(paths)])
+            conn.executemany("INSERT INTO shard_partitions (partition, shard) VALUES (?, ?)",
+                             [(partition, partition % len(paths)) for partition in range(partitions)])
+            conn.commit()
+        for path in paths:
+            create_shard(path)
+
+        shards = cls(primary, profile)
+        if existing:
+            shards._copy_from_primary()
+        return shards
+
+    def _copy_from_primary(self):
+        with self.primary.connection() as conn:
+            cursor = conn.execute("SELECT article_id, title, author_id, magazine_id FROM articles")
+            while True:
+                rows = cursor.fetchmany(ID_BLOCK * 10)
+                if not rows:
+                    break
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(self.shard_of(row[self._key_index]), []).append(row)
+                for shard, group in by_shard.items():
+                    self._write(shard, [(_INSERT, group)])
+            #Every row is in a shard now; a stale copy would only be misread
+            conn.execute("DELETE FROM articles")
+            conn.commit()
+
+    def reload(self):
+        """Re-read the layout from the primary, opening pools for new shards"""
+        with self.primary.connection() as conn:
+            try:
+                layout = conn.execute("SELECT shard_key, partitions FROM shard_layout WHERE id = 1").fetchone()
+            except sqlite3.OperationalError:
+                layout = None
+            if layout is None:
+                raise ShardingError("the primary has no shard layout; create one with ShardSet.create")
+            paths = dict(conn.execute("SELECT shard, path FROM shards ORDER BY shard").fetchall())
+            owners = dict(conn.execute("SELECT partition, shard FROM shard_partitions").fetchall())
+        self.key, self.partitions = layout
+        self._key_index = 2 if self.key == "author_id" else 3
+        self._partition_sql = _PARTITION_SQL[self.key].format(partitions=self.partitions)
+        self.paths = paths
+        self.owners = [owners[partition] for partition in range(self.partitions)]
+        for shard, path in paths.items():
+            if shard not in self.pools:
+                self.pools[shard] = ConnectionPool(path, profile=self.profile)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            if self._reserver is not None:
+                self._reserver.close()
+                self._reserver = None
+
+    def shard_of(self, value):
+        """The shard that owns articles whose shard key is `value`"""
+        return self.owners[partition_of(self.key, value, self.partitions)]
+
+    #Taking article ids from the reserved block, reserving another when it runs out
+    def _next_ids(self, count):
+        with self._lock:
+            ids = list(itertools.islice(self._ids, count))
+            while len(ids) < count:
+                size = max(ID_BLOCK, count - len(ids))
+                #A connection of its own, so reserving never commits what this thread has open on the primary
+                if self._reserver is None:
+                    self._reserver = self.primary.connect()
+                end = retry_busy(self._reserve, self._reserver, size)
+                block = range(end - size, end)
+                needed = count - len(ids)
+                ids.extend(block[:needed])
+                self._ids = iter(block[needed:])
+        return ids
+
+    @staticmethod
+    def _reserve(conn, size):
+        try:
+            end = conn.execute(
+                "UPDATE shard_layout SET next_id = next_id + ? WHERE id = 1 RETURNING next_id", (size,)
+            ).fetchone()[0]
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        return end
+
+    def _write(self, shard, statements):
+        """Run (sql, rows) pairs on one shard in a single transaction; returns the rowcounts"""
+        with self.pools[shard].connection() as conn:
+            return retry_busy(self._committed, conn, statements)
+
+    @staticmethod
+    def _committed(conn, statements):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            counts = [instrument.executemany(conn, sql, rows).rowcount for sql, rows in statements]
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        return counts
+
+    def _read(self, shard, sql, params=()):
+        with self.pools[shard].connection() as conn:
+            start = time.perf_counter()
+            rows = retry_busy(lambda: conn.execute(sql, params).fetchall())
+            instrument.record(conn, sql, params, time.perf_counter() - start, len(rows))
+            return rows
+
+    def _map(self, sql, params=(), shards=None):
+        """Yield (shard, rows) for `sql` run on `shards` (default: all), in parallel"""
+        shards = list(self.pools if shards is None else shards)
+        if len(shards) == 1:
+            return [(shards[0], self._read(shards[0], sql, params))]
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=len(self.pools), thread_name_prefix="shard")
+        return zip(shards, self._executor.map(lambda shard: self._read(shard, sql, params), shards))
+
+    def fan_out(self, sql, params=(), shards=None):
+        """Run `sql` on `shards` (default: all) in parallel; returns every shard's rows, concatenated"""
+        rows = []
+        for _, shard_rows in self._map(sql, params, shards):
+            rows.extend(shard_rows)
+        return rows
+
+    def insert(self, articles):
+        """Give each unsaved article an id and insert it into its shard"""
+        articles = list(articles)
+        for article, article_id in zip(articles, self._next_ids(len(articles))):
+            article.article_id = article_id
+        by_shard = {}
+        for article in articles:
+            by_shard.setdefault(self.shard_of(getattr(article, self.key)), []).append(
+                (article.article_id, article.title, article.author_id, article.magazine_id)
+            )
+        for shard, rows in by_shard.items():
+            self._write(shard, [(_INSERT, rows)])
+        return articles
+
+    def update(self, article):
+        """Write `article` to its shard, moving it there if its shard key changed shards"""
+        shard = self.shard_of(getattr(article, self.key))
+        row = (article.title, article.author_id, article.magazine_id, article.article_id)
+        updated, = self._write(shard, [(
+            "UPDATE articles SET title = ?, author_id = ?, magazine_id = ? WHERE article_id = ?", [row]
+        )])
+        if updated:
+            return
+        #Insert before deleting, so a failure in between duplicates the row rather than losing it
+        for old_shard in self._locate(article.article_id):
+            self._write(shard, [(_INSERT, [(article.article_id, *row[:3])])])
+            self._write(old_shard, [("DELETE FROM articles WHERE article_id = ?", [(article.article_id,)])])
+
+    def delete(self, article_id):
+        for shard in self._locate(article_id):
+            self._write(shard, [("DELETE FROM articles WHERE article_id = ?", [(article_id,)])])
+
+    def _locate(self, article_id):
+        """The shards holding a row for `article_id`; more than one only after an interrupted move"""
+        return [shard for shard, rows in self._map("SELECT 1 FROM articles WHERE article_id = ?", (article_id,)) if rows]
+
+    def find(self, article_id):
+        rows = self.fan_out("SELECT * FROM articles WHERE article_id = ?", (article_id,))
+        return rows[0] if rows else None
+
+    def find_by_title(self, title):
+        """The row of the lowest-id article called `title`, or None"""
+        rows = self.fan_out("SELECT * FROM articles WHERE title = ? ORDER BY article_id LIMIT 1", (title,))
+        return min(rows) if rows else None
+
+    def all_rows(self):
+        return sorted(self.fan_out("SELECT * FROM articles"))
+
+    def _route(self, column, values):
+        """The shards that can hold rows whose `column` is in `values`; None means all of them"""
+        if column != self.key:
+            return None
+        return sorted({self.shard_of(value) for value in values})
+
+    def _fan_out_in(self, sql, column, values, params=()):
+        """fan_out for `sql` with an {ids} slot, once per chunk of `values`"""
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), MAX_IN_PARAMS):
+            chunk = values[start:start + MAX_IN_PARAMS]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(self.fan_out(sql.format(ids=placeholders), (*params, *chunk), self._route(column, chunk)))
+        return rows
+
+    def articles_by(self, column, values):
+        """Rows of the articles whose `column` (author_id or magazine_id) is in `values`, in article_id order"""
+        return sorted(self._fan_out_in(f"SELECT * FROM articles WHERE {column} IN ({{ids}})", column, values))
+
+    def rows_after(self, after, limit, column=None, value=None):
+        """Up to `limit` article rows with ids above `after`, in id order, optionally only where `column` = `value`"""
+        if column is None:
+            rows = self.fan_out("SELECT * FROM articles WHERE article_id > ? ORDER BY article_id LIMIT ?", (after, limit))
+        else:
+            rows = self.fan_out(
+                f"SELECT * FROM articles WHERE {column} = ? AND article_id > ? ORDER BY article_id LIMIT ?",
+                (value, after, limit), self._route(column, [value]),
+            )
+        return sorted(rows)[:limit]
+
+    def iterate(self, column=None, value=None, batch_size=DEFAULT_FETCH_SIZE):
+        """Yield article rows in id order, one keyset query per shard and batch"""
+        after = 0
+        while True:
+            rows = self.rows_after(after, batch_size, column, value)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def page_fetch(self, order_by, filters):
+        """A `fetch` for db.pagination.fetch_page that merges the page query's rows from the shards"""
+        index = _COLUMNS.index(order_by.lstrip("-"))
+        shards = self._route(self.key, [filters[self.key]]) if self.key in filters else None
+
+        def fetch(sql, params):
+            rows = self.fan_out(sql, params, shards)
+            rows.sort(key=lambda row: (row[index], row[0]), reverse=order_by.startswith("-"))
+            return rows[:params[-1]]
+        return fetch
+
+    def pairs(self, column=None, values=None, min_articles=1):
+        """(author_id, magazine_id, article count) of the pairs with at least `min_articles` articles.
+
+        `column` and `values` narrow them to some authors or magazines.
+        """
+        if column is None:
+            rows = self.fan_out(
+                "SELECT author_id, magazine_id, article_count FROM author_magazine_counts WHERE article_count >= ?",
+                (min_articles,),
+            )
+        else:
+            rows = self._fan_out_in(f"""
+                SELECT author_id, magazine_id, article_count FROM author_magazine_counts
+                WHERE article_count >= ? AND {column} IN ({{ids}})
+            """, column, values, (min_articles,))
+        return sorted(rows)
+
+    def _totals(self, sql, params=()):
+        totals = {}
+        for key, count in self.fan_out(sql, params):
+            totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def author_totals(self):
+        """{author_id: article count} summed over the shards' author_stats"""
+        return self._totals("SELECT author_id, article_count FROM author_stats")
+
+    def magazine_totals(self):
+        """{magazine_id: article count} summed over the shards' magazine_stats"""
+        return self._totals("SELECT magazine_id, article_count FROM magazine_stats")
+
+    def top_author_id(self, depth=16):
+        """Id of the author with the most articles, the lowest id among ties.
+
+        Uses the threshold algorithm: each shard lists its `depth` biggest
+        authors, whose totals are summed over every shard. An author no
+        shard listed has at most the sum of the shards' smallest listed
+        counts, so once the best total beats that the answer is final;
+        otherwise `depth` grows and it tries again.
+        """
+        while True:
+            threshold = 0
+            candidates = set()
+            exhausted = True
+            for _, rows in self._map(
+                "SELECT author_id, article_count FROM author_stats ORDER BY article_count DESC LIMIT ?", (depth,)
+            ):
+                candidates.update(row[0] for row in rows)
+                if len(rows) == depth:
+                    threshold += rows[-1][1]
+                    exhausted = False
+            if not candidates:
+                return None
+            ids = sorted(candidates)
+            totals = self._totals(
+                f"SELECT author_id, article_count FROM author_stats WHERE author_id IN ({', '.join('?' for _ in ids)})",
+                ids,
+            )
+            best = min(totals, key=lambda author_id: (-totals[author_id], author_id))
+            if exhausted or totals[best] > threshold:
+                return best
+            depth *= 4
+
+    def counts(self):
+        """{shard: article count}"""
+        counts = {}
+        for shard, rows in self._map("SELECT COUNT(*) FROM articles"):
+            counts[shard] = rows[0][0]
+        return counts
+
+    def partition_counts(self):
+        """{partition: article count}, for the partitions that have articles"""
+        return dict(self.fan_out(f"SELECT {self._partition_sql}, COUNT(*) FROM articles GROUP BY 1"))
+
+    def add_shard(self, path):
+        """Add an empty shard file to the layout; `rebalance()` then moves partitions onto it"""
+        path = os.path.abspath(path)
+        create_shard(path)
+        with self.primary.connection() as conn:
+            conn.execute("INSERT INTO shards (shard, path) SELECT COALESCE(MAX(shard), -1) + 1, ? FROM shards", (path,))
+            conn.commit()
+        self.reload()
+        return max(self.pools)
+
+    def move_partition(self, partition, shard):
+        """Move one partition's articles to `shard`; returns the number of articles moved.
+
+        Rows are copied, the layout is switched, then the old copies are
+        deleted, so an interrupted move can simply be run again.
+        """
+        source = self.owners[partition]
+        if source == shard:
+            return 0
+        if shard not in self.pools:
+            raise ShardingError(f"no shard {shard} in the layout")
+        where = f"WHERE {self._partition_sql} = ?"
+        rows = self._read(source, f"SELECT article_id, title, author_id, magazine_id FROM articles {where}", (partition,))
+        self._write(shard, [(_INSERT.replace("INSERT", "INSERT OR IGNORE", 1), rows)])
+        with self.primary.connection() as conn:
+            conn.execute("UPDATE shard_partitions SET shard = ? WHERE partition = ?", (shard, partition))
+            conn.commit()
+        self.owners[partition] = shard
+        self._write(source, [(f"DELETE FROM articles {where}", [(partition,)])])
+        return len(rows)
+
+    def plan_rebalance(self):
+        """Return (partition, from shard, to shard) moves that even out the article counts.
+
+        Each move takes a partition from the fullest shard to the emptiest
+        one, picking the partition that leaves the two closest in size, and
+        stops once no single move would narrow the gap.
+        """
+        sizes = self.partition_counts()
+        owners = list(self.owners)
+        load = dict.fromkeys(self.pools, 0)
+        for partition, count in sizes.items():
+            load[owners[partition]] += count
+        moves = []
+        while True:
+            fullest = max(load, key=lambda shard: (load[shard], -shard))
+            emptiest = min(load, key=lambda shard: (load[shard], shard))
+            gap = load[fullest] - load[emptiest]
+            candidates = [p for p, count in sizes.items() if owners[p] == fullest and 0 < count < gap]
+            if not candidates:
+                return moves
+            best = min(candidates, key=lambda p: (abs(gap - 2 * sizes[p]), p))
+            owners[best] = emptiest
+            load[fullest] -= sizes[best]
+            load[emptiest] += sizes[best]
+            moves.append((best, fullest, emptiest))
+
+    def rebalance(self, dry_run=False):
+        """Carry out `plan_rebalance()`; returns the moves"""
+        moves = self.plan_rebalance()
+        if not dry_run:
+            for partition, _, shard in moves:
+                self.move_partition(partition, shard)
+        return moves
+
+
+_shards = None
+
+
+def use_shards(shards=None):
+    """Route the models' article reads and writes through `shards`.
+
+    `shards` defaults to a ShardSet over the active provider's layout.
+    Returns the ShardSet; `stop_shards()` switches back.
+    """
+    global _shards
+    _shards = shards if shards is not None else ShardSet()
+    return _shards
+
+
+def get_shards():
+    """The ShardSet the models route through, or None when articles are not sharded"""
+    return _shards
+
+
+def stop_shards():
+    global _shards
+    previous, _shards = _shards, None
+    if previous is not None:
+        previous.close()
@@ -0,0 +1,21 @@
+-- Shard layout, kept in the primary database next to authors and magazines.
+-- Articles are hashed on shard_key into a fixed number of partitions, and
+-- each partition lives in exactly one shard file. next_id hands out
+-- article ids in blocks, so ids stay unique across every shard.
+
+CREATE TABLE IF NOT EXISTS shard_layout (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    shard_key TEXT NOT NULL,
+    partitions INTEGER NOT NULL,
+    next_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS shard_partitions (
+    partition INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL REFERENCES shards (shard)
+);
@@ -0,0 +1,74 @@
+import os
+
+from db.connection import connection, held_transaction
+
+STATS_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats.sql")
+
+#Each stats table paired with the GROUP BY over articles it must equal
+EXPECTED = {
+    "author_stats": """
+        SELECT author_id, COUNT(*)
+        FROM articles
+        WHERE author_id IS NOT NULL
+        GROUP BY author_id
+    """,
+    "magazine_stats": """
+        SELECT magazine_id, COUNT(*), COUNT(DISTINCT author_id)
+        FROM articles
+        WHERE magazine_id IS NOT NULL
+        GROUP BY magazine_id
+    """,
+    "author_magazine_counts": """
+        SELECT author_id, magazine_id, COUNT(*)
+        FROM articles
+        WHERE author_id IS NOT NULL AND magazine_id IS NOT NULL
+        GROUP BY author_id, magazine_id
+    """,
+}
+
+
+def create_stats(conn=None):
+    """Create the stats tables and their triggers if they are missing"""
+    with open(STATS_SQL) as f:
+        script = f.read()
+    if conn is not None:
+        conn.executescript(script)
+        return
+    with connection() as conn:
+        conn.executescript(script)
+
+
+def drop_stats():
+    """Drop the stats tables; the triggers go with the articles table"""
+    with connection() as conn:
+        for table in EXPECTED:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.commit()
+
+
+def drift():
+    """Return the number of rows each stats table has wrong or missing"""
+    counts = {}
+    with connection() as conn:
+        for table, expected in EXPECTED.items():
+            sql = f"""
+                SELECT
+                    (SELECT COUNT(*) FROM ({expected} EXCEPT SELECT * FROM {table})) +
+                    (SELECT COUNT(*) FROM (SELECT * FROM {table} EXCEPT {expected}))
+            """
+            counts[table] = conn.execute(sql).fetchone()[0]
+    return counts
+
+
+def rebuild_stats():
+    """Recompute every stats table from articles in one transaction"""
+    create_stats()
+    with held_transaction() as conn:
+        try:
+            for table, expected in EXPECTED.items():
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"INSERT INTO {table} {expected}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
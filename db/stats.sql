@@ -0,0 +1,109 @@
+-- Denormalized article counts kept current by triggers on articles.
+-- Rebuild them from scratch with scripts/rebuild_stats.py.
+
+CREATE TABLE IF NOT EXISTS author_stats (
+    author_id INTEGER PRIMARY KEY,
+    article_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_author_stats_count ON author_stats (article_count);
+
+CREATE TABLE IF NOT EXISTS magazine_stats (
+    magazine_id INTEGER PRIMARY KEY,
+    article_count INTEGER NOT NULL,
+    author_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_magazine_stats_count ON magazine_stats (article_count);
+CREATE INDEX IF NOT EXISTS idx_magazine_stats_authors ON magazine_stats (author_count);
+
+CREATE TABLE IF NOT EXISTS author_magazine_counts (
+    author_id INTEGER NOT NULL,
+    magazine_id INTEGER NOT NULL,
+    article_count INTEGER NOT NULL,
+    PRIMARY KEY (author_id, magazine_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_author_magazine_counts_magazine ON author_magazine_counts (magazine_id, article_count);
+
+-- Counting an article in: the pair row goes first so magazine_stats can
+-- tell whether this is the author's first article in the magazine
+CREATE TRIGGER IF NOT EXISTS articles_stats_insert AFTER INSERT ON articles
+BEGIN
+    INSERT INTO author_stats (author_id, article_count)
+    SELECT NEW.author_id, 1 WHERE NEW.author_id IS NOT NULL
+    ON CONFLICT (author_id) DO UPDATE SET article_count = article_count + 1;
+
+    INSERT INTO author_magazine_counts (author_id, magazine_id, article_count)
+    SELECT NEW.author_id, NEW.magazine_id, 1
+    WHERE NEW.author_id IS NOT NULL AND NEW.magazine_id IS NOT NULL
+    ON CONFLICT (author_id, magazine_id) DO UPDATE SET article_count = article_count + 1;
+
+    INSERT INTO magazine_stats (magazine_id, article_count, author_count)
+    SELECT NEW.magazine_id, 1, NEW.author_id IS NOT NULL WHERE NEW.magazine_id IS NOT NULL
+    ON CONFLICT (magazine_id) DO UPDATE SET
+        article_count = article_count + 1,
+        author_count = author_count + ((
+            SELECT article_count = 1 FROM author_magazine_counts
+            WHERE author_id = NEW.author_id AND magazine_id = NEW.magazine_id
+        ) IS 1);
+END;
+
+-- Counting an article out: magazine_stats goes first, while the pair row
+-- still shows whether this was the author's last article in the magazine
+CREATE TRIGGER IF NOT EXISTS articles_stats_delete AFTER DELETE ON articles
+BEGIN
+    UPDATE author_stats SET article_count = article_count - 1 WHERE author_id = OLD.author_id;
+    DELETE FROM author_stats WHERE author_id = OLD.author_id AND article_count <= 0;
+
+    UPDATE magazine_stats SET
+        article_count = article_count - 1,
+        author_count = author_count - ((
+            SELECT article_count = 1 FROM author_magazine_counts
+            WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id
+        ) IS 1)
+    WHERE magazine_id = OLD.magazine_id;
+    DELETE FROM magazine_stats WHERE magazine_id = OLD.magazine_id AND article_count <= 0;
+
+    UPDATE author_magazine_counts SET article_count = article_count - 1
+    WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id;
+    DELETE FROM author_magazine_counts
+    WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id AND article_count <= 0;
+END;
+
+-- Moving an article is counting the old row out and the new row in
+CREATE TRIGGER IF NOT EXISTS articles_stats_update AFTER UPDATE OF author_id, magazine_id ON articles
+WHEN OLD.author_id IS NOT NEW.author_id OR OLD.magazine_id IS NOT NEW.magazine_id
+BEGIN
+    UPDATE author_stats SET article_count = article_count - 1 WHERE author_id = OLD.author_id;
+    DELETE FROM author_stats WHERE author_id = OLD.author_id AND article_count <= 0;
+
+    UPDATE magazine_stats SET
+        article_count = article_count - 1,
+        author_count = author_count - ((
+            SELECT article_count = 1 FROM author_magazine_counts
+            WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id
+        ) IS 1)
+    WHERE magazine_id = OLD.magazine_id;
+    DELETE FROM magazine_stats WHERE magazine_id = OLD.magazine_id AND article_count <= 0;
+
+    UPDATE author_magazine_counts SET article_count = article_count - 1
+    WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id;
+    DELETE FROM author_magazine_counts
+    WHERE author_id = OLD.author_id AND magazine_id = OLD.magazine_id AND article_count <= 0;
+
+    INSERT INTO author_stats (author_id, article_count)
+    SELECT NEW.author_id, 1 WHERE NEW.author_id IS NOT NULL
+    ON CONFLICT (author_id) DO UPDATE SET article_count = article_count + 1;
+
+    INSERT INTO author_magazine_counts (author_id, magazine_id, article_count)
+    SELECT NEW.author_id, NEW.magazine_id, 1
+    WHERE NEW.author_id IS NOT NULL AND NEW.magazine_id IS NOT NULL
+    ON CONFLICT (author_id, magazine_id) DO UPDATE SET article_count = article_count + 1;
+
+    INSERT INTO magazine_stats (magazine_id, article_count, author_count)
+    SELECT NEW.magazine_id, 1, NEW.author_id IS NOT NULL WHERE NEW.magazine_id IS NOT NULL
+    ON CONFLICT (magazine_id) DO UPDATE SET
+        article_count = article_count + 1,
+        author_count = author_count + ((
+            SELECT article_count = 1 FROM author_magazine_counts
+            WHERE author_id = NEW.author_id AND magazine_id = NEW.magazine_id
+        ) IS 1);
+END;
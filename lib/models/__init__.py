@@ -1,3 +1,23 @@
-from .article import Article
-from .author import Author
-from .magazine import Magazine
\ No newline at end of file
+import importlib
+
+#Each model module is imported the first time its class is looked up, so
+#importing one model does not pay for the others
+_MODELS = {
+    "Article": "lib.models.article",
+    "Author": "lib.models.author",
+    "Magazine": "lib.models.magazine",
+}
+
+__all__ = list(_MODELS)
+
+
+def __getattr__(name):
+    if name not in _MODELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    model = getattr(importlib.import_module(_MODELS[name]), name)
+    globals()[name] = model
+    return model
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
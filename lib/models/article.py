@@ -1,8 +1,22 @@
 
-from db.connection import CURSOR, CONN
+from db.connection import fetchone, fetchall, execute, iterate, DEFAULT_FETCH_SIZE
+from db.bulk import insert_many, chunked, DEFAULT_CHUNK_SIZE
+from db.pagination import fetch_page, DEFAULT_PAGE_SIZE
+from db import aio
+from db.identity import WeakIdentityMap
+from db.session import current_session
+from db.sharding import ShardingError, get_shards
+from db.changelog import create_changelog, drop_changelog
+from db.stats import create_stats, drop_stats
+from db.search import search_titles, create_search, drop_search, DEFAULT_SEARCH_LIMIT
 
 class Article:
-    all = {}
+    all = WeakIdentityMap()
+    table_name = "articles"
+    id_column = "article_id"
+    columns = ("title", "author_id", "magazine_id")
+    flush_order = 1
+    __slots__ = ("article_id", "title", "author_id", "magazine_id", "__weakref__")
 
     def __init__(self, title, author_id, magazine_id ,article_id = None):
         self.article_id = article_id
@@ -29,8 +43,17 @@ class Article:
                 FOREIGN KEY (magazine_id) REFERENCES magazines(magazine_id)
             )
         """
-        CURSOR.execute(sql)
-        CONN.commit()
+        execute(sql)
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_title ON articles (title)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_author_magazine ON articles (author_id, magazine_id)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_magazine_author ON articles (magazine_id, author_id)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_author ON articles (author_id, article_id)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_magazine ON articles (magazine_id, article_id)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_author_title ON articles (author_id, title)")
+        execute("CREATE INDEX IF NOT EXISTS idx_articles_magazine_title ON articles (magazine_id, title)")
+        create_stats()
+        create_search()
+        create_changelog()
 
     @classmethod
     #Deleting the articles table
@@ -38,19 +61,34 @@ class Article:
         sql = """
             DROP TABLE IF EXISTS articles;
         """
-        CURSOR.execute(sql)
-        CONN.commit()
+        execute(sql)
+        drop_stats()
+        drop_search()
+        drop_changelog()
 
     #Inserting a new row into the articles table
     def save(self):
+        #Sharded articles go straight to their shard; sessions only cover the primary
+        shards = get_shards()
+        if shards is not None:
+            if current_session():
+                raise ShardingError("sharded articles commit on their own and can't be written in a session")
+            shards.insert([self])
+            type(self).all[self.article_id] = self
+            return
+
+        session = current_session()
+        if session:
+            session.add(self)
+            return
+
         sql = """
             INSERT INTO articles (title, author_id, magazine_id)
             VALUES (?, ?, ?)
         """
-        CURSOR.execute(sql, (self.title, self.author_id, self.magazine_id))
-        CONN.commit()
+        cursor = execute(sql, (self.title, self.author_id, self.magazine_id))
 
-        self.article_id = CURSOR.lastrowid
+        self.article_id = cursor.lastrowid
         
         #Adds the article instance to the dictionary
         type(self).all[self.article_id] = self
@@ -66,8 +104,13 @@ class Article:
             article.author_id = row[2]
             article.magazine_id = row[3]
         else:
-            article = cls(row[1], row[2], row[3], article_id=row[0])
-            cls.all[article.article_id] = article
+            #Filling the slots straight from the tuple skips __init__
+            article = cls.__new__(cls)
+            article.article_id = row[0]
+            article.title = row[1]
+            article.author_id = row[2]
+            article.magazine_id = row[3]
+            cls.all[row[0]] = article
         return article
     
     @classmethod
@@ -78,17 +121,49 @@ class Article:
             FROM articles
         """
 
-        rows = CURSOR.execute(sql).fetchall()
+        shards = get_shards()
+        rows = shards.all_rows() if shards is not None else fetchall(sql)
 
         return [cls.instance_from_db(row) for row in rows]
     
+    @classmethod
+    def iter_all(cls, batch_size=DEFAULT_FETCH_SIZE):
+        """Yield a Article object per row, fetching `batch_size` rows at a time"""
+        sql = """
+            SELECT *
+            FROM articles
+        """
+        shards = get_shards()
+        rows = shards.iterate(batch_size=batch_size) if shards is not None else iterate(sql, batch_size=batch_size)
+        for row in rows:
+            yield cls.instance_from_db(row)
+    
+    @classmethod
+    def page(cls, after=None, limit=DEFAULT_PAGE_SIZE, order_by="article_id", author_id=None, magazine_id=None):
+        """Return one Page of articles using keyset pagination.
+
+        `after` is the `next_token` of the previous page; `order_by` is
+        "article_id" or "title", prefixed with "-" for descending order.
+        """
+        filters = {}
+        if author_id is not None:
+            filters["author_id"] = author_id
+        if magazine_id is not None:
+            filters["magazine_id"] = magazine_id
+        shards = get_shards()
+        if shards is not None:
+            fetch = shards.page_fetch(order_by, filters)
+            return fetch_page(cls, order_by, ("article_id", "title"), filters, after, limit, fetch)
+        return fetch_page(cls, order_by, ("article_id", "title"), filters, after, limit)
+    
     @classmethod
     def find_by_id(cls, article_id):
         sql = """
             SELECT * FROM articles
             WHERE article_id = ?
         """
-        row = CURSOR.execute(sql, (article_id,)).fetchone()
+        shards = get_shards()
+        row = shards.find(article_id) if shards is not None else fetchone(sql, (article_id,))
         return cls.instance_from_db(row) if row else None
     
     
@@ -98,35 +173,150 @@ class Article:
            SELECT * FROM articles
            WHERE title = ?
         """
-        row = CURSOR.execute(sql, (title,)).fetchone()
+        shards = get_shards()
+        row = shards.find_by_title(title) if shards is not None else fetchone(sql, (title,))
         return cls.instance_from_db(row) if row else None
 
+    @classmethod
+    #Ranked keyword search over every article title
+    def search(cls, query, magazine_id=None, author_id=None, limit=DEFAULT_SEARCH_LIMIT, candidates=None):
+        """Return SearchResults (article, snippet, score), best match first.
+
+        Every word in `query` must appear in the title; end a word with * to
+        match it as a prefix. Matched words in the snippet are [bracketed].
+        `candidates` caps how many of the newest matches are ranked, trading
+        exact results for speed on broad queries; by default all are ranked.
+        The index is only kept in the primary, so sharded articles raise ShardingError.
+        """
+        if get_shards() is not None:
+            raise ShardingError("article search is not available while articles are sharded")
+        return search_titles(cls, query, magazine_id, author_id, limit, candidates)
+
     @classmethod
     #Creating a new article record
     def create(cls, title, author_id, magazine_id):
         article = cls(title, author_id, magazine_id)
         article.save()
         return article
+
+    @classmethod
+    #Creating many article records in a single transaction
+    def create_many(cls, rows, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        """Insert (title, author_id, magazine_id) tuples or dicts; `rows` may be any iterable.
+
+        `return_objects=False` returns a count instead of the articles and
+        holds only one chunk at a time, for streaming large inputs.
+        """
+        articles = (
+            cls(row["title"], row["author_id"], row["magazine_id"]) if isinstance(row, dict) else cls(*row)
+            for row in rows
+        )
+        return cls.bulk_save(articles, chunk_size, return_objects)
+
+    @classmethod
+    #Inserting many unsaved article instances in a single transaction
+    def bulk_save(cls, articles, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        shards = get_shards()
+        if shards is not None:
+            if current_session():
+                raise ShardingError("sharded articles commit on their own and can't be written in a session")
+            if not return_objects:
+                return sum(len(shards.insert(chunk)) for chunk in chunked(articles, chunk_size))
+            saved = shards.insert(articles)
+            for article in saved:
+                cls.all[article.article_id] = article
+            return saved
+
+        if not return_objects:
+            #Counting only: the instances are not kept, so they skip the identity map and session
+            return insert_many(
+                cls.table_name, cls.id_column, cls.columns, articles,
+                lambda article: tuple(getattr(article, column) for column in cls.columns),
+                chunk_size, return_objects=False
+            )
+
+        session = current_session()
+        saved = insert_many(
+            cls.table_name, cls.id_column, cls.columns, articles,
+            lambda article: tuple(getattr(article, column) for column in cls.columns),
+            chunk_size
+        )
+        if session:
+            session.track_inserted(saved)
+        for article in saved:
+            cls.all[article.article_id] = article
+        return saved
     
     #Updating an existing article record
     def update(self):
+        shards = get_shards()
+        if shards is not None:
+            if current_session():
+                raise ShardingError("sharded articles commit on their own and can't be written in a session")
+            shards.update(self)
+            return
+
+        session = current_session()
+        if session:
+            session.mark_dirty(self)
+            return
+
         sql = """
             UPDATE articles
             SET title = ?, author_id = ?, magazine_id = ?
             WHERE article_id = ?
         """
-        CURSOR.execute(sql, (self.title, self.author_id, self.magazine_id, self.article_id))
-        CONN.commit()
+        execute(sql, (self.title, self.author_id, self.magazine_id, self.article_id))
 
     #Deleting an article record
     def delete(self):
+        shards = get_shards()
+        if shards is not None:
+            if current_session():
+                raise ShardingError("sharded articles commit on their own and can't be written in a session")
+            shards.delete(self.article_id)
+            del type(self).all[self.article_id]
+            self.article_id = None
+            return
+
+        session = current_session()
+        if session:
+            session.mark_deleted(self)
+            return
+
         sql = """
             DELETE FROM articles
             WHERE article_id = ?
         """
-        CURSOR.execute(sql, (self.article_id,))
-        CONN.commit()
+        execute(sql, (self.article_id,))
 
         del type(self).all[self.article_id]
 
         self.article_id = None
+
+    #Awaitable versions of the methods above, run on the database executor
+    afind_by_id = aio.async_classmethod("find_by_id")
+    afind_by_title = aio.async_classmethod("find_by_title")
+    asearch = aio.async_classmethod("search")
+    aget_all = aio.async_classmethod("get_all")
+    acreate = aio.async_classmethod("create", coalesce=False)
+    acreate_many = aio.async_classmethod("create_many", coalesce=False)
+    abulk_save = aio.async_classmethod("bulk_save", coalesce=False)
+    asave = aio.async_method("save", coalesce=False)
+    aupdate = aio.async_method("update", coalesce=False)
+    adelete = aio.async_method("delete", coalesce=False)
+
+    @classmethod
+    async def aiter_all(cls, batch_size=aio.DEFAULT_BATCH_SIZE):
+        shards = get_shards()
+        if shards is not None:
+            after = 0
+            while True:
+                rows = await aio.run(shards.rows_after, after, batch_size)
+                for row in rows:
+                    yield cls.instance_from_db(row)
+                if len(rows) < batch_size:
+                    return
+                after = rows[-1][0]
+        async for row in aio.aiter_rows("articles", "article_id", batch_size):
+            yield cls.instance_from_db(row)
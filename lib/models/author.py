@@ -1,11 +1,24 @@
-from db.connection import CURSOR, CONN
+from db.connection import fetchone, fetchall, execute, iterate, DEFAULT_FETCH_SIZE
+from db.bulk import insert_many, upsert_many, DEFAULT_CHUNK_SIZE, DEFAULT_UPSERT_SIZE
+from db.pagination import fetch_page, DEFAULT_PAGE_SIZE
+from db.prefetch import fetch_in, attach, group_rows, load_relations
+from db import aio
+from db.identity import WeakIdentityMap
+from db.session import current_session, transaction
+from db.sharding import get_shards
 
 class Author:
-    all = {}
+    all = WeakIdentityMap()
+    table_name = "authors"
+    id_column = "author_id"
+    columns = ("name",)
+    flush_order = 0
+    __slots__ = ("author_id", "name", "_prefetched", "__weakref__")
 
     def __init__(self, name, author_id = None):
         self.author_id = author_id
         self.name = name 
+        self._prefetched = None
     
     def __repr__(self):
         return f"Author ID ({self.author_id}): {self.name}"
@@ -23,9 +36,8 @@ class Author:
                 name VARCHAR(255) NOT NULL
             )
         """
-        CURSOR.execute(sql)
-        CONN.commit()
-        ...
+        execute(sql)
+        execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_authors_name ON authors (name)")
 
     @classmethod
     #Deleting the authors table
@@ -33,19 +45,22 @@ class Author:
         sql = """
             DROP TABLE IF EXISTS authors;
         """
-        CURSOR.execute(sql)
-        CONN.commit()
+        execute(sql)
 
     #Inserting a new row into the authors table
     def save(self):
+        session = current_session()
+        if session:
+            session.add(self)
+            return
+
         sql = """
             INSERT INTO authors (name)
             VALUES (?)
         """
-        CURSOR.execute(sql, (self.name,))
-        CONN.commit()
+        cursor = execute(sql, (self.name,))
 
-        self.author_id = CURSOR.lastrowid
+        self.author_id = cursor.lastrowid
 
         #Adds the author instance to the dictionary
         type(self).all[self.author_id] = self
@@ -59,21 +74,88 @@ class Author:
         if author:
             author.name = row[1]
         else:
-            author = cls(row[1], author_id=row[0])
-            cls.all[author.author_id] = author
+            #Filling the slots straight from the tuple skips __init__
+            author = cls.__new__(cls)
+            author.author_id = row[0]
+            author.name = row[1]
+            author._prefetched = None
+            cls.all[row[0]] = author
         return author
     
     @classmethod
-    def get_all(cls):
-        """Return a list containing a Author object per row in the table"""
+    def get_all(cls, prefetch=None):
+        """Return a list containing a Author object per row in the table.
+
+        `prefetch` names relations ("articles", "magazines") to load for all
+        of them up front, one query per relation.
+        """
+        sql = """
+            SELECT *
+            FROM authors
+        """
+
+        rows = fetchall(sql)
+
+        return cls.prefetch([cls.instance_from_db(row) for row in rows], prefetch)
+
+    @classmethod
+    def iter_all(cls, batch_size=DEFAULT_FETCH_SIZE):
+        """Yield a Author object per row, fetching `batch_size` rows at a time"""
         sql = """
             SELECT *
             FROM authors
         """
+        for row in iterate(sql, batch_size=batch_size):
+            yield cls.instance_from_db(row)
 
-        rows = CURSOR.execute(sql).fetchall()
+    @classmethod
+    #Loading the named relations for many authors at once
+    def prefetch(cls, authors, relations):
+        """Prefetched relations are a snapshot; they are served until the next prefetch"""
+        return load_relations(cls, authors, relations)
 
-        return [cls.instance_from_db(row) for row in rows]
+    @classmethod
+    #Loading the articles of many authors with one query per chunk of ids
+    def prefetch_articles(cls, authors):
+        from lib.models.article import Article
+        sql = """
+            SELECT author_id, * FROM articles
+            WHERE author_id IN ({ids})
+        """
+        shards = get_shards()
+        if shards is not None:
+            rows = [(row[2], *row) for row in shards.articles_by("author_id", {author.author_id for author in authors})]
+        else:
+            rows = fetch_in(sql, {author.author_id for author in authors})
+        attach(authors, "author_id", "articles", rows, lambda row: Article.instance_from_db(row[1:]))
+        return authors
+
+    @classmethod
+    #Loading the magazines of many authors with one query per chunk of ids
+    def prefetch_magazines(cls, authors):
+        from lib.models.magazine import Magazine
+        sql = """
+            SELECT DISTINCT a.author_id, m.*
+            FROM magazines m
+            JOIN articles a ON m.magazine_id = a.magazine_id
+            WHERE a.author_id IN ({ids})
+            ORDER BY m.magazine_id
+        """
+        shards = get_shards()
+        if shards is not None:
+            pairs = shards.pairs("author_id", {author.author_id for author in authors})
+            magazines = Magazine.find_all_by_id({pair[1] for pair in pairs})
+            rows = [(author_id, magazine_id) for author_id, magazine_id, _ in pairs if magazine_id in magazines]
+            attach(authors, "author_id", "magazines", rows, lambda row: magazines[row[1]])
+            return authors
+        rows = fetch_in(sql, {author.author_id for author in authors})
+        attach(authors, "author_id", "magazines", rows, lambda row: Magazine.instance_from_db(row[1:]))
+        return authors
+    
+    @classmethod
+    def page(cls, after=None, limit=DEFAULT_PAGE_SIZE, order_by="author_id"):
+        """Return one Page of authors using keyset pagination, ordered by author_id or name"""
+        return fetch_page(cls, order_by, ("author_id", "name"), after=after, limit=limit)
     
     @classmethod
     def find_by_id(cls, author_id):
@@ -81,8 +163,19 @@ class Author:
             SELECT * FROM authors
             WHERE author_id = ?
         """
-        row = CURSOR.execute(sql, (author_id,)).fetchone()
+        row = fetchone(sql, (author_id,))
         return cls.instance_from_db(row) if row else None
+
+    @classmethod
+    #Finding many authors by id with one query per chunk of ids
+    def find_all_by_id(cls, ids):
+        """Return {author_id: Author} for the `ids` that exist"""
+        sql = """
+            SELECT * FROM authors
+            WHERE author_id IN ({ids})
+        """
+        rows = fetch_in(sql, set(ids))
+        return {row[0]: cls.instance_from_db(row) for row in rows}
     
     @classmethod
     def find_by_name(cls, name):
@@ -90,7 +183,7 @@ class Author:
             SELECT * FROM authors
             WHERE name = ?
         """
-        row = CURSOR.execute(sql, (name,)).fetchone()
+        row = fetchone(sql, (name,))
         return cls.instance_from_db(row) if row else None
     
     @classmethod
@@ -99,46 +192,108 @@ class Author:
         author = cls(name)
         author.save()
         return author
+
+    @classmethod
+    #Creating many author records in a single transaction
+    def create_many(cls, rows, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        """Insert names, (name,) tuples or dicts; `rows` may be any iterable.
+
+        Returns the new authors, or with `return_objects=False` only how many
+        were inserted, which keeps memory flat for a streamed `rows`.
+        """
+        authors = (
+            cls(row["name"]) if isinstance(row, dict) else cls(row) if isinstance(row, str) else cls(*row)
+            for row in rows
+        )
+        return cls.bulk_save(authors, chunk_size, return_objects)
+
+    @classmethod
+    #Finding an author by name, creating it if there is none
+    def get_or_create(cls, name):
+        """Return the author called `name`, inserting it first if it does not exist.
+
+        The insert is an INSERT ... ON CONFLICT (name) DO NOTHING, so two
+        callers racing on a new name still end up with one row.
+        """
+        return cls.get_or_create_many([name])[0]
+
+    @classmethod
+    #Finding many authors by name in one transaction, creating the missing ones
+    def get_or_create_many(cls, names, chunk_size=DEFAULT_UPSERT_SIZE):
+        """Return an author per name in `names`, in order; repeated names give the same author"""
+        names = list(names)
+        rows = upsert_many(cls.table_name, "name", cls.columns, [(name,) for name in dict.fromkeys(names)],
+                           chunk_size=chunk_size)
+        authors = {name: cls.instance_from_db(row) for name, row in rows.items()}
+        return [authors[name] for name in names]
+
+    @classmethod
+    #Inserting many unsaved author instances in a single transaction
+    def bulk_save(cls, authors, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        if not return_objects:
+            #Counting only: the instances are not kept, so they skip the identity map and session
+            return insert_many(
+                cls.table_name, cls.id_column, cls.columns, authors,
+                lambda author: tuple(getattr(author, column) for column in cls.columns),
+                chunk_size, return_objects=False
+            )
+
+        session = current_session()
+        saved = insert_many(
+            cls.table_name, cls.id_column, cls.columns, authors,
+            lambda author: tuple(getattr(author, column) for column in cls.columns),
+            chunk_size
+        )
+        if session:
+            session.track_inserted(saved)
+        for author in saved:
+            cls.all[author.author_id] = author
+        return saved
     
     @classmethod
+    #Creating an author and their articles in a single transaction
     def add_with_articles(cls, name, articles_data):
+        from lib.models.article import Article
         try:
-            with CONN:
-                CURSOR.execute(
-                    "INSERT INTO authors (name) VALUES (?)",
-                    (name,)
-                )
-                author_id = CURSOR.lastrowid
+            with transaction() as session:
+                author = cls(name)
+                author.save()
 
+                #The articles need the author's id before they can be queued
+                session.flush()
                 for article in articles_data:
-                    CURSOR.execute(
-                        "INSERT INTO articles (name, title, author_id, magazine_id) VALUES (?, ?, ?, ?)",
-                        (article['name'], article['title'], author_id, article['magazine_id'])
-                    )
-            return cls.find_by_id(author_id)
+                    Article(article['title'], author.author_id, article['magazine_id']).save()
+            return author
         except Exception as e:
             print(f"Transaction failed: {e}")
             return None
 
-    
     #Updating an existing author record
     def update(self):
+        session = current_session()
+        if session:
+            session.mark_dirty(self)
+            return
+
         sql = """
             UPDATE authors
             SET name = ?
             WHERE author_id = ?
         """
-        CURSOR.execute(sql, (self.name, self.author_id))
-        CONN.commit()
+        execute(sql, (self.name, self.author_id))
 
     #Deleting an author record
     def delete(self):
+        session = current_session()
+        if session:
+            session.mark_deleted(self)
+            return
+
         sql = """
             DELETE FROM authors
             WHERE author_id = ?
         """
-        CURSOR.execute(sql, (self.author_id,))
-        CONN.commit()
+        execute(sql, (self.author_id,))
 
         del type(self).all[self.author_id]
 
@@ -148,6 +303,7 @@ class Author:
         from lib.models.article import Article
         article = Article(title=title, author_id=self.author_id, magazine_id=magazine.magazine_id)
         article.save()
+        self._prefetched = None
         return article
 
     def topic_areas(self):
@@ -156,44 +312,205 @@ class Author:
             FROM magazines m
             JOIN articles a ON m.magazine_id = a.magazine_id
             WHERE a.author_id = ?
+            ORDER BY m.category
         """
-        rows = CURSOR.execute(sql, (self.author_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            from lib.models.magazine import Magazine
+            magazines = Magazine.find_all_by_id(pair[1] for pair in shards.pairs("author_id", [self.author_id]))
+            return sorted({magazine.category for magazine in magazines.values()})
+        rows = fetchall(sql, (self.author_id,))
         return [row[0] for row in rows]
+
+    @classmethod
+    #The topic areas of many authors with one grouped query
+    def topic_areas_for(cls, ids=None):
+        """Return {author_id: topic_areas()} for `ids`, or for every author.
+
+        Reads the per-(author, magazine) counts instead of every article, and
+        authors without articles map to [].
+        """
+        shards = get_shards()
+        if shards is not None:
+            from lib.models.magazine import Magazine
+            pairs, ids = cls._sharded_pairs(shards, ids)
+            magazines = Magazine.find_all_by_id({pair[1] for pair in pairs})
+            rows = sorted({
+                (author_id, magazines[magazine_id].category)
+                for author_id, magazine_id, _ in pairs if magazine_id in magazines
+            })
+            return group_rows(ids, rows, lambda row: row[1])
+        if ids is None:
+            sql = """
+                SELECT DISTINCT au.author_id, m.category
+                FROM authors au
+                LEFT JOIN author_magazine_counts c ON c.author_id = au.author_id AND c.article_count > 0
+                LEFT JOIN magazines m ON m.magazine_id = c.magazine_id
+                ORDER BY au.author_id, m.category
+            """
+            return group_rows((), fetchall(sql), lambda row: row[1])
+        ids = list(dict.fromkeys(ids))
+        sql = """
+            SELECT DISTINCT c.author_id, m.category
+            FROM author_magazine_counts c
+            JOIN magazines m ON m.magazine_id = c.magazine_id
+            WHERE c.author_id IN ({ids}) AND c.article_count > 0
+            ORDER BY c.author_id, m.category
+        """
+        return group_rows(ids, fetch_in(sql, ids), lambda row: row[1])
     
+    @classmethod
+    def _sharded_pairs(cls, shards, ids):
+        """The shards' (author, magazine, count) pairs for `ids`, or for every author, and the ids"""
+        if ids is None:
+            ids = [row[0] for row in fetchall("SELECT author_id FROM authors ORDER BY author_id")]
+            return shards.pairs(), ids
+        ids = list(dict.fromkeys(ids))
+        return shards.pairs("author_id", ids), ids
+
     @classmethod
     def top_author(cls):
         sql = """
-            SELECT a.author_id, a.name, COUNT(ar.article_id) AS article_count
-            FROM authors a
-            JOIN articles ar ON a.author_id = ar.author_id
-            GROUP BY a.author_id
-            ORDER BY article_count DESC
+            SELECT s.author_id
+            FROM author_stats s
+            JOIN authors a ON a.author_id = s.author_id
+            ORDER BY s.article_count DESC
             LIMIT 1
         """
-        row = CURSOR.execute(sql).fetchone()
+        shards = get_shards()
+        if shards is not None:
+            #Each shard only counts its own articles, so the totals are summed first
+            author_id = shards.top_author_id()
+            return cls.find_by_id(author_id) if author_id is not None else None
+        row = fetchone(sql)
         if row:
-            # row[0] = author_id, row[1] = name
+            # row[0] = author_id
             return cls.find_by_id(row[0])
         return None
 
     def articles(self):
         #Return a list of articles associated with the current author
         from lib.models.article import Article
+        if self._prefetched and "articles" in self._prefetched:
+            return list(self._prefetched["articles"])
         sql = """
             SELECT * FROM articles
             WHERE author_id = ?
         """
-        rows = CURSOR.execute(sql, (self.author_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            rows = shards.articles_by("author_id", [self.author_id])
+        else:
+            rows = fetchall(sql, (self.author_id,))
 
         return [Article.instance_from_db(row) for row in rows]
     
+    def articles_page(self, after=None, limit=DEFAULT_PAGE_SIZE, order_by="article_id"):
+        #Return one Page of the articles associated with the current author
+        from lib.models.article import Article
+        return Article.page(after, limit, order_by, author_id=self.author_id)
+
+    def iter_articles(self, batch_size=DEFAULT_FETCH_SIZE):
+        #Stream the articles associated with the current author
+        from lib.models.article import Article
+        sql = """
+            SELECT * FROM articles
+            WHERE author_id = ?
+        """
+        shards = get_shards()
+        if shards is not None:
+            rows = shards.iterate("author_id", self.author_id, batch_size)
+        else:
+            rows = iterate(sql, (self.author_id,), batch_size)
+        for row in rows:
+            yield Article.instance_from_db(row)
+
     def magazines(self):
         from lib.models.magazine import Magazine
+        if self._prefetched and "magazines" in self._prefetched:
+            return list(self._prefetched["magazines"])
         sql = """
             SELECT DISTINCT m.*
             FROM magazines m
             JOIN articles a ON m.magazine_id = a.magazine_id
             WHERE a.author_id = ?
+            ORDER BY m.magazine_id
         """
-        rows = CURSOR.execute(sql, (self.author_id,)).fetchall()
-        return [Magazine.instance_from_db(row) for row in rows]
\ No newline at end of file
+        shards = get_shards()
+        if shards is not None:
+            magazines = Magazine.find_all_by_id(pair[1] for pair in shards.pairs("author_id", [self.author_id]))
+            return [magazines[magazine_id] for magazine_id in sorted(magazines)]
+        rows = fetchall(sql, (self.author_id,))
+        return [Magazine.instance_from_db(row) for row in rows]
+
+    @classmethod
+    #The magazines of many authors with one grouped query
+    def magazines_for(cls, ids=None):
+        """Return {author_id: magazines()} for `ids`, or for every author"""
+        from lib.models.magazine import Magazine
+        shards = get_shards()
+        if shards is not None:
+            pairs, ids = cls._sharded_pairs(shards, ids)
+            magazines = Magazine.find_all_by_id({pair[1] for pair in pairs})
+            rows = [(author_id, magazine_id) for author_id, magazine_id, _ in pairs if magazine_id in magazines]
+            return group_rows(ids, rows, lambda row: magazines[row[1]])
+        if ids is None:
+            sql = """
+                SELECT au.author_id, m.*
+                FROM authors au
+                LEFT JOIN author_magazine_counts c ON c.author_id = au.author_id AND c.article_count > 0
+                LEFT JOIN magazines m ON m.magazine_id = c.magazine_id
+                ORDER BY au.author_id, m.magazine_id
+            """
+            return group_rows((), fetchall(sql), lambda row: Magazine.instance_from_db(row[1:]))
+        ids = list(dict.fromkeys(ids))
+        sql = """
+            SELECT c.author_id, m.*
+            FROM author_magazine_counts c
+            JOIN magazines m ON m.magazine_id = c.magazine_id
+            WHERE c.author_id IN ({ids}) AND c.article_count > 0
+            ORDER BY c.author_id, m.magazine_id
+        """
+        return group_rows(ids, fetch_in(sql, ids), lambda row: Magazine.instance_from_db(row[1:]))
+
+    def iter_magazines(self, batch_size=DEFAULT_FETCH_SIZE):
+        from lib.models.magazine import Magazine
+        sql = """
+            SELECT DISTINCT m.*
+            FROM magazines m
+            JOIN articles a ON m.magazine_id = a.magazine_id
+            WHERE a.author_id = ?
+            ORDER BY m.magazine_id
+        """
+        if get_shards() is not None:
+            #An author writes for few magazines, so the list is read at once
+            yield from self.magazines()
+            return
+        for row in iterate(sql, (self.author_id,), batch_size):
+            yield Magazine.instance_from_db(row)
+
+    #Awaitable versions of the methods above, run on the database executor
+    afind_by_id = aio.async_classmethod("find_by_id")
+    afind_by_name = aio.async_classmethod("find_by_name")
+    aget_all = aio.async_classmethod("get_all")
+    atop_author = aio.async_classmethod("top_author")
+    atopic_areas = aio.async_method("topic_areas")
+    atopic_areas_for = aio.async_classmethod("topic_areas_for")
+    aarticles = aio.async_method("articles")
+    amagazines = aio.async_method("magazines")
+    amagazines_for = aio.async_classmethod("magazines_for")
+    acreate = aio.async_classmethod("create", coalesce=False)
+    acreate_many = aio.async_classmethod("create_many", coalesce=False)
+    abulk_save = aio.async_classmethod("bulk_save", coalesce=False)
+    aget_or_create = aio.async_classmethod("get_or_create", coalesce=False)
+    aget_or_create_many = aio.async_classmethod("get_or_create_many", coalesce=False)
+    aadd_with_articles = aio.async_classmethod("add_with_articles", coalesce=False)
+    asave = aio.async_method("save", coalesce=False)
+    aupdate = aio.async_method("update", coalesce=False)
+    adelete = aio.async_method("delete", coalesce=False)
+    aadd_article = aio.async_method("add_article", coalesce=False)
+
+    @classmethod
+    async def aiter_all(cls, batch_size=aio.DEFAULT_BATCH_SIZE):
+        async for row in aio.aiter_rows("authors", "author_id", batch_size):
+            yield cls.instance_from_db(row)
@@ -1,12 +1,25 @@
-from db.connection import CURSOR, CONN
+from db.connection import fetchone, fetchall, execute, iterate, DEFAULT_FETCH_SIZE
+from db.bulk import insert_many, upsert_many, DEFAULT_CHUNK_SIZE, DEFAULT_UPSERT_SIZE
+from db.pagination import fetch_page, DEFAULT_PAGE_SIZE
+from db.prefetch import fetch_in, attach, group_rows, load_relations
+from db import aio
+from db.identity import WeakIdentityMap
+from db.session import current_session
+from db.sharding import get_shards
 
 class Magazine:
-    all = {}
+    all = WeakIdentityMap()
+    table_name = "magazines"
+    id_column = "magazine_id"
+    columns = ("name", "category")
+    flush_order = 0
+    __slots__ = ("magazine_id", "name", "category", "_prefetched", "__weakref__")
 
     def __init__(self, name, category, magazine_id = None):
         self.magazine_id = magazine_id
         self.name = name 
         self.category = category
+        self._prefetched = None
     
     def __repr__(self):
         return f"Magazine ID ({self.magazine_id}): {self.name} -- {self.category}"
@@ -21,8 +34,9 @@ class Magazine:
                 category VARCHAR(255) NOT NULL
             )
         """
-        CURSOR.execute(sql)
-        CONN.commit()
+        execute(sql)
+        execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_magazines_name ON magazines (name)")
+        execute("CREATE INDEX IF NOT EXISTS idx_magazines_category ON magazines (category)")
 
     @classmethod
     #Deleting the magazines table
@@ -30,19 +44,22 @@ class Magazine:
         sql = """
             DROP TABLE IF EXISTS magazines;
         """
-        CURSOR.execute(sql)
-        CONN.commit()
+        execute(sql)
 
     #Inserting a new row into the magazines table
     def save(self):
+        session = current_session()
+        if session:
+            session.add(self)
+            return
+
         sql = """
             INSERT INTO magazines (name, category)
             VALUES (?, ?)
         """
-        CURSOR.execute(sql, (self.name, self.category))
-        CONN.commit()
+        cursor = execute(sql, (self.name, self.category))
 
-        self.magazine_id = CURSOR.lastrowid
+        self.magazine_id = cursor.lastrowid
             
         #Adds the magazine instance to the dictionary
         type(self).all[self.magazine_id] = self
@@ -57,21 +74,91 @@ class Magazine:
             magazine.name = row[1]
             magazine.category = row[2]
         else:
-            magazine = cls(row[1], row[2], magazine_id=row[0])
-            cls.all[magazine.magazine_id] = magazine
+            #Filling the slots straight from the tuple skips __init__
+            magazine = cls.__new__(cls)
+            magazine.magazine_id = row[0]
+            magazine.name = row[1]
+            magazine.category = row[2]
+            magazine._prefetched = None
+            cls.all[row[0]] = magazine
         return magazine
     
     @classmethod
-    def get_all(cls):
-        """Return a list containing a Magazine object per row in the table"""
+    def get_all(cls, prefetch=None):
+        """Return a list containing a Magazine object per row in the table.
+
+        `prefetch` names relations ("articles", "authors") to load for all
+        of them up front, one query per relation.
+        """
         sql = """
             SELECT *
             FROM magazines
         """
 
-        rows = CURSOR.execute(sql).fetchall()
+        rows = fetchall(sql)
 
-        return [cls.instance_from_db(row) for row in rows]
+        return cls.prefetch([cls.instance_from_db(row) for row in rows], prefetch)
+
+    @classmethod
+    def iter_all(cls, batch_size=DEFAULT_FETCH_SIZE):
+        """Yield a Magazine object per row, fetching `batch_size` rows at a time"""
+        sql = """
+            SELECT *
+            FROM magazines
+        """
+        for row in iterate(sql, batch_size=batch_size):
+            yield cls.instance_from_db(row)
+
+    @classmethod
+    #Loading the named relations for many magazines at once
+    def prefetch(cls, magazines, relations):
+        """Prefetched relations are a snapshot; they are served until the next prefetch"""
+        return load_relations(cls, magazines, relations)
+
+    @classmethod
+    #Loading the articles of many magazines with one query per chunk of ids
+    def prefetch_articles(cls, magazines):
+        from lib.models.article import Article
+        sql = """
+            SELECT magazine_id, * FROM articles
+            WHERE magazine_id IN ({ids})
+        """
+        shards = get_shards()
+        if shards is not None:
+            ids = {magazine.magazine_id for magazine in magazines}
+            rows = [(row[3], *row) for row in shards.articles_by("magazine_id", ids)]
+        else:
+            rows = fetch_in(sql, {magazine.magazine_id for magazine in magazines})
+        attach(magazines, "magazine_id", "articles", rows, lambda row: Article.instance_from_db(row[1:]))
+        return magazines
+
+    @classmethod
+    #Loading the contributing authors of many magazines with one query per chunk of ids
+    def prefetch_authors(cls, magazines):
+        from lib.models.author import Author
+        sql = """
+            SELECT DISTINCT ar.magazine_id, au.*
+            FROM authors au
+            JOIN articles ar ON au.author_id = ar.author_id
+            WHERE ar.magazine_id IN ({ids})
+            ORDER BY au.author_id
+        """
+        shards = get_shards()
+        if shards is not None:
+            pairs = sorted((magazine_id, author_id) for author_id, magazine_id, _ in
+                           shards.pairs("magazine_id", {magazine.magazine_id for magazine in magazines}))
+            authors = Author.find_all_by_id({pair[1] for pair in pairs})
+            rows = [pair for pair in pairs if pair[1] in authors]
+            attach(magazines, "magazine_id", "authors", rows, lambda row: authors[row[1]])
+            return magazines
+        rows = fetch_in(sql, {magazine.magazine_id for magazine in magazines})
+        attach(magazines, "magazine_id", "authors", rows, lambda row: Author.instance_from_db(row[1:]))
+        return magazines
+    
+    @classmethod
+    def page(cls, after=None, limit=DEFAULT_PAGE_SIZE, order_by="magazine_id"):
+        """Return one Page of magazines using keyset pagination, ordered by magazine_id or name"""
+        return fetch_page(cls, order_by, ("magazine_id", "name"), after=after, limit=limit)
     
     @classmethod
     def find_by_id(cls, magazine_id):
@@ -79,8 +166,19 @@ class Magazine:
             SELECT * FROM magazines
             WHERE magazine_id = ?
         """
-        row = CURSOR.execute(sql, (magazine_id,)).fetchone()
+        row = fetchone(sql, (magazine_id,))
         return cls.instance_from_db(row) if row else None
+
+    @classmethod
+    #Finding many magazines by id with one query per chunk of ids
+    def find_all_by_id(cls, ids):
+        """Return {magazine_id: Magazine} for the `ids` that exist"""
+        sql = """
+            SELECT * FROM magazines
+            WHERE magazine_id IN ({ids})
+        """
+        rows = fetch_in(sql, set(ids))
+        return {row[0]: cls.instance_from_db(row) for row in rows}
     
     @classmethod
     def find_by_name(cls, name):
@@ -88,7 +186,7 @@ class Magazine:
             SELECT * FROM magazines
             WHERE name = ?
         """
-        row = CURSOR.execute(sql, (name,)).fetchone()
+        row = fetchone(sql, (name,))
         return cls.instance_from_db(row) if row else None
     
     @classmethod
@@ -97,52 +195,71 @@ class Magazine:
             SELECT * FROM magazines
             WHERE category = ?
         """
-        row = CURSOR.execute(sql, (category,)).fetchone()
+        row = fetchone(sql, (category,))
         return cls.instance_from_db(row) if row else None
     
     @classmethod
-    def get_all_by_category(cls, category):
+    def get_all_by_category(cls, category, prefetch=None):
         sql = """
             SELECT * FROM magazines
             WHERE category = ?
         """
-        rows = CURSOR.execute(sql, (category,)).fetchall()
-        return [cls.instance_from_db(row) for row in rows]
+        rows = fetchall(sql, (category,))
+        return cls.prefetch([cls.instance_from_db(row) for row in rows], prefetch)
     
     @classmethod
     def with_multiple_authors(cls):
         sql = """
             SELECT m.*
-            FROM magazines m
-            JOIN articles a ON m.magazine_id = a.magazine_id
-            GROUP BY m.magazine_id
-            HAVING COUNT(DISTINCT a.author_id) >= 2
+            FROM magazine_stats s
+            JOIN magazines m ON m.magazine_id = s.magazine_id
+            WHERE s.author_count >= 2
         """
-        rows = CURSOR.execute(sql).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            #A pair lives on one shard, so counting pairs counts distinct authors
+            authors = {}
+            for _, magazine_id, _ in shards.pairs():
+                authors[magazine_id] = authors.get(magazine_id, 0) + 1
+            magazines = cls.find_all_by_id(magazine_id for magazine_id, count in authors.items() if count >= 2)
+            return [magazines[magazine_id] for magazine_id in sorted(magazines)]
+        rows = fetchall(sql)
         return [cls.instance_from_db(row) for row in rows]
     
     @classmethod
     def article_counts(cls):
         sql = """
-            SELECT m.name, COUNT(a.article_id) AS article_count
+            SELECT m.name, COALESCE(s.article_count, 0) AS article_count
             FROM magazines m
-            LEFT JOIN articles a ON m.magazine_id = a.magazine_id
-            GROUP BY m.magazine_id
+            LEFT JOIN magazine_stats s ON s.magazine_id = m.magazine_id
+            ORDER BY m.magazine_id
         """
-        rows = CURSOR.execute(sql).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            #Magazine names come from the primary, the counts from every shard
+            totals = shards.magazine_totals()
+            rows = fetchall("SELECT magazine_id, name FROM magazines ORDER BY magazine_id")
+            return [{'name': row[1], 'article_count': totals.get(row[0], 0)} for row in rows]
+        rows = fetchall(sql)
         return [{'name': row[0], 'article_count': row[1]} for row in rows]
     
     @classmethod
     def most_articles_written(cls):
         sql = """
-            SELECT a.*, COUNT(ar.article_id) AS article_count
-            FROM authors a
-            JOIN articles ar ON a.author_id = ar.author_id
-            GROUP BY a.author_id
-            ORDER BY article_count DESC
+            SELECT m.*
+            FROM magazine_stats s
+            JOIN magazines m ON m.magazine_id = s.magazine_id
+            ORDER BY s.article_count DESC, s.magazine_id
             LIMIT 1
         """
-        row = CURSOR.execute(sql).fetchone()
+        shards = get_shards()
+        if shards is not None:
+            totals = shards.magazine_totals()
+            magazines = cls.find_all_by_id(totals)
+            if not magazines:
+                return None
+            return magazines[min(magazines, key=lambda magazine_id: (-totals[magazine_id], magazine_id))]
+        row = fetchone(sql)
         return cls.instance_from_db(row) if row else None
 
     @classmethod
@@ -151,46 +268,210 @@ class Magazine:
         magazine = cls(name, category)
         magazine.save()
         return magazine
+
+    @classmethod
+    #Creating many magazine records in a single transaction
+    def create_many(cls, rows, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        """Insert (name, category) tuples or dicts; `rows` may be any iterable.
+
+        `return_objects=False` returns a count instead of the magazines.
+        """
+        magazines = (
+            cls(row["name"], row["category"]) if isinstance(row, dict) else cls(*row)
+            for row in rows
+        )
+        return cls.bulk_save(magazines, chunk_size, return_objects)
+
+    @classmethod
+    #Finding a magazine by name, creating it in `category` if there is none
+    def get_or_create(cls, name, category):
+        """Return the magazine called `name`; `category` is only used when it has to be created"""
+        return cls.get_or_create_many([(name, category)])[0]
+
+    @classmethod
+    #Creating a magazine or moving the existing one to `category`
+    def upsert(cls, name, category):
+        """Insert the magazine, or set the category of the one with that name, in one statement"""
+        return cls.upsert_many([(name, category)])[0]
+
+    @classmethod
+    #Finding many magazines by name in one transaction, creating the missing ones
+    def get_or_create_many(cls, rows, chunk_size=DEFAULT_UPSERT_SIZE):
+        """Return a magazine per (name, category) tuple or dict in `rows`, in order.
+
+        When a name repeats, the first row's category is the one used.
+        """
+        return cls._resolve(rows, (), chunk_size)
+
+    @classmethod
+    #Creating or updating many magazines in one transaction
+    def upsert_many(cls, rows, chunk_size=DEFAULT_UPSERT_SIZE):
+        """Like get_or_create_many, but existing magazines take the category given; the last one wins"""
+        return cls._resolve(rows, ("category",), chunk_size)
+
+    @classmethod
+    def _resolve(cls, rows, update, chunk_size):
+        rows = [(row["name"], row["category"]) if isinstance(row, dict) else tuple(row) for row in rows]
+        unique = {}
+        for name, category in rows:
+            if update or name not in unique:
+                unique[name] = (name, category)
+        found = upsert_many(cls.table_name, "name", cls.columns, list(unique.values()), update, chunk_size)
+        magazines = {name: cls.instance_from_db(row) for name, row in found.items()}
+        return [magazines[name] for name, _ in rows]
+
+    @classmethod
+    #Inserting many unsaved magazine instances in a single transaction
+    def bulk_save(cls, magazines, chunk_size=DEFAULT_CHUNK_SIZE, return_objects=True):
+        if not return_objects:
+            #Counting only: the instances are not kept, so they skip the identity map and session
+            return insert_many(
+                cls.table_name, cls.id_column, cls.columns, magazines,
+                lambda magazine: tuple(getattr(magazine, column) for column in cls.columns),
+                chunk_size, return_objects=False
+            )
+
+        session = current_session()
+        saved = insert_many(
+            cls.table_name, cls.id_column, cls.columns, magazines,
+            lambda magazine: tuple(getattr(magazine, column) for column in cls.columns),
+            chunk_size
+        )
+        if session:
+            session.track_inserted(saved)
+        for magazine in saved:
+            cls.all[magazine.magazine_id] = magazine
+        return saved
     
     #Updating an existing magazine record
     def update(self):
+        session = current_session()
+        if session:
+            session.mark_dirty(self)
+            return
+
         sql = """
             UPDATE magazines
             SET name = ?, category = ?
             WHERE magazine_id = ?
         """
-        CURSOR.execute(sql, (self.name, self.category, self.magazine_id))
-        CONN.commit()
+        execute(sql, (self.name, self.category, self.magazine_id))
 
     #Deleting an magazine record
     def delete(self):
+        session = current_session()
+        if session:
+            session.mark_deleted(self)
+            return
+
         sql = """
             DELETE FROM magazines
             WHERE magazine_id = ?
         """
-        CURSOR.execute(sql, (self.magazine_id,))
-        CONN.commit()
+        execute(sql, (self.magazine_id,))
 
         del type(self).all[self.magazine_id]
 
         self.magazine_id = None
 
+    def _sharded_authors(self, shards, min_articles=1):
+        """The authors with at least `min_articles` articles here, from the shards' pairs, in id order"""
+        from lib.models.author import Author
+        authors = Author.find_all_by_id(pair[0] for pair in shards.pairs("magazine_id", [self.magazine_id], min_articles))
+        return [authors[author_id] for author_id in sorted(authors)]
+
     def contributors(self):
+        if self._prefetched and "authors" in self._prefetched:
+            return list(self._prefetched["authors"])
+        shards = get_shards()
+        if shards is not None:
+            return self._sharded_authors(shards)
         sql = """
             SELECT DISTINCT au.*
             FROM authors au
             JOIN articles a ON au.author_id = a.author_id
             WHERE a.magazine_id = ?
+            ORDER BY au.author_id
         """
-        rows = CURSOR.execute(sql, (self.magazine_id,)).fetchall()
+        rows = fetchall(sql, (self.magazine_id,))
         from lib.models.author import Author
         return [Author.instance_from_db(row) for row in rows]
 
+    @classmethod
+    #The contributors of many magazines with one grouped query
+    def contributors_for(cls, ids=None, min_articles=1):
+        """Return {magazine_id: [Author, ...]} for `ids`, or for every magazine.
+
+        Only authors with at least `min_articles` articles in the magazine are
+        listed: the default matches contributors(), 3 matches
+        contributing_authors(). Magazines without any map to [].
+        """
+        from lib.models.author import Author
+        shards = get_shards()
+        if shards is not None:
+            if ids is None:
+                ids = [row[0] for row in fetchall("SELECT magazine_id FROM magazines ORDER BY magazine_id")]
+                pairs = shards.pairs(min_articles=min_articles)
+            else:
+                ids = list(dict.fromkeys(ids))
+                pairs = shards.pairs("magazine_id", ids, min_articles)
+            authors = Author.find_all_by_id({pair[0] for pair in pairs})
+            rows = sorted((magazine_id, author_id) for author_id, magazine_id, _ in pairs if author_id in authors)
+            return group_rows(ids, rows, lambda row: authors[row[1]])
+        if ids is None:
+            sql = """
+                SELECT m.magazine_id, au.*
+                FROM magazines m
+                LEFT JOIN author_magazine_counts c ON c.magazine_id = m.magazine_id AND c.article_count >= ?
+                LEFT JOIN authors au ON au.author_id = c.author_id
+                ORDER BY m.magazine_id, au.author_id
+            """
+            return group_rows((), fetchall(sql, (min_articles,)), lambda row: Author.instance_from_db(row[1:]))
+        ids = list(dict.fromkeys(ids))
+        sql = """
+            SELECT c.magazine_id, au.*
+            FROM author_magazine_counts c
+            JOIN authors au ON au.author_id = c.author_id
+            WHERE c.article_count >= ? AND c.magazine_id IN ({ids})
+            ORDER BY c.magazine_id, au.author_id
+        """
+        rows = fetch_in(sql, ids, (min_articles,))
+        return group_rows(ids, rows, lambda row: Author.instance_from_db(row[1:]))
+
+    def iter_contributors(self, batch_size=DEFAULT_FETCH_SIZE):
+        from lib.models.author import Author
+        sql = """
+            SELECT DISTINCT au.*
+            FROM authors au
+            JOIN articles a ON au.author_id = a.author_id
+            WHERE a.magazine_id = ?
+            ORDER BY au.author_id
+        """
+        shards = get_shards()
+        if shards is not None:
+            yield from self._sharded_authors(shards)
+            return
+        for row in iterate(sql, (self.magazine_id,), batch_size):
+            yield Author.instance_from_db(row)
+
     def article_titles(self):
         sql = "SELECT title FROM articles WHERE magazine_id = ?"
-        rows = CURSOR.execute(sql, (self.magazine_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            return [row[1] for row in shards.articles_by("magazine_id", [self.magazine_id])]
+        rows = fetchall(sql, (self.magazine_id,))
         return [row[0] for row in rows]
 
+    def iter_article_titles(self, batch_size=DEFAULT_FETCH_SIZE):
+        sql = "SELECT title FROM articles WHERE magazine_id = ?"
+        shards = get_shards()
+        if shards is not None:
+            for row in shards.iterate("magazine_id", self.magazine_id, batch_size):
+                yield row[1]
+            return
+        for row in iterate(sql, (self.magazine_id,), batch_size):
+            yield row[0]
+
     def contributing_authors(self):
         sql = """
             SELECT au.*, COUNT(a.article_id) as article_count
@@ -199,31 +480,112 @@ class Magazine:
             WHERE a.magazine_id = ?
             GROUP BY au.author_id
             HAVING article_count > 2
+            ORDER BY au.author_id
         """
-        rows = CURSOR.execute(sql, (self.magazine_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            return self._sharded_authors(shards, min_articles=3)
+        rows = fetchall(sql, (self.magazine_id,))
         from lib.models.author import Author
         return [Author.instance_from_db(row) for row in rows]
 
     def articles(self):
         #Return all the articles associated with the current Magazine instance
         from lib.models.article import Article
+        if self._prefetched and "articles" in self._prefetched:
+            return list(self._prefetched["articles"])
         sql = """
             SELECT * FROM articles
             WHERE magazine_id = ?
         """
-        rows = CURSOR.execute(sql, (self.magazine_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            rows = shards.articles_by("magazine_id", [self.magazine_id])
+        else:
+            rows = fetchall(sql, (self.magazine_id,))
 
         return [Article.instance_from_db(row) for row in rows]
     
+    def articles_page(self, after=None, limit=DEFAULT_PAGE_SIZE, order_by="article_id"):
+        #Return one Page of the articles associated with the current magazine
+        from lib.models.article import Article
+        return Article.page(after, limit, order_by, magazine_id=self.magazine_id)
+
+    def iter_articles(self, batch_size=DEFAULT_FETCH_SIZE):
+        #Stream the articles associated with the current Magazine instance
+        from lib.models.article import Article
+        sql = """
+            SELECT * FROM articles
+            WHERE magazine_id = ?
+        """
+        shards = get_shards()
+        if shards is not None:
+            rows = shards.iterate("magazine_id", self.magazine_id, batch_size)
+        else:
+            rows = iterate(sql, (self.magazine_id,), batch_size)
+        for row in rows:
+            yield Article.instance_from_db(row)
+
     def authors(self):
         from lib.models.author import Author
+        if self._prefetched and "authors" in self._prefetched:
+            return list(self._prefetched["authors"])
         sql = """
             SELECT DISTINCT au.*
             FROM authors au
             JOIN articles ar ON au.author_id = ar.author_id
             WHERE ar.magazine_id = ?
+            ORDER BY au.author_id
         """
-        rows = CURSOR.execute(sql, (self.magazine_id,)).fetchall()
+        shards = get_shards()
+        if shards is not None:
+            return self._sharded_authors(shards)
+        rows = fetchall(sql, (self.magazine_id,))
         return [Author.instance_from_db(row) for row in rows]
 
-    
\ No newline at end of file
+    def iter_authors(self, batch_size=DEFAULT_FETCH_SIZE):
+        from lib.models.author import Author
+        sql = """
+            SELECT DISTINCT au.*
+            FROM authors au
+            JOIN articles ar ON au.author_id = ar.author_id
+            WHERE ar.magazine_id = ?
+            ORDER BY au.author_id
+        """
+        shards = get_shards()
+        if shards is not None:
+            yield from self._sharded_authors(shards)
+            return
+        for row in iterate(sql, (self.magazine_id,), batch_size):
+            yield Author.instance_from_db(row)
+
+    #Awaitable versions of the methods above, run on the database executor
+    afind_by_id = aio.async_classmethod("find_by_id")
+    afind_by_name = aio.async_classmethod("find_by_name")
+    afind_by_category = aio.async_classmethod("find_by_category")
+    aget_all = aio.async_classmethod("get_all")
+    aget_all_by_category = aio.async_classmethod("get_all_by_category")
+    awith_multiple_authors = aio.async_classmethod("with_multiple_authors")
+    aarticle_counts = aio.async_classmethod("article_counts")
+    amost_articles_written = aio.async_classmethod("most_articles_written")
+    acontributors = aio.async_method("contributors")
+    acontributors_for = aio.async_classmethod("contributors_for")
+    aarticle_titles = aio.async_method("article_titles")
+    acontributing_authors = aio.async_method("contributing_authors")
+    aarticles = aio.async_method("articles")
+    aauthors = aio.async_method("authors")
+    acreate = aio.async_classmethod("create", coalesce=False)
+    acreate_many = aio.async_classmethod("create_many", coalesce=False)
+    abulk_save = aio.async_classmethod("bulk_save", coalesce=False)
+    aget_or_create = aio.async_classmethod("get_or_create", coalesce=False)
+    aget_or_create_many = aio.async_classmethod("get_or_create_many", coalesce=False)
+    aupsert = aio.async_classmethod("upsert", coalesce=False)
+    aupsert_many = aio.async_classmethod("upsert_many", coalesce=False)
+    asave = aio.async_method("save", coalesce=False)
+    aupdate = aio.async_method("update", coalesce=False)
+    adelete = aio.async_method("delete", coalesce=False)
+
+    @classmethod
+    async def aiter_all(cls, batch_size=aio.DEFAULT_BATCH_SIZE):
+        async for row in aio.aiter_rows("magazines", "magazine_id", batch_size):
+            yield cls.instance_from_db(row)
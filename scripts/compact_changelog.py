@@ -0,0 +1,16 @@
+import argparse
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.changelog import DEFAULT_MAX_ROWS, compact, latest_seq
+
+parser = argparse.ArgumentParser(description="Delete change log rows every consumer has processed.")
+parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS,
+                    help="keep at most this many changes even if a consumer still needs older ones")
+args = parser.parse_args()
+
+deleted = compact(args.max_rows)
+print(f"Deleted {deleted} changes; latest seq is {latest_seq()}.")
@@ -0,0 +1,46 @@
+import argparse
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.changelog import ChangelogTruncated
+from db.export import FORMATS, export
+
+parser = argparse.ArgumentParser(description="Export the article catalogue to CSV or JSON Lines.")
+parser.add_argument("output", help="file to write; a .gz suffix compresses it")
+parser.add_argument("--format", choices=FORMATS, help="defaults to the output's extension, else csv")
+parser.add_argument("--since", type=int, help="only export articles changed after this watermark")
+parser.add_argument("--watermark-file",
+                    help="read --since from this file and store the new watermark in it after a successful export")
+args = parser.parse_args()
+
+fmt = args.format
+if fmt is None:
+    fmt = "jsonl" if args.output.removesuffix(".gz").endswith((".jsonl", ".json")) else "csv"
+
+since = args.since
+if since is None and args.watermark_file and os.path.exists(args.watermark_file):
+    with open(args.watermark_file) as f:
+        since = int(f.read().strip())
+
+
+def report(rows, seconds):
+    print(f"  {rows} rows, {rows / seconds:,.0f} rows/s", file=sys.stderr)
+
+
+try:
+    result = export(args.output, fmt, since=since, progress=report)
+except ChangelogTruncated as e:
+    sys.exit(f"{e}; run a full export without --since to resync")
+
+# Only move the watermark once the export is complete, and never leave a half-written file
+if args.watermark_file:
+    partial = args.watermark_file + ".tmp"
+    with open(partial, "w") as f:
+        f.write(f"{result.watermark}\n")
+    os.replace(partial, args.watermark_file)
+
+print(f"Exported {result.rows} rows in {result.seconds:.2f}s "
+      f"({result.rows_per_second:,.0f} rows/s), watermark {result.watermark}.")
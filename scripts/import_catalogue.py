@@ -0,0 +1,36 @@
+import argparse
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db import instrument
+from db.connection import configure
+from db.importer import DEFAULT_BATCH_SIZE, FORMATS, import_file
+
+parser = argparse.ArgumentParser(description="Import (author, magazine, category, title) records from CSV or JSON Lines.")
+parser.add_argument("input", help="file to read; a .gz suffix is decompressed")
+parser.add_argument("--format", choices=FORMATS, help="defaults to the input's extension, else csv")
+parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="articles per transaction")
+parser.add_argument("--workers", type=int, help="parser processes; defaults to the CPU count, 0 parses inline")
+parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an earlier run and start over")
+args = parser.parse_args()
+
+# Big transactions want the bulk-load cache and sync settings
+configure(profile="bulk-load")
+# Every batch insert is slow by design; the progress lines say how fast it goes
+instrument.set_slow_query_ms(None)
+
+
+def report(rows, seconds):
+    print(f"  {rows} rows, {rows / seconds:,.0f} rows/s", file=sys.stderr)
+
+
+result = import_file(args.input, args.format, args.batch_size, args.workers, restart=args.restart, progress=report)
+
+if result.resumed_at:
+    print(f"Resumed at byte {result.resumed_at}.")
+print(f"Imported {result.rows} rows in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s); "
+      f"created {result.authors_created} authors and {result.magazines_created} magazines, "
+      f"skipped {result.skipped} records.")
@@ -0,0 +1,56 @@
+import argparse
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.connection import configure
+from db.instrument import set_slow_query_ms
+from db.sharding import DEFAULT_PARTITIONS, SHARD_KEYS, ShardSet
+
+parser = argparse.ArgumentParser(description="Create, grow and rebalance the article shards of a database.")
+parser.add_argument("--database", help="primary database holding the shard layout (default: $ARTICLES_DB)")
+commands = parser.add_subparsers(dest="command", required=True)
+
+init = commands.add_parser("init", help="lay out the shards and copy the existing articles into them")
+init.add_argument("paths", nargs="+", help="shard files to create")
+init.add_argument("--key", choices=SHARD_KEYS, default="magazine_id")
+init.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS)
+
+add = commands.add_parser("add", help="add an empty shard file; run rebalance afterwards")
+add.add_argument("path")
+
+move = commands.add_parser("move", help="move one partition to another shard")
+move.add_argument("partition", type=int)
+move.add_argument("shard", type=int)
+
+rebalance = commands.add_parser("rebalance", help="move partitions until the shards hold similar article counts")
+rebalance.add_argument("--dry-run", action="store_true", help="only print the moves")
+
+commands.add_parser("status", help="print each shard's path and article count")
+args = parser.parse_args()
+
+if args.database:
+    configure(args.database)
+#Copies and moves are long statements by design
+set_slow_query_ms(None)
+
+if args.command == "init":
+    shards = ShardSet.create(args.paths, args.key, args.partitions)
+else:
+    shards = ShardSet()
+
+if args.command == "add":
+    print(f"Added shard {shards.add_shard(args.path)}.")
+elif args.command == "move":
+    print(f"Moved {shards.move_partition(args.partition, args.shard)} articles.")
+elif args.command == "rebalance":
+    for partition, source, target in shards.rebalance(args.dry_run):
+        print(f"partition {partition}: shard {source} -> shard {target}")
+
+counts = shards.counts()
+for shard, path in shards.paths.items():
+    owned = sum(1 for owner in shards.owners if owner == shard)
+    print(f"shard {shard}: {counts[shard]} articles in {owned} partitions ({path})")
+shards.close()
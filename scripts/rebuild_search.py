@@ -0,0 +1,10 @@
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.search import rebuild_search
+
+rebuild_search()
+print("Search index rebuilt.")
@@ -0,0 +1,17 @@
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.stats import drift, rebuild_stats
+
+# With --check, only report drift and exit non-zero if there is any
+if "--check" in sys.argv[1:]:
+    counts = drift()
+    for table, count in counts.items():
+        print(f"{table}: {count} rows out of date")
+    sys.exit(1 if any(counts.values()) else 0)
+
+rebuild_stats()
+print("Stats rebuilt.")
@@ -4,7 +4,6 @@ import os
 # Add the project root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from db.connection import CONN, CURSOR
 from lib.models.author import Author
 from lib.models.magazine import Magazine
 from lib.models.article import Article
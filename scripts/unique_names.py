@@ -0,0 +1,23 @@
+import sys
+import os
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.natural_keys import category_conflicts, duplicate_names, enforce_unique_names
+
+# Merging keeps the first category of each of these magazines
+conflicts = category_conflicts()
+for name, categories in conflicts.items():
+    print(f"magazines: {name!r} is filed under {', '.join(map(repr, categories))}; merging keeps {categories[0]!r}")
+
+# With --check, only report duplicates and exit non-zero if there are any
+if "--check" in sys.argv[1:]:
+    counts = duplicate_names()
+    for table, count in counts.items():
+        print(f"{table}: {count} duplicate names")
+    sys.exit(1 if any(counts.values()) else 0)
+
+for table, count in enforce_unique_names().items():
+    print(f"{table}: merged {count} duplicate rows")
+print("Unique name indexes built.")
@@ -0,0 +1,23 @@
+import sys
+import os
+import sqlite3
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.connection import DATABASE, DATABASE_ENV
+from db.migrate import missing_tables, upgrade
+from db.natural_keys import missing_indexes
+
+# A plain connection, since opening the default pool would upgrade the database already
+args = [arg for arg in sys.argv[1:] if arg != "--check"]
+conn = sqlite3.connect(args[0] if args else os.environ.get(DATABASE_ENV) or DATABASE)
+
+# With --check, only report what is missing and exit non-zero if anything is
+if "--check" in sys.argv[1:]:
+    missing = missing_tables(conn) + [f"unique names on {table}" for table in missing_indexes(conn)]
+    print(f"Missing: {', '.join(missing)}" if missing else "Nothing to upgrade.")
+    sys.exit(1 if missing else 0)
+
+created = upgrade(conn)
+print(f"Created and filled: {', '.join(created)}" if created else "Nothing to upgrade.")
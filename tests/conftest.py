@@ -0,0 +1,26 @@
+import pytest
+
+from db.connection import ConnectionPool, set_provider
+from lib.models.article import Article
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the models at a fresh database built from the scripts in db/"""
+    pool = ConnectionPool(str(tmp_path / "articles.db"))
+    with pool.connection() as conn:
+        for path in ("db/schema.sql", "db/stats.sql", "db/search.sql", "db/changelog.sql"):
+            with open(path) as f:
+                conn.executescript(f.read())
+
+    previous = set_provider(pool)
+    #A fresh map of each model's default kind; tests that need another set it themselves
+    for model in (Author, Magazine, Article):
+        monkeypatch.setattr(model, "all", type(model.all)())
+
+    yield pool
+
+    set_provider(previous)
+    pool.close()
@@ -0,0 +1,52 @@
+import asyncio
+
+from db import aio
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_async_api_mirrors_sync_api(db):
+    async def main():
+        author = await Author.acreate("Author 1")
+        magazine = await Magazine.acreate("Magazine 1", "Category 1")
+        await author.aadd_article(magazine, "Article 1")
+
+        found = await Author.afind_by_id(author.author_id)
+        articles = await magazine.aarticles()
+        return author, found, articles
+
+    author, found, articles = asyncio.run(main())
+    assert found is author
+    assert [a.title for a in articles] == ["Article 1"]
+
+
+def test_aiter_all_streams_every_row(db):
+    author = Author.create("Author 1")
+    magazine = Magazine.create("Magazine 1", "Category 1")
+    Article.create_many((f"Article {i}", author.author_id, magazine.magazine_id) for i in range(25))
+
+    async def main():
+        return [article.title async for article in Article.aiter_all(batch_size=10)]
+
+    assert asyncio.run(main()) == [f"Article {i}" for i in range(25)]
+
+
+def test_concurrent_lookups_are_coalesced(db, monkeypatch):
+    author = Author.create("Author 1")
+    calls = []
+    find_by_id = Author.find_by_id.__func__
+
+    def counting_find_by_id(cls, author_id):
+        calls.append(author_id)
+        return find_by_id(cls, author_id)
+
+    monkeypatch.setattr(Author, "find_by_id", classmethod(counting_find_by_id))
+
+    async def main():
+        return await asyncio.gather(*(Author.afind_by_id(author.author_id) for _ in range(20)))
+
+    results = asyncio.run(main())
+    assert all(result is author for result in results)
+    assert calls == [author.author_id]
+    assert not any(aio._inflight.values())
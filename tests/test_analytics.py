@@ -0,0 +1,125 @@
+import random
+from collections import Counter
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from db.analytics import AuthorMagazineMatrix
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    rng = random.Random(20)
+    authors = Author.create_many(f"Author {i}" for i in range(15))
+    magazines = Magazine.create_many((f"Magazine {i}", f"Category {i % 3}") for i in range(8))
+    Article.create_many(
+        (f"Article {i}", rng.choice(authors[:12]).author_id, rng.choice(magazines[:7]).magazine_id)
+        for i in range(200)
+    )
+    return authors, magazines
+
+
+def pair_counts():
+    return Counter(
+        (article.author_id, article.magazine_id) for article in Article.get_all()
+        if article.author_id is not None and article.magazine_id is not None
+    )
+
+
+def assert_same(matrix, other):
+    assert np.array_equal(matrix.author_ids, other.author_ids)
+    assert np.array_equal(matrix.magazine_ids, other.magazine_ids)
+    assert np.array_equal(matrix.dense(), other.dense())
+
+
+def test_load_matches_the_articles(catalogue):
+    authors, magazines = catalogue
+    matrix = AuthorMagazineMatrix.load()
+
+    assert matrix.shape == (12, 8)
+    dense = matrix.dense()
+    for (author_id, magazine_id), count in pair_counts().items():
+        assert dense[matrix.author_index(author_id), matrix.magazine_index(magazine_id)] == count
+    assert dense.sum() == sum(pair_counts().values())
+    assert matrix.author_index(authors[-1].author_id) is None
+
+
+def test_queries_match_the_model_methods(catalogue):
+    authors, magazines = catalogue
+    matrix = AuthorMagazineMatrix.load()
+
+    for author in authors:
+        assert matrix.magazines_of(author.author_id).tolist() == [m.magazine_id for m in author.magazines()]
+    assert sorted(matrix.magazines_with_authors(2).tolist()) == sorted(
+        m.magazine_id for m in Magazine.with_multiple_authors()
+    )
+    for magazine in magazines:
+        assert matrix.contributing_authors(magazine.magazine_id).tolist() == [
+            a.author_id for a in magazine.contributing_authors()
+        ]
+
+    author_ids, magazine_ids, counts = matrix.frequent_pairs(3)
+    expected = {pair: count for pair, count in pair_counts().items() if count > 3}
+    assert dict(zip(zip(author_ids.tolist(), magazine_ids.tolist()), counts.tolist())) == expected
+
+
+def test_top_authors_by_category(catalogue):
+    _, magazines = catalogue
+    category = {m.magazine_id: m.category for m in magazines}
+    totals = Counter()
+    for (author_id, magazine_id), count in pair_counts().items():
+        totals[category[magazine_id], author_id] += count
+
+    top = AuthorMagazineMatrix.load().top_authors_by_category(k=3)
+
+    assert sorted(top) == ["Category 0", "Category 1", "Category 2"]
+    for name, (author_ids, counts) in top.items():
+        ranked = sorted(((-n, a) for (c, a), n in totals.items() if c == name))[:3]
+        assert list(zip(author_ids.tolist(), counts.tolist())) == [(a, -n) for n, a in ranked]
+
+
+def test_similar_authors_by_shared_magazines(catalogue):
+    authors, _ = catalogue
+    matrix = AuthorMagazineMatrix.load()
+    magazines = {author.author_id: {m.magazine_id for m in author.magazines()} for author in authors[:12]}
+    target = authors[0].author_id
+
+    author_ids, scores = matrix.similar_authors(target, k=4)
+
+    jaccard = {
+        other: len(ids & magazines[target]) / len(ids | magazines[target])
+        for other, ids in magazines.items() if other != target and ids & magazines[target]
+    }
+    ranked = sorted(jaccard, key=lambda other: (-jaccard[other], other))[:4]
+    assert author_ids.tolist() == ranked
+    assert scores.tolist() == pytest.approx([jaccard[other] for other in ranked])
+
+
+def test_refresh_applies_only_the_changed_pairs(catalogue):
+    authors, magazines = catalogue
+    matrix = AuthorMagazineMatrix.load()
+    assert matrix.refresh() == 0
+
+    article = Article.create("New", authors[-1].author_id, magazines[-1].magazine_id)
+    moved = authors[0].articles()[0]
+    moved.magazine_id = magazines[-1].magazine_id
+    moved.update()
+    for other in authors[1].articles():
+        other.delete()
+    Magazine.create("Brand new", "Category 9")
+
+    changed = matrix.refresh()
+
+    assert 0 < changed < len(pair_counts())
+    assert_same(matrix, AuthorMagazineMatrix.load())
+    assert matrix.author_index(authors[1].author_id) is None
+    assert matrix.magazines_of(authors[-1].author_id).tolist() == [magazines[-1].magazine_id]
+    assert matrix.shape[1] == 9
+
+    article.delete()
+    matrix.refresh()
+    assert_same(matrix, AuthorMagazineMatrix.load())
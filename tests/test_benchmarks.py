@@ -0,0 +1,64 @@
+import sqlite3
+from collections import Counter
+
+from benchmarks import compare, generator, imports, models
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT * FROM articles ORDER BY article_id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_generator_is_deterministic_and_skewed(tmp_path):
+    first, second, other = (str(tmp_path / name) for name in ("a.db", "b.db", "c.db"))
+    counts = generator.generate(first, 2000, seed=1)
+    generator.generate(second, 2000, seed=1)
+    generator.generate(other, 2000, seed=2)
+
+    assert counts == {"authors": 100, "magazines": 5, "articles": 2000}
+    assert rows(first) == rows(second)
+    assert rows(first) != rows(other)
+
+    #Under a uniform draw the busiest of 100 authors would hold about 1-2%
+    by_author = Counter(row[2] for row in rows(first))
+    assert by_author.most_common(1)[0][1] > 0.1 * 2000
+
+    conn = sqlite3.connect(first)
+    assert conn.execute("SELECT SUM(article_count) FROM author_stats").fetchone() == (2000,)
+    assert conn.execute("SELECT COUNT(*) FROM articles_fts").fetchone() == (2000,)
+    conn.close()
+
+
+def test_parse_size():
+    assert [generator.parse_size(size) for size in ("500", "10k", "1.5m")] == [500, 10000, 1500000]
+
+
+def test_every_public_method_has_a_case():
+    assert models.untimed_methods() == []
+
+
+def test_run_times_every_case_and_leaves_the_catalogue_intact(tmp_path):
+    results = models.run([1000], data_dir=str(tmp_path), min_time=0, max_calls=1, import_runs=1,
+                         report=lambda line: None)
+    path = models.catalogue_path(str(tmp_path), 1000, generator.DEFAULT_SEED)
+
+    assert set(results["results"]["1000"]) == {case.name for case in models.CASES}
+    assert all(stats["calls"] == 1 for stats in results["results"]["1000"].values())
+    assert set(results["results"]["imports"]) == {f"import {module}" for module in imports.MODULES}
+    assert results["meta"]["sqlite"] == sqlite3.sqlite_version
+    assert len(rows(path)) == 1000
+
+
+def test_compare_flags_slowdowns_above_threshold_and_noise():
+    def run(**medians):
+        return {"results": {"1000": {case: {"median_ms": ms} for case, ms in medians.items()}}}
+
+    old = run(slower=10.0, tiny=0.01, faster=5.0, same=1.0, removed=1.0)
+    new = run(slower=14.0, tiny=0.05, faster=2.0, same=1.1, added=1.0)
+    changes = {change.case: change for change in compare.compare(old, new)}
+
+    assert set(changes) == {"slower", "tiny", "faster", "same"}
+    assert [case for case, change in changes.items() if change.regressed] == ["slower"]
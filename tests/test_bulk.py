@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_create_many_assigns_ids_and_registers(db):
+    authors = Author.create_many(["Author 1", ("Author 2",), {"name": "Author 3"}])
+    assert [a.name for a in authors] == ["Author 1", "Author 2", "Author 3"]
+    assert [a.author_id for a in authors] == [1, 2, 3]
+    assert all(Author.all[a.author_id] is a for a in authors)
+
+
+def test_create_many_streams_in_chunks(db):
+    magazine = Magazine.create("Magazine 1", "Category 1")
+    author = Author.create("Author 1")
+    rows = ((f"Article {i}", author.author_id, magazine.magazine_id) for i in range(2500))
+
+    articles = Article.create_many(rows, chunk_size=1000)
+
+    assert len(articles) == 2500
+    assert len({a.article_id for a in articles}) == 2500
+    for article in (articles[0], articles[1234], articles[-1]):
+        assert Article.find_by_id(article.article_id).title == article.title
+
+
+def test_create_many_can_return_only_a_count(db):
+    magazine = Magazine.create("Magazine 1", "Category 1")
+    rows = ((f"Article {i}", None, magazine.magazine_id) for i in range(2500))
+
+    assert Article.create_many(rows, chunk_size=1000, return_objects=False) == 2500
+    assert len(Article.all) == 0
+    assert len(magazine.articles()) == 2500
+
+
+def test_bulk_save_is_one_transaction(db):
+    magazines = [Magazine("Magazine 1", "Category 1"), Magazine(None, "Category 2")]
+    with pytest.raises(sqlite3.IntegrityError):
+        Magazine.bulk_save(magazines, chunk_size=1)
+    assert Magazine.get_all() == []
+    assert Magazine.all == {}
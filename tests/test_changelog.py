@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+
+from db import changelog
+from db.changelog import Change, ChangelogTruncated, Consumer
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_triggers_log_every_write_in_order(db):
+    author = Author.create("Ada")
+    magazine = Magazine.create("Wired", "Tech")
+    article = Article.create("Engines", author.author_id, magazine.magazine_id)
+    author.name = "Ada Lovelace"
+    author.update()
+    article_id = article.article_id
+    article.delete()
+
+    changes = changelog.changes_since(0)
+
+    pair = author.author_id << 32 | magazine.magazine_id
+    assert [(c.table, c.op, c.row_id) for c in changes] == [
+        ("authors", "insert", author.author_id),
+        ("magazines", "insert", magazine.magazine_id),
+        ("articles", "insert", article_id),
+        ("author_magazine_counts", "insert", pair),
+        ("authors", "update", author.author_id),
+        ("articles", "delete", article_id),
+        ("author_magazine_counts", "update", pair),
+        ("author_magazine_counts", "delete", pair),
+    ]
+    assert [c.seq for c in changes] == sorted(c.seq for c in changes)
+    assert changelog.latest_seq() == changes[-1].seq
+
+
+def test_changes_since_pages_and_filters(db):
+    Author.create_many(f"Author {i}" for i in range(5))
+    Magazine.create("Wired", "Tech")
+
+    first = changelog.changes_since(0, limit=2)
+    rest = changelog.changes_since(first[-1].seq)
+    assert len(first) == 2 and len(rest) == 4
+    assert [c.table for c in changelog.changes_since(0, tables=["magazines"])] == ["magazines"]
+
+
+def test_consumers_track_their_own_position(db):
+    Author.create("Before")
+    indexer = Consumer("indexer")
+    assert indexer.changes() == []
+
+    author = Author.create("After")
+    changes = indexer.changes()
+    assert changes == [Change(changes[0].seq, "authors", "insert", author.author_id)]
+
+    indexer.ack(changes[-1].seq)
+    assert Consumer("indexer").changes() == []
+    assert Consumer("indexer").position() == changes[-1].seq
+
+
+def test_compaction_keeps_what_consumers_still_need(db):
+    Author.create_many(f"Author {i}" for i in range(10))
+    slow, fast = Consumer("slow"), Consumer("fast")
+    Author.create_many(f"Later {i}" for i in range(10))
+    fast.ack(changelog.latest_seq())
+
+    assert changelog.compact() == 10
+    assert len(slow.changes()) == 10
+
+    slow.ack(slow.changes()[4].seq)
+    assert changelog.compact() == 5
+    assert changelog.compact(max_rows=2) == 3
+
+    with pytest.raises(ChangelogTruncated):
+        slow.changes()
+    with pytest.raises(ChangelogTruncated):
+        changelog.changes_since(0)
+
+    seq = changelog.latest_seq()
+    Author.create("Next")
+    changelog.compact(max_rows=0)
+    assert changelog.latest_seq() == seq + 1
+    assert changelog.changes_since(seq + 1) == []
+
+
+def test_tail_blocks_until_changes_arrive(db):
+    seen = []
+    writer = threading.Timer(0.05, lambda: Author.create_many(["Late", "Later"]))
+    writer.start()
+    for change in changelog.tail(poll_interval=0.01, timeout=1):
+        seen.append(change)
+        if len(seen) == 2:
+            break
+    writer.join()
+    assert [c.op for c in seen] == ["insert", "insert"]
+
+    assert list(changelog.tail(poll_interval=0.01, timeout=0.05)) == []
+
+
+def test_atail_follows_the_log(db):
+    async def follow():
+        seen = []
+        async def write():
+            await asyncio.sleep(0.05)
+            await Author.acreate("Async")
+        task = asyncio.create_task(write())
+        async for change in changelog.atail(poll_interval=0.01, timeout=1):
+            seen.append(change)
+            break
+        await task
+        return seen
+
+    [change] = asyncio.run(follow())
+    assert (change.table, change.op) == ("authors", "insert")
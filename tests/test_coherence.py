@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from db import changelog, coherence
+from db.coherence import Coherence
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def other(db, tmp_path, monkeypatch):
+    """A connection standing in for another process writing to the same file"""
+    monkeypatch.setattr(coherence, "_coherence", Coherence())
+    conn = sqlite3.connect(str(tmp_path / "articles.db"), isolation_level=None)
+    yield conn
+    coherence.set_staleness(None)
+    conn.close()
+
+
+def test_sync_applies_outside_updates_and_deletes(other):
+    kept = Author.create("Ada")
+    dropped = Author.create("Grace")
+    coherence.sync()
+
+    other.execute("UPDATE authors SET name = 'Ada Lovelace' WHERE author_id = ?", (kept.author_id,))
+    other.execute("DELETE FROM authors WHERE author_id = ?", (dropped.author_id,))
+
+    assert coherence.sync() == 2
+    assert kept.name == "Ada Lovelace"
+    assert Author.all.get(kept.author_id) is kept
+    assert Author.all.get(dropped.author_id) is None
+    assert coherence.stats()["refreshed"] == 1 and coherence.stats()["evicted"] == 1
+
+
+def test_nothing_is_read_when_data_version_is_unchanged(other):
+    Author.create("Ada")
+    coherence.sync()
+    Author.create("Grace")
+    seq = coherence.stats()["seq"]
+
+    #Commits on our own connection leave its data_version alone
+    assert coherence.sync() == 0
+    assert coherence.stats()["seq"] == seq
+
+
+def test_moved_articles_drop_prefetched_relations(other):
+    author = Author.create("Ada")
+    wired = Magazine.create("Wired", "Tech")
+    vogue = Magazine.create("Vogue", "Fashion")
+    article = Article.create("Engines", author.author_id, wired.magazine_id)
+    Author.get_all(prefetch=["magazines"])
+    assert author.magazines() == [wired]
+    coherence.sync()
+
+    other.execute("UPDATE articles SET magazine_id = ? WHERE article_id = ?", (vogue.magazine_id, article.article_id))
+    coherence.sync()
+
+    assert article.magazine_id == vogue.magazine_id
+    assert author._prefetched is None
+    assert author.magazines() == [vogue]
+
+
+def test_checks_wait_out_the_staleness_interval(other):
+    author = Author.create("Ada")
+    coherence.set_staleness(3600)
+    Magazine.get_all()
+
+    other.execute("UPDATE authors SET name = 'Ada Lovelace' WHERE author_id = ?", (author.author_id,))
+    Magazine.get_all()
+    assert author.name == "Ada"
+    assert coherence.stats()["checks"] == 1
+
+    coherence.set_staleness(0)
+    Magazine.get_all()
+    assert author.name == "Ada Lovelace"
+    assert coherence.stats()["checks"] == 2
+
+    coherence.set_staleness(None)
+    Magazine.get_all()
+    assert coherence.stats()["checks"] == 2
+
+
+def test_compacted_log_falls_back_to_rereading_the_cache(other):
+    author = Author.create("Ada")
+    coherence.sync()
+
+    other.execute("UPDATE authors SET name = 'Ada Lovelace' WHERE author_id = ?", (author.author_id,))
+    Author.create("Grace")
+    changelog.compact(max_rows=0)
+
+    assert coherence.sync() == 0
+    assert coherence.stats()["resyncs"] == 1
+    assert author.name == "Ada Lovelace"
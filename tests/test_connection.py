@@ -0,0 +1,183 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db.connection import (
+    ConnectionPool, PoolExhausted, configure, connection, execute, fetchone, get_provider, retry_busy,
+    set_provider, settings,
+)
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+
+
+def test_nested_calls_reuse_the_held_connection(db):
+    with connection() as outer:
+        with connection() as inner:
+            assert inner is outer
+
+
+def test_pool_is_bounded(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1, timeout=0.05)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait()
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    held.wait()
+    with pytest.raises(PoolExhausted):
+        with pool.connection():
+            pass
+    release.set()
+    worker.join()
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone()[0] == 1
+    pool.close()
+
+
+def test_models_work_from_worker_threads(db):
+    magazine = Magazine.create("Magazine 1", "Category 1")
+
+    def work(i):
+        author = Author.create(f"Author {i}")
+        author.add_article(magazine, f"Article {i}")
+        return [a.title for a in Author.find_by_id(author.author_id).articles()]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(work, range(40)))
+
+    assert results == [[f"Article {i}"] for i in range(40)]
+    assert len(magazine.articles()) == 40
+
+
+def test_profiles_are_applied_to_new_connections(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "bulk.db"), profile="bulk-load")
+    settings = pool.settings()
+    assert settings["profile"] == "bulk-load"
+    assert settings["journal_mode"] == "wal"
+    assert settings["synchronous"] == 0
+    assert settings["busy_timeout"] == 30000
+    assert settings["cache_size"] == -256000
+    pool.close()
+
+    custom = ConnectionPool(str(tmp_path / "custom.db"), profile={"busy_timeout": 0})
+    assert custom.settings()["busy_timeout"] == 0
+    custom.close()
+
+
+def test_unknown_profiles_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ConnectionPool(str(tmp_path / "x.db"), profile="turbo")
+    with pytest.raises(ValueError):
+        ConnectionPool(str(tmp_path / "x.db"), profile={"page_size": 4096})
+
+
+def test_settings_reports_the_active_provider(db):
+    assert settings()["journal_mode"] == "wal"
+    assert settings()["profile"] == "oltp"
+
+
+def test_readers_are_not_blocked_by_a_writer(db):
+    Author.create("Author 1")
+    with connection() as writer:
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO authors (name) VALUES ('Uncommitted')")
+
+        def read():
+            return [author.name for author in Author.get_all()]
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(read).result(timeout=5) == ["Author 1"]
+        writer.rollback()
+
+
+def test_busy_errors_are_retried_with_backoff(tmp_path, monkeypatch):
+    pool = ConnectionPool(str(tmp_path / "busy.db"), profile={"journal_mode": "wal", "busy_timeout": 0})
+    previous = set_provider(pool)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    try:
+        execute("CREATE TABLE t (x)")
+        blocker = sqlite3.connect(str(tmp_path / "busy.db"))
+        blocker.execute("BEGIN IMMEDIATE")
+
+        #Release the lock once the retry loop has backed off twice
+        def sleep(delay):
+            sleeps.append(delay)
+            if len(sleeps) == 2:
+                blocker.rollback()
+        monkeypatch.setattr(time, "sleep", sleep)
+
+        execute("INSERT INTO t VALUES (1)")
+        assert fetchone("SELECT COUNT(*) FROM t") == (1,)
+        assert len(sleeps) == 2 and sleeps[1] > sleeps[0] / 2
+
+        blocker.execute("BEGIN IMMEDIATE")
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            retry_busy(execute, "INSERT INTO t VALUES (2)", retries=0)
+        blocker.rollback()
+        blocker.close()
+    finally:
+        set_provider(previous)
+        pool.close()
+
+
+def test_other_errors_are_not_retried(db, monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda delay: pytest.fail("retried"))
+    with pytest.raises(sqlite3.OperationalError):
+        execute("INSERT INTO no_such_table VALUES (1)")
+
+
+def test_the_default_pool_is_opened_from_configuration(tmp_path, monkeypatch):
+    previous = set_provider(None)
+    try:
+        monkeypatch.setenv("ARTICLES_DB", str(tmp_path / "env.db"))
+        monkeypatch.setenv("ARTICLES_DB_PROFILE", "analytics")
+        assert settings()["database"] == str(tmp_path / "env.db")
+        assert settings()["profile"] == "analytics"
+
+        pool = get_provider()
+        configure(path=str(tmp_path / "explicit.db"))
+        assert pool._opened == []
+        assert settings()["database"] == str(tmp_path / "explicit.db")
+        assert settings()["profile"] == "analytics"
+
+        with pytest.raises(ValueError):
+            configure(profile="turbo")
+    finally:
+        configure()
+        set_provider(previous)
+
+
+def test_importing_the_models_is_lazy():
+    probe = (
+        "import sys, lib.models, db.connection; "
+        "print(db.connection._provider, sorted(m for m in sys.modules "
+        "if m.startswith(('lib.models.', 'asyncio', 'concurrent', 'logging'))))"
+    )
+    output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["None", "[]"]
+
+    probe = "import sys; from lib.models import Author; print('lib.models.article' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
+
+
+def test_connections_returned_after_close_are_closed(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "closing.db"), size=2)
+    with pool.connection() as conn:
+        pool.close()
+        conn.execute("SELECT 1")
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert "0/2 open" in repr(pool)
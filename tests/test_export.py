@@ -0,0 +1,108 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from db import export
+from db.changelog import ChangelogTruncated, compact
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    authors = Author.create_many(["Ada", "Grace"])
+    magazines = Magazine.create_many([("Wired", "Tech"), ("Vogue", "Fashion")])
+    articles = Article.create_many([
+        ("First", authors[0].author_id, magazines[0].magazine_id),
+        ("Second", authors[1].author_id, magazines[0].magazine_id),
+        ("Third", authors[0].author_id, magazines[1].magazine_id),
+    ])
+    return authors, magazines, articles
+
+
+def read_csv(path):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_full_csv_export_joins_names(catalogue, tmp_path):
+    path = tmp_path / "catalogue.csv"
+    result = export.export(path)
+
+    rows = read_csv(path)
+    assert result.rows == 3
+    assert [row["title"] for row in rows] == ["First", "Second", "Third"]
+    assert rows[1]["author_name"] == "Grace"
+    assert (rows[2]["magazine_name"], rows[2]["category"]) == ("Vogue", "Fashion")
+    assert result.watermark > 0
+    assert result.rows_per_second > 0
+
+
+def test_jsonl_export_to_gzip_file_and_stream(catalogue, tmp_path):
+    path = tmp_path / "catalogue.jsonl.gz"
+    export.export(path, "jsonl")
+    with gzip.open(path, "rt") as f:
+        records = [json.loads(line) for line in f]
+    assert list(records[0]) == list(export.COLUMNS)
+    assert records[0]["author_name"] == "Ada"
+
+    buffer = io.BytesIO()
+    export.export(buffer, "jsonl", compress=True)
+    lines = gzip.decompress(buffer.getvalue()).decode().splitlines()
+    assert [json.loads(line) for line in lines] == records
+
+
+def test_batches_and_progress(catalogue, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "PROGRESS_EVERY", 2)
+    calls = []
+    result = export.export(tmp_path / "out.csv", batch_size=1, progress=lambda rows, s: calls.append(rows))
+    assert result.rows == 3
+    assert calls == [2]
+
+
+def test_incremental_export_since_watermark(catalogue, tmp_path):
+    authors, magazines, articles = catalogue
+    watermark = export.export(tmp_path / "full.csv").watermark
+
+    nothing = export.export(tmp_path / "none.csv", since=watermark)
+    assert nothing.rows == 0 and nothing.watermark == watermark
+
+    articles[0].title = "First, revised"
+    articles[0].update()
+    authors[1].name = "Grace Hopper"
+    authors[1].update()
+    deleted_id = articles[2].article_id
+    articles[2].delete()
+
+    path = tmp_path / "changes.csv"
+    result = export.export(path, since=watermark)
+    rows = {row["article_id"]: row for row in read_csv(path)}
+    assert result.rows == 3
+    assert rows[str(articles[0].article_id)]["title"] == "First, revised"
+    assert rows[str(articles[1].article_id)]["author_name"] == "Grace Hopper"
+    assert rows[str(deleted_id)]["deleted"] == "1"
+    assert rows[str(deleted_id)]["title"] == ""
+
+    assert export.export(tmp_path / "again.csv", since=result.watermark).rows == 0
+
+
+def test_watermarks_older_than_the_compacted_log_are_refused(catalogue, tmp_path):
+    authors, _, _ = catalogue
+    watermark = export.export(tmp_path / "full.csv").watermark
+    authors[0].name = "Ada Lovelace"
+    authors[0].update()
+    compact(max_rows=0)
+
+    with pytest.raises(ChangelogTruncated):
+        export.export(tmp_path / "changes.csv", since=watermark)
+    assert export.export(tmp_path / "none.csv", since=export.export(tmp_path / "full.csv").watermark).rows == 0
+
+
+def test_unknown_format_is_rejected(catalogue, tmp_path):
+    with pytest.raises(ValueError):
+        export.export(tmp_path / "out.xml", "xml")
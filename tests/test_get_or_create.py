@@ -0,0 +1,95 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db.connection import fetchone
+from db.natural_keys import category_conflicts, duplicate_names, enforce_unique_names
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_get_or_create_returns_the_existing_author(db):
+    ada = Author.create("Ada")
+    assert Author.get_or_create("Ada") is ada
+    grace = Author.get_or_create("Grace")
+    assert grace.author_id and Author.find_by_id(grace.author_id) is grace
+    assert fetchone("SELECT COUNT(*) FROM authors")[0] == 2
+
+
+def test_get_or_create_many_keeps_order_and_repeats(db):
+    ada = Author.create("Ada")
+    authors = Author.get_or_create_many(["Grace", "Ada", "Hedy", "Grace"], chunk_size=2)
+    assert [author.name for author in authors] == ["Grace", "Ada", "Hedy", "Grace"]
+    assert authors[1] is ada and authors[0] is authors[3]
+    assert fetchone("SELECT COUNT(*) FROM authors")[0] == 3
+
+
+def test_magazine_get_or_create_keeps_the_category(db):
+    wired = Magazine.create("Wired", "Tech")
+    assert Magazine.get_or_create("Wired", "News") is wired
+    assert wired.category == "Tech"
+
+    magazines = Magazine.get_or_create_many([("Time", "News"), {"name": "Time", "category": "Politics"}])
+    assert magazines[0] is magazines[1] and magazines[0].category == "News"
+
+
+def test_upsert_moves_the_existing_magazine(db):
+    wired = Magazine.create("Wired", "Tech")
+    assert Magazine.upsert("Wired", "Culture") is wired
+    assert wired.category == "Culture"
+    assert fetchone("SELECT category FROM magazines WHERE magazine_id = ?", (wired.magazine_id,))[0] == "Culture"
+
+    magazines = Magazine.upsert_many([("Byte", "Tech"), ("Wired", "News"), ("Byte", "Retro")])
+    assert magazines[0] is magazines[2] and magazines[0].category == "Retro"
+    assert magazines[1] is wired and wired.category == "News"
+    assert fetchone("SELECT COUNT(*) FROM magazines")[0] == 2
+
+
+def test_duplicate_names_are_rejected(db):
+    Author.create("Ada")
+    Magazine.create("Wired", "Tech")
+    with pytest.raises(sqlite3.IntegrityError):
+        Author.create("Ada")
+    with pytest.raises(sqlite3.IntegrityError):
+        Magazine.create("Wired", "News")
+
+
+def test_concurrent_get_or_create_makes_one_row(db):
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        ids = set(pool.map(lambda _: Author.get_or_create("Ada").author_id, range(16)))
+    assert len(ids) == 1
+    assert fetchone("SELECT COUNT(*) FROM authors WHERE name = 'Ada'")[0] == 1
+
+
+def test_enforce_unique_names_merges_duplicates(db):
+    with db.connection() as conn:
+        conn.execute("DROP INDEX idx_authors_name")
+        conn.execute("CREATE INDEX idx_authors_name ON authors (name)")
+        conn.executemany("INSERT INTO authors (name) VALUES (?)", [("Ada",), ("Grace",), ("Ada",)])
+        conn.execute("INSERT INTO magazines (name, category) VALUES ('Wired', 'Tech')")
+        conn.executemany("INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, 1)",
+                         [("First", 1), ("Second", 3), ("Third", 2)])
+        conn.commit()
+    assert duplicate_names() == {"authors": 1, "magazines": 0}
+
+    assert enforce_unique_names() == {"authors": 1, "magazines": 0}
+    assert duplicate_names() == {"authors": 0, "magazines": 0}
+    assert [article.author_id for article in Article.get_all()] == [1, 1, 2]
+    assert fetchone("SELECT article_count FROM author_stats WHERE author_id = 1")[0] == 2
+    with pytest.raises(sqlite3.IntegrityError):
+        Author.create("Ada")
+
+
+def test_merging_magazines_reports_and_keeps_the_first_category(db):
+    with db.connection() as conn:
+        conn.execute("DROP INDEX idx_magazines_name")
+        conn.executemany("INSERT INTO magazines (name, category) VALUES (?, ?)",
+                         [("Wired", "Tech"), ("Vogue", "Fashion"), ("Wired", "Culture"), ("Vogue", "Fashion")])
+        conn.commit()
+    assert category_conflicts() == {"Wired": ["Tech", "Culture"]}
+
+    assert enforce_unique_names() == {"authors": 0, "magazines": 2}
+    assert category_conflicts() == {}
+    assert Magazine.find_by_name("Wired").category == "Tech"
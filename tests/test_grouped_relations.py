@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from db.instrument import max_queries
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    rng = random.Random(19)
+    authors = Author.create_many(f"Author {i}" for i in range(12))
+    magazines = Magazine.create_many((f"Magazine {i}", f"Category {i % 3}") for i in range(6))
+    Article.create_many(
+        (f"Article {i}", rng.choice(authors[:10]).author_id, rng.choice(magazines[:5]).magazine_id)
+        for i in range(120)
+    )
+    return authors, magazines
+
+
+def test_topic_areas_for_matches_topic_areas(catalogue):
+    authors, _ = catalogue
+    with max_queries(1):
+        topic_areas = Author.topic_areas_for()
+
+    assert topic_areas == {author.author_id: author.topic_areas() for author in authors}
+    assert topic_areas[authors[-1].author_id] == []
+
+
+def test_magazines_for_matches_magazines(catalogue):
+    authors, _ = catalogue
+    with max_queries(1):
+        magazines = Author.magazines_for()
+
+    assert magazines == {author.author_id: author.magazines() for author in authors}
+    for author in authors:
+        assert all(magazine is Magazine.all[magazine.magazine_id] for magazine in magazines[author.author_id])
+
+
+def test_contributors_for_matches_contributors(catalogue):
+    _, magazines = catalogue
+    with max_queries(2):
+        contributors = Magazine.contributors_for()
+        contributing = Magazine.contributors_for(min_articles=3)
+
+    assert contributors == {magazine.magazine_id: magazine.contributors() for magazine in magazines}
+    assert contributing == {magazine.magazine_id: magazine.contributing_authors() for magazine in magazines}
+    assert contributors[magazines[-1].magazine_id] == []
+
+
+def test_ids_restrict_the_mapping(catalogue):
+    authors, magazines = catalogue
+    ids = [authors[3].author_id, authors[-1].author_id, authors[3].author_id, 999]
+
+    assert Author.topic_areas_for(ids) == {
+        authors[3].author_id: authors[3].topic_areas(), authors[-1].author_id: [], 999: [],
+    }
+    assert list(Author.magazines_for(ids)) == [authors[3].author_id, authors[-1].author_id, 999]
+    assert Magazine.contributors_for([magazines[0].magazine_id], min_articles=2) == {
+        magazines[0].magazine_id: [
+            author for author in magazines[0].contributors()
+            if sum(article.magazine_id == magazines[0].magazine_id for article in author.articles()) >= 2
+        ],
+    }
+
+
+def test_bulk_variants_follow_moves_and_deletes(catalogue):
+    authors, magazines = catalogue
+    article = authors[0].articles()[0]
+    article.magazine_id = magazines[5].magazine_id
+    article.update()
+    for other in authors[1].articles():
+        other.delete()
+
+    assert Author.topic_areas_for() == {author.author_id: author.topic_areas() for author in authors}
+    assert Magazine.contributors_for() == {magazine.magazine_id: magazine.contributors() for magazine in magazines}
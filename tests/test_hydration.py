@@ -0,0 +1,26 @@
+import pytest
+
+from benchmarks import hydration
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.mark.parametrize("model, row", [
+    (Article, (1, "Article 1", 2, 3)),
+    (Author, (1, "Author 1")),
+    (Magazine, (1, "Magazine 1", "Category 1")),
+])
+def test_instances_are_slotted_and_hydrated_from_tuples(db, model, row):
+    instance = model.instance_from_db(row)
+
+    assert not hasattr(instance, "__dict__")
+    assert tuple(getattr(instance, column) for column in (model.id_column,) + model.columns) == row
+    assert model.instance_from_db(row) is instance
+
+
+def test_hydration_benchmark_runs():
+    results = hydration.main(["--rows", "1000"])
+    assert set(results) == {
+        "before (dict, sqlite3.Row)", "after (slots, tuple)", "after + weak identity map", "after + LRU identity map",
+    }
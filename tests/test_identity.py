@@ -0,0 +1,67 @@
+import gc
+
+from db.identity import IdentityMap, WeakIdentityMap, LRUIdentityMap, set_identity_map
+from lib.models.author import Author
+
+
+class Item:
+    pass
+
+
+def test_identity_map_counts_hits_and_misses():
+    identity_map = IdentityMap()
+    item = Item()
+    identity_map[1] = item
+
+    assert identity_map.get(1) is item
+    assert identity_map.get(2) is None
+    assert identity_map.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0, "collected": 0}
+
+
+def test_weak_identity_map_forgets_unreferenced_instances():
+    identity_map = WeakIdentityMap()
+    item = Item()
+    identity_map[1] = item
+    identity_map[2] = Item()
+    gc.collect()
+
+    assert dict(identity_map.items()) == {1: item}
+    assert identity_map.stats()["collected"] == 1
+
+
+def test_lru_identity_map_is_bounded_but_canonical():
+    identity_map = LRUIdentityMap(maxsize=2)
+    kept = Item()
+    identity_map[1] = kept
+    for key in range(2, 6):
+        identity_map[key] = Item()
+    gc.collect()
+
+    assert identity_map.evictions == 3
+    assert sorted(identity_map) == [1, 4, 5]
+    assert identity_map.get(1) is kept
+
+
+def test_models_use_configured_identity_map(db, monkeypatch):
+    #Restored by monkeypatch once the test finishes
+    monkeypatch.setattr(Author, "all", Author.all)
+    Author.create_many(f"Author {i}" for i in range(50))
+    set_identity_map(Author, LRUIdentityMap(maxsize=10))
+
+    authors = Author.get_all()
+    held = authors[0]
+    del authors
+    gc.collect()
+
+    #The ten most recent plus the one still referenced
+    assert len(Author.all) == 11
+    assert Author.find_by_id(held.author_id) is held
+
+
+def test_models_default_to_the_weak_identity_map(db):
+    assert type(Author.all) is WeakIdentityMap
+    held = Author.create_many(["Ada", "Grace"])[0]
+    gc.collect()
+
+    assert Author.find_by_name("Ada") is held
+    assert list(Author.all) == [held.author_id]
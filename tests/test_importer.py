@@ -0,0 +1,116 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from db import importer
+from db.export import export
+from db.stats import EXPECTED, drift
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+RECORDS = [
+    {"author": "Ada", "magazine": "Wired", "category": "Tech", "title": "Engines"},
+    {"author": "Grace", "magazine": "Wired", "category": "Tech", "title": "Compilers"},
+    {"author": "Ada", "magazine": "Vogue", "category": "Fashion", "title": "Looms"},
+    {"author": "Linus", "magazine": "Wired", "category": "", "title": "Kernels,\nand \"more\""},
+    {"author": "Grace", "magazine": "Vogue", "category": "Fashion", "title": "Bugs"},
+]
+
+
+def write_csv(path, records):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["author", "magazine", "category", "title"])
+        writer.writeheader()
+        writer.writerows(records)
+    return path
+
+
+def titles():
+    return sorted(article.title for article in Article.get_all())
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_csv_import_creates_each_name_once(db, tmp_path, workers):
+    Author.create("Ada")
+    path = write_csv(tmp_path / "feed.csv", RECORDS)
+
+    result = importer.import_file(path, workers=workers, batch_size=2, chunk_lines=1)
+
+    assert result.rows == len(RECORDS)
+    assert (result.authors_created, result.magazines_created) == (2, 2)
+    assert sorted(author.name for author in Author.get_all()) == ["Ada", "Grace", "Linus"]
+    assert titles() == sorted(record["title"] for record in RECORDS)
+    linus = Author.find_by_name("Linus")
+    assert Article.find_by_title("Kernels,\nand \"more\"").author_id == linus.author_id
+    assert drift() == {table: 0 for table in EXPECTED}
+
+
+def test_jsonl_gzip_import_reads_exported_columns(db, tmp_path):
+    importer.import_file(write_csv(tmp_path / "feed.csv", RECORDS), workers=0)
+    exported = tmp_path / "catalogue.jsonl.gz"
+    export(exported, "jsonl")
+
+    result = importer.import_file(exported, workers=0)
+
+    assert result.rows == len(RECORDS)
+    assert (result.authors_created, result.magazines_created) == (0, 0)
+    assert len(Article.get_all()) == 2 * len(RECORDS)
+
+
+def test_records_without_title_or_category_are_skipped(db, tmp_path):
+    path = tmp_path / "feed.jsonl"
+    with open(path, "w") as f:
+        for record in (
+            {"author": "Ada", "title": "No magazine"},
+            {"author": "Ada", "magazine": "Wired", "category": "Tech"},
+            {"author": "Ada", "magazine": "Nowhere", "title": "Unknown magazine"},
+        ):
+            f.write(json.dumps(record) + "\n")
+
+    result = importer.import_file(path, workers=0)
+
+    assert (result.rows, result.skipped) == (1, 2)
+    assert Article.find_by_title("No magazine").magazine_id is None
+    assert Magazine.find_by_name("Nowhere") is None
+
+
+def test_interrupted_import_resumes_after_last_commit(db, tmp_path, monkeypatch):
+    records = [{"author": f"Author {i % 7}", "magazine": f"Magazine {i % 3}", "category": "News",
+                "title": f"Article {i}"} for i in range(50)]
+    path = write_csv(tmp_path / "feed.csv", records)
+
+    write = importer.Importer.write
+    calls = []
+
+    def crash_on_third_batch(self, *args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return write(self, *args)
+
+    monkeypatch.setattr(importer.Importer, "write", crash_on_third_batch)
+    with pytest.raises(KeyboardInterrupt):
+        importer.import_file(path, workers=0, batch_size=10, chunk_lines=10)
+    assert len(Article.get_all()) == 20
+    monkeypatch.undo()
+
+    result = importer.import_file(path, workers=0, batch_size=10, chunk_lines=10)
+    assert result.resumed_at > 0
+    assert result.rows == 30
+    assert titles() == sorted(record["title"] for record in records)
+    assert len(Author.get_all()) == 7
+
+    assert importer.import_file(path, workers=0).rows == 0
+    assert importer.import_file(path, workers=0, restart=True).rows == 50
+
+
+def test_progress_is_reported_per_batch(db, tmp_path):
+    single_line = [record for record in RECORDS if "\n" not in record["title"]]
+    path = write_csv(tmp_path / "feed.csv", single_line * 5)
+    calls = []
+    importer.import_file(path, workers=0, batch_size=5, chunk_lines=5,
+                         progress=lambda rows, seconds: calls.append(rows))
+    assert calls == [5, 10, 15, 20]
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+import pytest
+
+from db import instrument
+from db.instrument import count_queries, max_queries, normalize
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    instrument.metrics.reset()
+    authors = Author.create_many(f"Author {i}" for i in range(3))
+    magazines = Magazine.create_many((f"Magazine {i}", "Category") for i in range(3))
+    Article.create_many(
+        (f"Article {a}-{m}", author.author_id, magazine.magazine_id)
+        for a, author in enumerate(authors)
+        for m, magazine in enumerate(magazines)
+    )
+    return authors, magazines
+
+
+def test_normalize_strips_literals_and_whitespace():
+    assert normalize("SELECT *\n   FROM t WHERE a = 'x''y' AND b = 42 AND c IN (?, ?, ?)") == (
+        "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (?...)"
+    )
+    assert normalize("SELECT col1 FROM t2 LIMIT 10") == "SELECT col1 FROM t2 LIMIT ?"
+
+
+def test_statements_are_charged_to_the_model_method(catalogue):
+    authors, _ = catalogue
+    with count_queries() as queries:
+        articles = authors[0].articles()
+        list(authors[0].iter_articles(batch_size=2))
+
+    assert [(query.method, query.rows) for query in queries] == [
+        ("Author.articles", len(articles)),
+        ("Author.iter_articles", len(articles)),
+    ]
+    assert queries.by_method() == {"Author.articles": 1, "Author.iter_articles": 1}
+    assert "Author.articles" in instrument.metrics.by_method()
+
+
+def test_writes_in_a_transaction_are_charged_to_the_caller(catalogue):
+    _, magazines = catalogue
+    with count_queries() as queries:
+        Author.add_with_articles("Author 9", [{"title": "T", "magazine_id": magazines[0].magazine_id}] * 3)
+
+    assert set(queries.by_method()) == {"Author.add_with_articles"}
+    insert = [query for query in queries if query.sql.startswith("INSERT INTO articles")]
+    assert insert[0].rows == 3
+
+
+def test_metrics_total_by_statement(catalogue):
+    authors, _ = catalogue
+    for author in authors:
+        author.topic_areas()
+
+    [stats] = [item for item in instrument.metrics.snapshot() if item["method"] == "Author.topic_areas"]
+    assert stats["count"] == 3
+    assert stats["rows"] == 3
+    assert stats["max_ms"] >= stats["mean_ms"] > 0
+
+
+def test_max_queries_catches_n_plus_one(catalogue):
+    with pytest.raises(AssertionError, match="expected at most 1 queries, ran 4"):
+        with max_queries(1):
+            for magazine in Magazine.get_all():
+                magazine.articles()
+
+    with max_queries(3):
+        for magazine in Magazine.get_all(prefetch=["articles", "authors"]):
+            magazine.articles()
+            magazine.authors()
+
+
+def test_async_queries_are_counted_in_the_awaiting_task(catalogue):
+    authors, _ = catalogue
+
+    async def main():
+        with count_queries() as queries:
+            await authors[0].aarticles()
+        return queries
+
+    assert asyncio.run(main()).by_method() == {"Author.articles": 1}
+
+
+def test_slow_queries_are_logged_with_their_plan(catalogue, caplog):
+    previous = instrument.set_slow_query_ms(0)
+    try:
+        with caplog.at_level(logging.WARNING, logger="db.queries"):
+            catalogue[1][0].articles()
+    finally:
+        instrument.set_slow_query_ms(previous)
+
+    [message] = [record.getMessage() for record in caplog.records]
+    assert message.startswith("slow query in Magazine.articles")
+    assert "SEARCH articles USING INDEX" in message
+
+
+def test_no_plan_is_taken_when_the_log_is_off(catalogue, monkeypatch):
+    monkeypatch.setattr(instrument, "plan", lambda *args: pytest.fail("planned a query nobody logs"))
+    monkeypatch.setattr(logging.getLogger("db.queries"), "disabled", True)
+    previous = instrument.set_slow_query_ms(0)
+    try:
+        catalogue[1][0].articles()
+    finally:
+        instrument.set_slow_query_ms(previous)
+
+
+def test_returned_rows_are_counted(catalogue):
+    with count_queries() as queries:
+        Author.create_many(["Author 3", "Author 4"])
+    #The batch insert changes two rows, and reading back the last id returns one
+    assert [query.rows for query in queries] == [2, 1]
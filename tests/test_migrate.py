@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from db.connection import configure, set_provider
+from db.importer import import_file
+from db.migrate import missing_tables, upgrade
+from db.natural_keys import missing_indexes
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    """A database with only the original three tables and no unique names, like the shipped articles.db"""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    with open("db/schema.sql") as f:
+        conn.executescript(f.read())
+    conn.execute("DROP INDEX idx_authors_name")
+    conn.execute("DROP INDEX idx_magazines_name")
+    conn.executemany("INSERT INTO authors (name) VALUES (?)", [("Ada",), ("Grace",)])
+    conn.execute("INSERT INTO magazines (name, category) VALUES ('Wired', 'Tech')")
+    conn.executemany("INSERT INTO articles (title, author_id, magazine_id) VALUES (?, ?, 1)",
+                     [("Engines of logic", 1), ("Compilers", 2), ("Notes on engines", 2)])
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+def test_upgrade_creates_and_fills_the_feature_tables(old_database):
+    _, conn = old_database
+    assert missing_tables(conn) == ["author_stats", "articles_fts", "changelog"]
+
+    assert upgrade(conn) == ["author_stats", "articles_fts", "changelog", "idx_authors_name", "idx_magazines_name"]
+    assert missing_tables(conn) == [] and missing_indexes(conn) == []
+    assert conn.execute("SELECT author_id, article_count FROM author_stats ORDER BY 1").fetchall() == [(1, 1), (2, 2)]
+    assert conn.execute("SELECT rowid FROM articles_fts WHERE articles_fts MATCH 'engines' ORDER BY 1").fetchall() == [(1,), (3,)]
+    assert upgrade(conn) == []
+
+
+def test_the_default_pool_upgrades_an_old_database(old_database, monkeypatch):
+    path, _ = old_database
+    previous = set_provider(None)
+    for model in (Author, Magazine, Article):
+        monkeypatch.setattr(model, "all", type(model.all)())
+    try:
+        configure(path=path)
+        assert Author.top_author().name == "Grace"
+        assert Magazine.article_counts() == [{"name": "Wired", "article_count": 3}]
+        assert [result.article.article_id for result in Article.search("engines")] == [1, 3]
+    finally:
+        configure()
+        set_provider(previous)
+
+
+
+def test_upgrade_merges_duplicate_names_before_building_the_unique_indexes(old_database, monkeypatch, tmp_path):
+    path, conn = old_database
+    conn.execute("INSERT INTO authors (name) VALUES ('Ada')")
+    conn.execute("INSERT INTO magazines (name, category) VALUES ('Wired', 'Culture')")
+    conn.execute("INSERT INTO articles (title, author_id, magazine_id) VALUES ('Analytical engines', 3, 2)")
+    conn.commit()
+    assert missing_indexes(conn) == ["authors", "magazines"]
+
+    previous = set_provider(None)
+    for model in (Author, Magazine, Article):
+        monkeypatch.setattr(model, "all", type(model.all)())
+    try:
+        configure(path=path)
+        assert [author.author_id for author in Author.get_all()] == [1, 2]
+        assert Author.find_by_id(1).articles()[-1].title == "Analytical engines"
+        assert Magazine.article_counts() == [{"name": "Wired", "article_count": 4}]
+
+        assert Author.get_or_create("Ada").author_id == 1
+        assert Magazine.upsert("Wired", "Tech").magazine_id == 1
+        source = tmp_path / "more.csv"
+        source.write_text("title,author,magazine\nDifference engines,Ada,Wired\nNew,Hedy,Wired\n")
+        result = import_file(str(source), workers=0)
+        assert result.rows == 2
+        assert [author.name for author in Author.get_all()] == ["Ada", "Grace", "Hedy"]
+    finally:
+        configure()
+        set_provider(previous)
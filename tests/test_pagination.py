@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+from db import pagination
+from db.query_plan import schema_connection, explain
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def articles(db):
+    author = Author.create("Author 1")
+    magazines = Magazine.create_many([("Magazine 1", "Category 1"), ("Magazine 2", "Category 2")])
+    #Repeated titles make sure ties are broken by article_id
+    Article.create_many(
+        (f"Title {i % 7}", author.author_id, magazines[i % 2].magazine_id) for i in range(45)
+    )
+    return author, magazines
+
+
+def walk(fetch, **kwargs):
+    items, token, pages = [], None, 0
+    while True:
+        page = fetch(after=token, limit=10, **kwargs)
+        items += page.items
+        pages += 1
+        token = page.next_token
+        if token is None:
+            return items, pages
+
+
+@pytest.mark.parametrize("order_by", ["article_id", "-article_id", "title", "-title"])
+def test_pages_cover_every_article_once_in_order(articles, order_by):
+    author, magazines = articles
+    expected = magazines[0].articles()
+    expected.sort(key=lambda a: (a.title, a.article_id) if "title" in order_by else a.article_id,
+                  reverse=order_by.startswith("-"))
+
+    items, pages = walk(magazines[0].articles_page, order_by=order_by)
+
+    assert items == expected
+    assert pages == 3
+
+
+def test_author_pages(articles):
+    Author.create_many(f"Author {i}" for i in range(2, 25))
+    items, _ = walk(Author.page, order_by="name")
+    assert [a.name for a in items] == sorted(a.name for a in Author.get_all())
+
+
+def test_tokens_are_checked(articles):
+    token = Article.page(limit=5).next_token
+    with pytest.raises(ValueError):
+        Article.page(after=token, order_by="title")
+    with pytest.raises(ValueError):
+        Article.page(after="not-a-token")
+    with pytest.raises(ValueError):
+        Article.page(order_by="author_id")
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_empty_pages_are_rejected(articles, limit):
+    with pytest.raises(ValueError, match="at least one row"):
+        Article.page(limit=limit)
+
+
+@pytest.mark.parametrize("filters", [(), ("author_id",), ("magazine_id",)])
+@pytest.mark.parametrize("order_by", ["article_id", "-article_id", "title", "-title"])
+def test_page_queries_seek_an_index(filters, order_by):
+    sql = pagination.page_sql("articles", "article_id", order_by, filters, after=True)
+    plan = explain(schema_connection(), sql)
+    assert all(detail.startswith("SEARCH") for detail in plan), plan
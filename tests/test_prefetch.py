@@ -0,0 +1,87 @@
+import pytest
+
+from db import prefetch
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+import lib.models.author
+import lib.models.magazine
+
+
+@pytest.fixture
+def catalogue(db):
+    authors = Author.create_many(f"Author {i}" for i in range(3))
+    magazines = Magazine.create_many((f"Magazine {i}", f"Category {i}") for i in range(4))
+    Article.create_many(
+        (f"Article {a}-{m}", author.author_id, magazine.magazine_id)
+        for a, author in enumerate(authors)
+        for m, magazine in enumerate(magazines[:3])
+        if a <= m
+    )
+    return authors, magazines
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    issued = []
+    fetchall = prefetch.fetchall
+
+    def counting_fetchall(sql, params=()):
+        issued.append(sql)
+        return fetchall(sql, params)
+
+    def no_query(*args):
+        raise AssertionError("relation was not prefetched")
+
+    monkeypatch.setattr(prefetch, "fetchall", counting_fetchall)
+    return issued, no_query
+
+
+def test_magazine_get_all_prefetches_relations(catalogue, queries, monkeypatch):
+    authors, magazines = catalogue
+    expected = {m.magazine_id: ({a.title for a in m.articles()}, {a.name for a in m.authors()}) for m in magazines}
+    issued, no_query = queries
+
+    loaded = Magazine.get_all(prefetch=["articles", "authors"])
+    monkeypatch.setattr(lib.models.magazine, "fetchall", no_query)
+
+    assert len(issued) == 2
+    assert {m.magazine_id: ({a.title for a in m.articles()}, {a.name for a in m.authors()}) for m in loaded} == expected
+    assert loaded[3].articles() == [] and loaded[3].contributors() == []
+
+
+def test_author_prefetch_is_chunked(catalogue, queries, monkeypatch):
+    authors, magazines = catalogue
+    expected = {a.author_id: {m.name for m in a.magazines()} for a in authors}
+    issued, no_query = queries
+    monkeypatch.setattr(prefetch, "MAX_IN_PARAMS", 2)
+
+    Author.prefetch_articles(authors)
+    Author.prefetch_magazines(authors)
+    monkeypatch.setattr(lib.models.author, "fetchall", no_query)
+
+    assert len(issued) == 4
+    assert {a.author_id: {m.name for m in a.magazines()} for a in authors} == expected
+    assert [len(a.articles()) for a in authors] == [3, 2, 1]
+
+
+def test_unknown_relation_is_rejected(db):
+    with pytest.raises(ValueError):
+        Author.get_all(prefetch=["reviews"])
+
+
+def test_prefetched_contributors_keep_the_query_order(db):
+    authors = Author.create_many(f"Author {i}" for i in range(4))
+    magazine = Magazine.create("Magazine", "Category")
+    #Written newest author first, so insertion order and author_id order differ
+    Article.create_many((f"Article {i}", author.author_id, magazine.magazine_id) for i, author in enumerate(reversed(authors)))
+    #Without the (magazine_id, author_id) index the join walks articles in rowid order
+    with db.connection() as conn:
+        conn.execute("DROP INDEX idx_articles_magazine_author")
+        conn.commit()
+
+    expected = magazine.contributors()
+    assert expected == authors
+    Magazine.prefetch([magazine], ["authors"])
+    assert magazine.contributors() == expected
+    assert magazine.authors() == expected
@@ -0,0 +1,20 @@
+from db import query_plan
+
+
+def test_model_statements_are_found():
+    locations = {statement.location for statement in query_plan.collect_statements()}
+    assert {"Author.articles", "Magazine.contributors", "Author.topic_areas", "Magazine.get_all_by_category"} <= locations
+
+
+def test_no_model_query_scans_a_large_table():
+    assert query_plan.check() == []
+
+
+def test_missing_index_is_reported():
+    conn = query_plan.schema_connection()
+    for index in ("idx_articles_author_magazine", "idx_articles_author", "idx_articles_author_title"):
+        conn.execute(f"DROP INDEX {index}")
+
+    problems = query_plan.check(conn)
+
+    assert any(problem.startswith("Author.articles ") and "full scan of articles" in problem for problem in problems)
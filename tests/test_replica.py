@@ -0,0 +1,99 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from db.connection import execute, fetchone, get_provider, iterate
+from db.replica import MemoryReplica, ReplicaReadOnly, stop_replica, use_replica
+from db.session import transaction
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def primary(db):
+    author = Author.create("Ada")
+    magazine = Magazine.create("Wired", "Tech")
+    Article.create("Engines", author.author_id, magazine.magazine_id)
+    yield db
+    stop_replica()
+
+
+def test_reads_come_from_the_copy_until_it_is_refreshed(primary):
+    replica = use_replica()
+    assert get_provider() is replica
+    assert replica.settings()["bytes"] > 0
+    with primary.connection() as conn:
+        conn.execute("INSERT INTO authors (name) VALUES ('Grace')")
+        conn.commit()
+
+    assert fetchone("SELECT COUNT(*) FROM authors")[0] == 1
+    replica.refresh()
+    assert fetchone("SELECT COUNT(*) FROM authors")[0] == 2
+    assert [author.name for author in Author.get_all()] == ["Ada", "Grace"]
+
+
+def test_forwarded_writes_reach_the_primary(primary):
+    replica = use_replica(writes="forward")
+    grace = Author.create("Grace")
+
+    with primary.connection() as conn:
+        assert conn.execute("SELECT name FROM authors WHERE author_id = ?", (grace.author_id,)).fetchone() == ("Grace",)
+    assert Author.find_by_id(grace.author_id) is None
+    replica.refresh()
+    assert Author.find_by_id(grace.author_id) is grace
+
+
+def test_transactions_read_their_own_writes_on_the_primary(primary):
+    use_replica(writes="forward")
+    with transaction() as session:
+        Author.create("Grace")
+        session.flush()
+        assert fetchone("SELECT COUNT(*) FROM authors")[0] == 2
+        execute("INSERT INTO authors (name) VALUES ('Hedy')")
+        assert fetchone("SELECT COUNT(*) FROM authors")[0] == 3
+
+    with primary.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 3
+
+
+def test_rejected_writes_raise(primary):
+    replica = use_replica(writes="reject")
+    with pytest.raises(ReplicaReadOnly):
+        Author.create("Grace")
+    #Statements run on a replica connection directly cannot write either
+    with replica.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM articles")
+    assert fetchone("SELECT COUNT(*) FROM articles")[0] == 1
+
+
+def test_refresh_swaps_copies_under_open_readers(primary):
+    replica = MemoryReplica(primary)
+    with replica.checkout() as conn:
+        with primary.connection() as writer:
+            writer.execute("INSERT INTO authors (name) VALUES ('Grace')")
+            writer.commit()
+        replica.refresh()
+        #The reader that started before the refresh keeps its copy
+        assert conn.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 1
+    with replica.checkout() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM authors").fetchone()[0] == 2
+    replica.close()
+
+
+def test_stale_copies_refresh_on_the_next_read(primary):
+    replica = use_replica(refresh_interval=0)
+    with primary.connection() as conn:
+        conn.execute("INSERT INTO authors (name) VALUES ('Grace')")
+        conn.commit()
+
+    with closing(iterate("SELECT name FROM authors ORDER BY author_id")) as rows:
+        assert list(rows) == [("Ada",), ("Grace",)]
+    assert replica.refreshes == 2
+
+
+def test_unknown_write_mode(primary):
+    with pytest.raises(ValueError, match="write mode"):
+        MemoryReplica(primary, writes="queue")
@@ -0,0 +1,104 @@
+import pytest
+
+from db.connection import execute
+from db.search import match_expression, rebuild_search, search_titles
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    a, b = Author.create_many(["Author A", "Author B"])
+    m1, m2 = Magazine.create_many([("Magazine 1", "Tech"), ("Magazine 2", "Food")])
+    Article.create_many([
+        ("Learning Python the hard way", a.author_id, m1.magazine_id),
+        ("Python python python", b.author_id, m1.magazine_id),
+        ("Machine learning at scale", a.author_id, m2.magazine_id),
+        ("Café culture in Nairobi", b.author_id, m2.magazine_id),
+    ])
+    return (a, b), (m1, m2)
+
+
+def titles(results):
+    return [result.article.title for result in results]
+
+
+def test_match_expression_quotes_every_word():
+    assert match_expression('python "learning') == 'title : ("python" AND "learning")'
+    assert match_expression("mach* OR NOT") == 'title : ("mach"* AND "OR" AND "NOT")'
+    assert match_expression("x", magazine_id=3, author_id="4") == (
+        'title : ("x") AND magazine_id : "3" AND author_id : "4"'
+    )
+    assert match_expression(" -- ") is None
+
+
+def test_results_are_ranked_and_highlighted(catalogue):
+    results = Article.search("python")
+    assert titles(results) == ["Python python python", "Learning Python the hard way"]
+    assert results[0].score > results[1].score
+    assert results[1].snippet == "Learning [Python] the hard way"
+    assert results[0].article is Article.find_by_id(results[0].article.article_id)
+
+
+def test_prefix_and_diacritics(catalogue):
+    assert sorted(titles(Article.search("learn*"))) == ["Learning Python the hard way", "Machine learning at scale"]
+    assert titles(Article.search("cafe")) == ["Café culture in Nairobi"]
+    assert Article.search("learn") == []
+    assert Article.search("!!") == []
+
+
+def test_filters_and_limit(catalogue):
+    (a, b), (m1, m2) = catalogue
+    assert titles(Article.search("learning", magazine_id=m2.magazine_id)) == ["Machine learning at scale"]
+    assert titles(Article.search("python", author_id=b.author_id)) == ["Python python python"]
+    assert Article.search("python", author_id=b.author_id, magazine_id=m2.magazine_id) == []
+    assert len(Article.search("learning", limit=1)) == 1
+
+
+def test_ids_only_match_as_filters(catalogue):
+    (a, b), (m1, m2) = catalogue
+    Article.create(f"Top {m2.magazine_id} recipes", a.author_id, m1.magazine_id)
+    assert titles(Article.search(str(m2.magazine_id))) == [f"Top {m2.magazine_id} recipes"]
+    assert titles(Article.search("recipes", magazine_id=m2.magazine_id)) == []
+
+
+def test_broad_queries_rank_the_newest_candidates(catalogue):
+    (a, b), (m1, m2) = catalogue
+    Article.create_many((f"Python note {i}", a.author_id, m1.magazine_id) for i in range(10))
+    newest = titles(search_titles(Article, "note", candidates=3))
+    assert sorted(newest) == ["Python note 7", "Python note 8", "Python note 9"]
+    assert len(search_titles(Article, "note", candidates=None)) == 10
+
+
+def test_by_default_older_better_matches_are_ranked_too(catalogue):
+    (a, b), (m1, m2) = catalogue
+    Article.create("Note", a.author_id, m1.magazine_id)
+    Article.create_many((f"A much longer python note number {i}", a.author_id, m1.magazine_id) for i in range(10))
+    assert titles(Article.search("note", limit=1)) == ["Note"]
+    assert titles(Article.search("note", limit=1, candidates=3)) != ["Note"]
+
+
+def test_index_follows_updates_and_deletes(catalogue):
+    article = Article.search("culture")[0].article
+    article.title = "Street food in Nairobi"
+    article.update()
+    assert Article.search("culture") == []
+    assert titles(Article.search("street")) == ["Street food in Nairobi"]
+
+    article.magazine_id = catalogue[1][0].magazine_id
+    article.update()
+    assert titles(Article.search("street", magazine_id=catalogue[1][0].magazine_id)) == ["Street food in Nairobi"]
+
+    article.delete()
+    assert Article.search("nairobi") == []
+    #Raises if the index no longer matches the articles table
+    execute("INSERT INTO articles_fts (articles_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_rebuild_indexes_existing_rows(catalogue):
+    execute("INSERT INTO articles_fts (articles_fts) VALUES ('delete-all')")
+    assert Article.search("python") == []
+
+    rebuild_search()
+    assert len(Article.search("python")) == 2
@@ -0,0 +1,75 @@
+import pytest
+
+from db.connection import fetchone
+from db.session import transaction, current_session
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_changes_are_deferred_until_commit(db):
+    with transaction() as session:
+        author = Author.create("Author 1")
+        assert author.author_id is None
+        assert session.new == [author]
+        assert fetchone("SELECT COUNT(*) FROM authors")[0] == 0
+
+    assert current_session() is None
+    assert author.author_id is not None
+    assert Author.all[author.author_id] is author
+    assert Author.find_by_id(author.author_id).name == "Author 1"
+
+
+def test_dirty_and_deleted_objects_are_flushed(db):
+    keep = Author.create("Author 1")
+    drop = Author.create("Author 2")
+
+    with transaction():
+        keep.name = "Renamed"
+        keep.update()
+        drop_id = drop.author_id
+        drop.delete()
+        assert drop_id not in Author.all
+
+    assert Author.find_by_id(keep.author_id).name == "Renamed"
+    assert Author.find_by_id(drop_id) is None
+
+
+def test_rollback_restores_identity_map(db):
+    keep = Author.create("Author 1")
+    drop = Author.create("Author 2")
+    drop_id = drop.author_id
+
+    with pytest.raises(RuntimeError):
+        with transaction() as session:
+            new = Author.create("Author 3")
+            keep.name = "Renamed"
+            keep.update()
+            drop.delete()
+            session.flush()
+            raise RuntimeError("boom")
+
+    assert new.author_id is None
+    assert keep.name == "Author 1"
+    assert drop.author_id == drop_id
+    assert Author.all == {keep.author_id: keep, drop_id: drop}
+    assert len(Author.get_all()) == 2
+
+
+def test_add_with_articles(db):
+    magazine = Magazine.create("Magazine 1", "Category 1")
+    data = [{"title": f"Article {i}", "magazine_id": magazine.magazine_id} for i in range(50)]
+
+    author = Author.add_with_articles("Author 1", data)
+
+    assert author.author_id is not None
+    assert len(author.articles()) == 50
+    assert all(a.author_id == author.author_id for a in Article.all.values())
+
+
+def test_add_with_articles_rolls_back_on_failure(db):
+    author = Author.add_with_articles("Author 1", [{"title": None, "magazine_id": 1}])
+
+    assert author is None
+    assert Author.get_all() == []
+    assert Author.all == {}
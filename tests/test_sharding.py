@@ -0,0 +1,214 @@
+import asyncio
+
+import pytest
+
+from db.connection import fetchone
+from db.export import export
+from db.importer import import_file
+from db.session import transaction
+from db.sharding import ShardSet, ShardingError, get_shards, stop_shards, use_shards
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    authors = Author.create_many([("Ada",), ("Grace",), ("Hedy",)])
+    magazines = Magazine.create_many([("Wired", "Tech"), ("Vogue", "Fashion"), ("Byte", "Tech"), ("Time", "News")])
+    Article.create_many(
+        (f"Article {i}", authors[i % 5 % 3].author_id, magazines[i % 4].magazine_id) for i in range(24)
+    )
+    return authors, magazines
+
+
+@pytest.fixture
+def sharded(catalogue, db, tmp_path):
+    paths = [str(tmp_path / f"shard{i}.db") for i in range(2)]
+    shards = use_shards(ShardSet.create(paths, partitions=4, primary=db))
+    yield shards
+    stop_shards()
+
+
+def shard_ids(shards, shard):
+    return {row[0] for row in shards.fan_out("SELECT article_id FROM articles", shards=[shard])}
+
+
+def test_existing_articles_are_moved_to_their_shards(sharded):
+    assert sharded.counts() == {0: 12, 1: 12}
+    assert fetchone("SELECT COUNT(*) FROM articles")[0] == 0
+    for shard in (0, 1):
+        magazine_ids = {row[0] for row in sharded.fan_out("SELECT magazine_id FROM articles", shards=[shard])}
+        assert {sharded.shard_of(magazine_id) for magazine_id in magazine_ids} == {shard}
+
+
+def test_writes_route_to_the_owning_shard(sharded, catalogue):
+    authors, magazines = catalogue
+    first = Article.create("New", authors[0].author_id, magazines[0].magazine_id)
+    second = Article.create("Newer", authors[0].author_id, magazines[1].magazine_id)
+
+    assert first.article_id > 24 and second.article_id == first.article_id + 1
+    assert first.article_id in shard_ids(sharded, sharded.shard_of(magazines[0].magazine_id))
+    assert second.article_id in shard_ids(sharded, sharded.shard_of(magazines[1].magazine_id))
+    assert Article.find_by_id(second.article_id) is second
+    assert len(Article.get_all()) == 26
+
+    saved = Article.create_many([("Bulk 1", None, magazines[2].magazine_id), ("Bulk 2", None, magazines[3].magazine_id)])
+    assert [article.article_id for article in saved] == [second.article_id + 1, second.article_id + 2]
+
+
+def test_updates_move_articles_between_shards(sharded, catalogue):
+    authors, magazines = catalogue
+    article = Article.create("Mover", authors[0].author_id, magazines[0].magazine_id)
+    source = sharded.shard_of(magazines[0].magazine_id)
+    target = sharded.shard_of(magazines[1].magazine_id)
+    assert source != target
+
+    article.magazine_id = magazines[1].magazine_id
+    article.update()
+    assert article.article_id in shard_ids(sharded, target)
+    assert article.article_id not in shard_ids(sharded, source)
+
+    article.title = "Renamed"
+    article.update()
+    article_id = article.article_id
+    article.delete()
+    assert sharded.find(article_id) is None
+    assert sum(sharded.counts().values()) == 24
+
+
+def test_cross_shard_reads_merge(db, catalogue, tmp_path):
+    authors, _ = catalogue
+    expected = (
+        {author.author_id: [a.article_id for a in author.articles()] for author in authors},
+        Author.top_author(),
+        Magazine.article_counts(),
+    )
+    paths = [str(tmp_path / f"shard{i}.db") for i in range(3)]
+    use_shards(ShardSet.create(paths, key="author_id", partitions=8, primary=db))
+    try:
+        assert {author.author_id: [a.article_id for a in author.articles()] for author in authors} == expected[0]
+        assert Author.top_author() is expected[1]
+        #A shallow first pass has to widen before it can be sure
+        assert get_shards().top_author_id(depth=1) == expected[1].author_id
+        assert Magazine.article_counts() == expected[2]
+    finally:
+        stop_shards()
+
+
+def ids(instances):
+    return [getattr(instance, instance.id_column) for instance in instances]
+
+
+def by_id(grouped):
+    return {key: ids(value) for key, value in grouped.items()}
+
+
+def relation_reads(authors, magazines):
+    """Everything the models read through articles, in comparable form"""
+    return {
+        "iter_all": ids(Article.iter_all(batch_size=5)),
+        "aiter_all": asyncio.run(_collect(Article.aiter_all(batch_size=5))),
+        "find_by_title": Article.find_by_title("Article 7").article_id,
+        "pages": [ids(Article.page(limit=5, order_by="-title").items),
+                  ids(Article.page(limit=5, author_id=authors[1].author_id).items),
+                  ids(magazines[2].articles_page(limit=2).items)],
+        "author articles": [ids(author.iter_articles(batch_size=2)) for author in authors],
+        "magazines": [ids(author.magazines()) for author in authors],
+        "iter magazines": [sorted(ids(author.iter_magazines())) for author in authors],
+        "magazines_for": by_id(Author.magazines_for()),
+        "topic_areas": [author.topic_areas() for author in authors],
+        "topic_areas_for": Author.topic_areas_for([authors[2].author_id, authors[0].author_id]),
+        "magazine articles": [sorted(ids(magazine.articles())) for magazine in magazines],
+        "iter articles": [ids(magazine.iter_articles(batch_size=2)) for magazine in magazines],
+        "titles": [sorted(magazine.article_titles()) for magazine in magazines],
+        "iter titles": [sorted(magazine.iter_article_titles(batch_size=2)) for magazine in magazines],
+        "contributors": [ids(magazine.contributors()) for magazine in magazines],
+        "authors": [ids(magazine.iter_authors()) for magazine in magazines],
+        "contributing": [ids(magazine.contributing_authors()) for magazine in magazines],
+        "contributors_for": by_id(Magazine.contributors_for(min_articles=3)),
+        "multiple authors": sorted(ids(Magazine.with_multiple_authors())),
+        "most articles": Magazine.most_articles_written().magazine_id,
+        "prefetched": [(ids(magazine.articles()), ids(magazine.authors()))
+                       for magazine in Magazine.get_all(prefetch=["articles", "authors"])],
+        "prefetched authors": [(ids(author.articles()), ids(author.magazines()))
+                               for author in Author.get_all(prefetch=["articles", "magazines"])],
+    }
+
+
+async def _collect(articles):
+    return [article.article_id async for article in articles]
+
+
+@pytest.mark.parametrize("key", ["magazine_id", "author_id"])
+def test_every_article_read_goes_through_the_shards(db, catalogue, tmp_path, key):
+    authors, magazines = catalogue
+    expected = relation_reads(authors, magazines)
+    paths = [str(tmp_path / f"shard{i}.db") for i in range(3)]
+    use_shards(ShardSet.create(paths, key=key, partitions=8, primary=db))
+    try:
+        assert relation_reads(authors, magazines) == expected
+    finally:
+        stop_shards()
+
+
+def test_reads_the_shards_cannot_answer_raise(sharded, tmp_path):
+    with pytest.raises(ShardingError):
+        Article.search("Article")
+    with pytest.raises(ShardingError):
+        export(tmp_path / "catalogue.csv")
+
+
+def test_writes_the_shards_cannot_join_raise(sharded, catalogue, tmp_path):
+    authors, magazines = catalogue
+    with pytest.raises(ShardingError):
+        with transaction():
+            Article.create("Queued", authors[0].author_id, magazines[0].magazine_id)
+    assert Author.add_with_articles("Radia", [{"title": "Spanning", "magazine_id": magazines[0].magazine_id}]) is None
+    assert fetchone("SELECT COUNT(*) FROM authors WHERE name = 'Radia'")[0] == 0
+
+    path = tmp_path / "catalogue.csv"
+    path.write_text("title,author,magazine\nImported,Ada,Wired\n")
+    with pytest.raises(ShardingError):
+        import_file(str(path), workers=0)
+    assert sharded.counts() == {0: 12, 1: 12}
+
+
+def test_reserving_ids_leaves_the_callers_transaction_open(sharded, catalogue, db):
+    authors, magazines = catalogue
+    with db.connection() as conn:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM authors").fetchone()
+        Article.create("Reserved", authors[0].author_id, magazines[0].magazine_id)
+        assert conn.in_transaction
+        conn.rollback()
+    assert sum(sharded.counts().values()) == 25
+
+
+def test_rebalance_spreads_partitions_onto_a_new_shard(sharded, tmp_path):
+    shard = sharded.add_shard(str(tmp_path / "shard2.db"))
+    assert sharded.counts()[shard] == 0
+
+    moves = sharded.rebalance()
+    assert moves and all(to == shard for _, _, to in moves)
+    counts = sharded.counts()
+    assert sum(counts.values()) == 24 and counts[shard] > 0
+    assert max(counts.values()) - min(counts.values()) < 12
+
+    #The layout is stored in the primary, so a fresh ShardSet sees the moves
+    reopened = ShardSet(sharded.primary)
+    assert reopened.owners == sharded.owners
+    assert sharded.rebalance(dry_run=True) == []
+    reopened.close()
+
+
+def test_a_layout_is_created_once(sharded, db, tmp_path):
+    with pytest.raises(ShardingError):
+        ShardSet.create([str(tmp_path / "again.db")], primary=db)
+    with pytest.raises(ValueError, match="shard key"):
+        ShardSet.create([str(tmp_path / "again.db")], key="title", primary=db)
+
+
+def test_a_primary_without_a_layout(db):
+    with pytest.raises(ShardingError):
+        ShardSet(db)
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from db import stats
+from db.connection import connection, execute, fetchall
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+@pytest.fixture
+def catalogue(db):
+    authors = Author.create_many(f"Author {i}" for i in range(4))
+    magazines = Magazine.create_many((f"Magazine {i}", f"Category {i}") for i in range(3))
+    return authors, magazines
+
+
+def assert_in_sync():
+    assert stats.drift() == {table: 0 for table in stats.EXPECTED}
+
+
+def test_triggers_follow_inserts_moves_and_deletes(catalogue):
+    authors, magazines = catalogue
+    rng = random.Random(11)
+    articles = Article.create_many(
+        (f"Article {i}", rng.choice(authors).author_id, rng.choice(magazines).magazine_id)
+        for i in range(60)
+    )
+    assert_in_sync()
+
+    for article in rng.sample(articles, 20):
+        article.author_id = rng.choice(authors).author_id
+        article.magazine_id = rng.choice(magazines).magazine_id if rng.random() > 0.2 else None
+        article.update()
+    assert_in_sync()
+
+    for article in rng.sample(articles, 30):
+        article.delete()
+    assert_in_sync()
+
+    execute("DELETE FROM articles")
+    assert fetchall("SELECT * FROM author_stats") == []
+    assert fetchall("SELECT * FROM magazine_stats") == []
+    assert fetchall("SELECT * FROM author_magazine_counts") == []
+
+
+def test_distinct_author_count_tracks_last_article(catalogue):
+    (a, b, *_), (magazine, *_) = catalogue
+    first = Article.create("One", a.author_id, magazine.magazine_id)
+    Article.create("Two", a.author_id, magazine.magazine_id)
+    third = Article.create("Three", b.author_id, magazine.magazine_id)
+    assert fetchall("SELECT article_count, author_count FROM magazine_stats") == [(3, 2)]
+
+    third.delete()
+    first.delete()
+    assert fetchall("SELECT article_count, author_count FROM magazine_stats") == [(1, 1)]
+
+
+def test_rebuild_repairs_drift(catalogue):
+    authors, magazines = catalogue
+    Article.create_many(
+        (f"Article {i}", authors[i % 4].author_id, magazines[i % 3].magazine_id)
+        for i in range(12)
+    )
+    with connection() as conn:
+        conn.execute("UPDATE author_stats SET article_count = 99")
+        conn.execute("DELETE FROM magazine_stats")
+        conn.execute("INSERT INTO author_magazine_counts VALUES (42, 42, 1)")
+        conn.commit()
+    assert stats.drift() == {"author_stats": 8, "magazine_stats": 3, "author_magazine_counts": 1}
+
+    stats.rebuild_stats()
+    assert_in_sync()
+
+
+def test_leaderboards_read_the_stats(catalogue):
+    (a, b, c, _), (m1, m2, m3) = catalogue
+    Article.create_many([
+        ("A1", a.author_id, m1.magazine_id),
+        ("B1", b.author_id, m1.magazine_id),
+        ("B2", b.author_id, m2.magazine_id),
+        ("B3", b.author_id, m1.magazine_id),
+        ("C1", c.author_id, m1.magazine_id),
+    ])
+
+    assert Author.top_author() is b
+    assert Magazine.most_articles_written() is m1
+    assert Magazine.with_multiple_authors() == [m1]
+    assert sorted(Magazine.article_counts(), key=lambda row: row["name"]) == [
+        {"name": "Magazine 0", "article_count": 4},
+        {"name": "Magazine 1", "article_count": 1},
+        {"name": "Magazine 2", "article_count": 0},
+    ]
+
+
+def test_leaderboards_are_empty_without_articles(catalogue):
+    assert Author.top_author() is None
+    assert Magazine.most_articles_written() is None
+    assert Magazine.with_multiple_authors() == []
@@ -0,0 +1,58 @@
+import gc
+from contextlib import closing
+
+from db.connection import ConnectionPool, set_provider
+from db.identity import LRUIdentityMap
+from lib.models.author import Author
+from lib.models.magazine import Magazine
+from lib.models.article import Article
+
+
+def test_iter_all_streams_in_batches(db, monkeypatch):
+    monkeypatch.setattr(Article, "all", LRUIdentityMap(maxsize=100))
+    author = Author.create("Author 1")
+    magazine = Magazine.create("Magazine 1", "Category 1")
+    Article.create_many((f"Article {i}", author.author_id, magazine.magazine_id) for i in range(2000))
+    gc.collect()
+
+    count = 0
+    for article in Article.iter_all(batch_size=64):
+        count += 1
+        assert len(Article.all) <= 101
+    assert count == 2000
+
+
+def test_relation_iterators_match_lists(db):
+    author = Author.create("Author 1")
+    magazines = Magazine.create_many([("Magazine 1", "Category 1"), ("Magazine 2", "Category 2")])
+    for magazine in reversed(magazines):
+        author.add_article(magazine, f"Article in {magazine.name}")
+    #Later authors write first, so insertion order is not id order
+    for other in reversed(Author.create_many(["Author 2", "Author 3"])):
+        other.add_article(magazines[0], f"Article by {other.name}")
+
+    assert list(author.iter_articles(batch_size=1)) == author.articles()
+    assert list(author.iter_magazines(batch_size=1)) == author.magazines()
+    assert list(magazines[0].iter_articles()) == magazines[0].articles()
+    assert list(magazines[0].iter_authors()) == magazines[0].authors()
+    assert list(magazines[0].iter_contributors()) == magazines[0].contributors()
+    assert list(magazines[0].iter_article_titles()) == magazines[0].article_titles()
+    assert [magazine.name for magazine in author.iter_magazines()] == ["Magazine 1", "Magazine 2"]
+    assert [row["name"] for row in Magazine.article_counts()] == ["Magazine 1", "Magazine 2"]
+
+
+def test_closing_an_iterator_returns_its_connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(Author, "all", LRUIdentityMap())
+    pool = ConnectionPool(str(tmp_path / "articles.db"), size=1, timeout=0.1)
+    with pool.connection() as conn:
+        with open("db/schema.sql") as f:
+            conn.executescript(f.read())
+    previous = set_provider(pool)
+    try:
+        Author.create_many(f"Author {i}" for i in range(10))
+        with closing(Author.iter_all(batch_size=2)) as authors:
+            next(authors)
+        assert Author.find_by_name("Author 9").name == "Author 9"
+    finally:
+        set_provider(previous)
+        pool.close()